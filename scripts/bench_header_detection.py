@@ -0,0 +1,209 @@
+"""
+Benchmark header-row detection against the previous row-by-row implementation.
+Checks both pick the same header on generated sheets, then times them.
+Usage: python scripts/bench_header_detection.py [--cols 300] [--repeat 5]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sheetpic import HEADER_KEYWORDS, _cell_type, _is_blank, _score_header_row  # noqa: E402
+
+
+# Previous implementation, kept verbatim as the reference.
+
+def legacy_row_signature(row):
+    """Return (n_filled, type_counts dict, values list)."""
+    vals = [v for v in row if not _is_blank(v)]
+    types = {'str': 0, 'num': 0, 'date': 0, 'url': 0}
+    for v in row:
+        t = _cell_type(v)
+        if t == 'blank':
+            continue
+        types[t] = types.get(t, 0) + 1
+    return len(vals), types, vals
+
+
+def legacy_score_header_row(df_raw, scan_rows=15):
+    """Score the first `scan_rows` rows of `df_raw` and return the best index.
+
+    `df_raw` is a pandas DataFrame loaded with header=None.
+    """
+    import math as _math
+    if df_raw is None or df_raw.empty:
+        return 0
+    n_total_rows = len(df_raw)
+    n_cols = df_raw.shape[1]
+    if n_cols == 0:
+        return 0
+
+    scan_rows = min(scan_rows, n_total_rows)
+    # Widest non-trivial row width across the whole sample → expected col count
+    row_widths = [legacy_row_signature(df_raw.iloc[i].tolist())[0] for i in range(n_total_rows)]
+    max_width = max(row_widths) if row_widths else 0
+    if max_width == 0:
+        return 0
+
+    # Most common width across data-region rows (skip first 3 to avoid title bias)
+    from collections import Counter
+    tail_widths = [w for w in row_widths[3:] if w > 0]
+    if tail_widths:
+        mode_width = Counter(tail_widths).most_common(1)[0][0]
+    else:
+        mode_width = max_width
+
+    expected_width = max(mode_width, int(max_width * 0.6))
+
+    best_idx = 0
+    best_score = -_math.inf
+
+    for idx in range(scan_rows):
+        row_vals = df_raw.iloc[idx].tolist()
+        n_filled, types, vals = legacy_row_signature(row_vals)
+        if n_filled == 0:
+            continue
+
+        # Fill ratio relative to expected width
+        fill_ratio = min(1.0, n_filled / expected_width) if expected_width else 0
+        # String purity
+        str_ratio = types['str'] / n_filled
+        # No URLs in headers
+        url_penalty = -0.5 if types['url'] > 0 else 0
+        # Numbers in a "header" row are suspicious — but tolerated up to ~30%
+        num_ratio = (types['num'] + types['date']) / n_filled
+
+        # Uniqueness (case-insensitive, stripped)
+        normalized = [str(v).strip().lower() for v in vals]
+        uniq_ratio = len(set(normalized)) / len(normalized) if normalized else 0
+
+        # Average label length — headers are short
+        avg_len = sum(len(str(v)) for v in vals) / len(vals)
+        # Penalize very long cells (likely descriptions/titles)
+        len_score = 1.0 if avg_len <= 12 else max(0.0, 1.0 - (avg_len - 12) / 30.0)
+
+        # Keyword match
+        kw_hits = 0
+        for v in vals:
+            if not isinstance(v, str):
+                continue
+            low = v.strip().lower()
+            if low in HEADER_KEYWORDS:
+                kw_hits += 1
+                continue
+            # Substring match for common Chinese keywords
+            for kw in HEADER_KEYWORDS:
+                if len(kw) >= 2 and kw in low:
+                    kw_hits += 1
+                    break
+        kw_score = min(1.0, kw_hits / max(1, n_filled))
+
+        # "Followed by data" — look at next 3 rows: should be ≥ as wide and
+        # contain MORE numbers/dates/URLs than this row (mixed types).
+        followed_score = 0.0
+        look = min(3, n_total_rows - idx - 1)
+        if look > 0:
+            wider_or_equal = 0
+            more_mixed = 0
+            for j in range(1, look + 1):
+                nf, tt, _ = legacy_row_signature(df_raw.iloc[idx + j].tolist())
+                if nf >= max(1, n_filled - 1):
+                    wider_or_equal += 1
+                # data rows typically have more non-string content than the header
+                if (tt['num'] + tt['date'] + tt['url']) > types['num'] + types['date'] + types['url']:
+                    more_mixed += 1
+            followed_score = (wider_or_equal / look) * 0.5 + (more_mixed / look) * 0.5
+        else:
+            # last row of the sheet can't be a header
+            followed_score = -1.0
+
+        # Sparse-row penalty (likely a merged title spanning few cells)
+        sparse_penalty = -0.6 if n_filled < max(2, expected_width * 0.5) else 0.0
+
+        score = (
+            fill_ratio * 2.0 +
+            str_ratio * 1.5 +
+            uniq_ratio * 1.5 +
+            len_score * 1.0 +
+            kw_score * 1.5 +
+            followed_score * 2.0 +
+            url_penalty +
+            sparse_penalty -
+            num_ratio * 1.2
+        )
+
+        # Tie-breaker: prefer the LATER row (titles come first)
+        if score > best_score + 1e-9 or (abs(score - best_score) <= 1e-9 and idx > best_idx):
+            best_score = score
+            best_idx = idx
+
+    return best_idx
+
+
+def make_sheet(rng, n_cols, n_rows=40):
+    """A supplier-style export: title rows, a header row, then mixed data."""
+    n_title = rng.randint(0, 4)
+    rows = []
+    for t in range(n_title):
+        rows.append([f"Export {t} - {rng.random():.4f}"] + [None] * (n_cols - 1))
+    words = sorted(HEADER_KEYWORDS) + ['Field', '字段', 'Value']
+    rows.append([f"{rng.choice(words)}{i}" if rng.random() < 0.9 else None for i in range(n_cols)])
+    for r in range(n_rows - len(rows)):
+        row = []
+        for c in range(n_cols):
+            kind = rng.random()
+            if kind < 0.15:
+                row.append(None)
+            elif kind < 0.45:
+                row.append(rng.randint(0, 10 ** 6))
+            elif kind < 0.55:
+                row.append(f"https://cdn.example.com/{r}/{c}.jpg")
+            elif kind < 0.6:
+                row.append(datetime.date(2024, 1, 1) + datetime.timedelta(days=r))
+            else:
+                row.append(f"item {rng.randint(0, 999)}")
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def best_time(fn, df, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(df)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=200, help="Random sheets checked for identical results")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for i in range(args.samples):
+        df = make_sheet(rng, rng.randint(1, 40), rng.randint(1, 40))
+        old, new = legacy_score_header_row(df), _score_header_row(df)
+        if old != new:
+            print(f"MISMATCH on sample {i}: legacy={old} new={new}")
+            return 1
+    print(f"{args.samples} random sheets: identical header rows")
+
+    for n_cols in (20, 100, args.cols):
+        df = make_sheet(rng, n_cols)
+        old = best_time(legacy_score_header_row, df, args.repeat)
+        new = best_time(_score_header_row, df, args.repeat)
+        print(f"40 x {n_cols:>4} cols: legacy {old * 1000:8.1f} ms   vectorized {new * 1000:7.1f} ms   "
+              f"({old / new:5.1f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
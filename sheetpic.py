@@ -4,13 +4,17 @@ SheetPic - 批量图片提取 & 嵌入 工具
   - 提取图片: 从Excel下载/导出嵌入图片
   - 嵌入图片: 将URL图片下载后嵌入Excel单元格
 """
-import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext, ttk
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, scrolledtext, ttk
+except ImportError:  # headless Python builds: only the command line is available
+    tk = filedialog = messagebox = scrolledtext = ttk = None
 import math
 import os
 import threading
 import platform
 import concurrent.futures
+import glob
 from io import BytesIO
 import webbrowser
 import datetime
@@ -21,6 +25,13 @@ import sys
 import time
 import subprocess
 import urllib.request
+import urllib.parse
+import hashlib
+import atexit
+import shutil
+import sqlite3
+import tempfile
+from collections import OrderedDict, deque
 
 
 class _LazyImport:
@@ -80,6 +91,41 @@ def XlImage(*args, **kwargs):
     return _XlImage(*args, **kwargs)
 
 
+def _shared_xl_image(ref, digest):
+    """XlImage of a file path or bytes whose media part is named by `digest`,
+    so identical pictures share one part."""
+    img = XlImage(BytesIO(ref) if isinstance(ref, bytes) else ref)
+    img._path = "/xl/media/image-" + digest[:20] + ".{1}"
+    return img
+
+
+def _save_workbook(wb, path):
+    """`wb.save(path)` that writes each distinct media part once.
+
+    Anchors of `_shared_xl_image` pictures with the same content all point at
+    one `xl/media` part; openpyxl's stock writer would store it per anchor.
+    """
+    from zipfile import ZipFile, ZIP_DEFLATED
+    from openpyxl.writer.excel import ExcelWriter
+
+    class _MediaDedupWriter(ExcelWriter):
+        def _write_images(self):
+            written = set()
+            for img in self._images:
+                part = img.path[1:]
+                if part not in written:
+                    written.add(part)
+                    self._archive.writestr(part, img._data())
+
+    archive = ZipFile(path, 'w', ZIP_DEFLATED, allowZip64=True)
+    try:
+        wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        _MediaDedupWriter(wb, archive).save()
+    except Exception:
+        archive.close()
+        raise
+
+
 def _resource_path(relative_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
     return os.path.join(base_path, relative_path)
@@ -156,17 +202,22 @@ LANG_MAP = {
         'lbl_img_bg': "图片背景",
         'opt_bg_white': "白底 JPG",
         'opt_bg_transparent': "保留透明 PNG",
+        'lbl_img_placement': "图片位置",
+        'opt_place_floating': "浮动图片",
+        'opt_place_cell': "嵌入单元格 (Excel)",
+        'opt_place_wps': "嵌入单元格 (WPS)",
         'chk_original': "插入原图 (不缩放)",
         'chk_write_original': "写入原文件 (保留格式)",
         'msg_no_url': "❌ 未检测到包含URL的列",
         'opt_url_library': "[URL库] 按SKU/ID匹配 ({} 条)",
-        'msg_url_lib_imported': "✅ URL库已导入: 新增/更新 {} 条，当前共 {} 条 ({})",
+        'msg_url_lib_imported': "✅ URL库已导入: 新增 {} 条，更新 {} 条，未变 {} 条，当前共 {} 条 ({})",
         'msg_url_lib_empty': "❌ URL库文件为空或未找到有效映射",
         'msg_url_lib_no_cols': "❌ URL库需要至少一列条码/SKU和一列图片URL",
         'msg_url_lib_cleared': "URL库已清空",
         'msg_url_lib_clear_confirm': "确定清空已保存的URL库吗？",
         'msg_use_url_library': "未检测到URL列，将使用URL库按SKU/ID匹配",
         'msg_url_lib_matches': "URL库匹配: {} / {}",
+        'msg_dup_urls': "重复URL: {} 行共用 {} 次下载",
         'msg_embed_done': "耗时: {:.1f}s\n嵌入成功: {}\n下载失败: {}\n输出文件: {}",
         'msg_dl_fail': "[下载失败]",
         'msg_dl_skip': "[无URL]",
@@ -179,6 +230,8 @@ LANG_MAP = {
         'log_embed_start': "开始嵌入图片处理...",
         'log_embed_save': "正在保存Excel文件...",
         'log_embed_format_fallback': "{} 不支持保留格式写入，已自动改为新建 .xlsx 输出。",
+        'log_cell_images_original': "写入原表时不支持嵌入单元格图片，已改为浮动图片。",
+        'log_embed_row_fail': "第 {} 行图片写入失败: {}",
         'msg_embed_error': "❌ 嵌入处理失败: {}",
         'embed_status_run': "嵌入: {}/{} (成功: {} | 失败: {})",
         # Shared
@@ -190,6 +243,7 @@ LANG_MAP = {
         'status_stop': "正在停止...",
         'log_ready': "已就绪。请加载含图片的表格文件。",
         'log_header': "✅ 锁定表头: 第 {} 行",
+        'log_reader_engine': "📖 读取引擎: {}",
         'log_stats': "📊 列分析: 列 {} 含 {} 条有效数据 (类型: {})",
         'msg_404': "❌ {}: [404] 链接失效/不存在",
         'msg_timeout': "⚠️ {}: [超时] 网络连接卡顿",
@@ -242,17 +296,22 @@ LANG_MAP = {
         'lbl_img_bg': "Image Background",
         'opt_bg_white': "White JPG",
         'opt_bg_transparent': "Preserve PNG alpha",
+        'lbl_img_placement': "Placement",
+        'opt_place_floating': "Floating",
+        'opt_place_cell': "In cell (Excel)",
+        'opt_place_wps': "In cell (WPS)",
         'chk_original': "Original Size (no resize)",
         'chk_write_original': "Write to original file (preserve format)",
         'msg_no_url': "❌ No URL column detected",
         'opt_url_library': "[URL Library] Match by SKU/ID ({} items)",
-        'msg_url_lib_imported': "✅ URL library imported: {} added/updated, {} total ({})",
+        'msg_url_lib_imported': "✅ URL library imported: {} new, {} updated, {} unchanged, {} total ({})",
         'msg_url_lib_empty': "❌ URL library file is empty or has no valid mappings",
         'msg_url_lib_no_cols': "❌ URL library needs one SKU/ID column and one image URL column",
         'msg_url_lib_cleared': "URL library cleared",
         'msg_url_lib_clear_confirm': "Clear the saved URL library?",
         'msg_use_url_library': "No URL column detected; using URL library by SKU/ID",
         'msg_url_lib_matches': "URL library matches: {} / {}",
+        'msg_dup_urls': "Duplicate URLs: {} rows share {} downloads",
         'msg_embed_done': "Time: {:.1f}s\nEmbedded: {}\nFailed: {}\nOutput: {}",
         'msg_dl_fail': "[Download Failed]",
         'msg_dl_skip': "[No URL]",
@@ -265,6 +324,8 @@ LANG_MAP = {
         'log_embed_start': "Starting image embedding...",
         'log_embed_save': "Saving Excel file...",
         'log_embed_format_fallback': "{} cannot be written with preserved formatting; creating a new .xlsx instead.",
+        'log_cell_images_original': "In-cell pictures are not supported when writing into the original; using floating pictures.",
+        'log_embed_row_fail': "Row {}: could not write the picture: {}",
         'msg_embed_error': "❌ Embed failed: {}",
         'embed_status_run': "Embed: {} / {} (OK: {} | Fail: {})",
         # Shared
@@ -276,6 +337,7 @@ LANG_MAP = {
         'status_stop': "Stopping...",
         'log_ready': "Ready. Load a table with images.",
         'log_header': "✅ Header at Row {}",
+        'log_reader_engine': "📖 Reader engine: {}",
         'log_stats': "📊 Col Stats: {} has {} valid items ({})",
         'msg_404': "❌ {}: [404] Not Found",
         'msg_timeout': "⚠️ {}: [Timeout] Connection failed",
@@ -308,6 +370,7 @@ URL_LIBRARY_CONFIG_KEY = "url_library"
 URL_LIBRARY_RECORDS_CONFIG_KEY = "url_library_records"
 URL_LIBRARY_FIELDS_CONFIG_KEY = "url_library_fields"
 URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY = "url_library_selected_fields"
+URL_LIBRARY_MATCH_SAMPLE_ROWS = 2000  # rows of each column scored before any full-column pass
 EXTRACT_TIMEOUT_RETRIES = 2
 URL_LIBRARY_CODE_KEYWORDS = (
     "条形码", "条码", "商品条码", "sku", "barcode", "bar code",
@@ -344,6 +407,44 @@ HEADER_KEYWORDS = {
 }
 
 
+class _KeywordMatcher:
+    """A keyword list compiled once into a set plus a single alternation regex.
+
+    `match(text)` is true when `text` equals a keyword or contains one that
+    is at least `min_len` characters long. Keywords are lowercased and, with
+    `compact`, stripped of spaces; callers pass text normalized the same way.
+    """
+
+    def __init__(self, keywords, min_len=1, compact=False):
+        keys = {k.lower().replace(" ", "") if compact else k.lower() for k in keywords}
+        self.keywords = frozenset(keys)
+        parts = sorted((k for k in keys if len(k) >= min_len), key=len, reverse=True)
+        self._re = re.compile('|'.join(map(re.escape, parts))) if parts else None
+
+    def contains(self, text):
+        return self._re is not None and self._re.search(text) is not None
+
+    def match(self, text):
+        return text in self.keywords or self.contains(text)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_HEADER_KEYWORD_MATCHER = _KeywordMatcher(HEADER_KEYWORDS, min_len=2)
+# "id" is matched separately: only names ending in it ("id", "商品id") count.
+_CODE_KEYWORD_MATCHER = _KeywordMatcher([k for k in URL_LIBRARY_CODE_KEYWORDS if k != "id"], compact=True)
+_SKU_EXCLUDE_MATCHER = _KeywordMatcher(SKU_COLUMN_EXCLUDE_KEYWORDS, compact=True)
+_SKU_HIGH_MATCHER = _KeywordMatcher(SKU_COLUMN_HIGH_PRIORITY_KEYWORDS, compact=True)
+_SKU_MEDIUM_MATCHER = _KeywordMatcher([k for k in SKU_COLUMN_MEDIUM_PRIORITY_KEYWORDS if k != "id"], compact=True)
+
+
+def _compact_column_name(col_name):
+    """Lowercased column name without whitespace; '' for blank/Unnamed columns."""
+    name = str(col_name).strip().lower()
+    if not name or name.startswith("unnamed"):
+        return ''
+    return _WHITESPACE_RE.sub("", name)
+
+
 def _is_blank(v):
     if v is None:
         return True
@@ -381,6 +482,67 @@ def _normalize_lookup_code(value):
     return text
 
 
+def _normalize_float_codes(values):
+    """`_normalize_lookup_code` for a float64 array."""
+    import numpy as np
+    out = np.full(values.shape, '', dtype=object)
+    integral = np.isfinite(values) & (np.floor(values) == values)
+    small = integral & (np.abs(values) < 2 ** 53)
+    out[small] = values[small].astype(np.int64).astype(str)
+    # NumPy prints float64 with the same shortest repr as Python's str(float)
+    fraction = ~np.isnan(values) & ~integral
+    out[fraction] = values[fraction].astype(str)
+    for i in np.flatnonzero(integral & ~small):
+        out[i] = _normalize_lookup_code(float(values[i]))
+    return out
+
+
+def _normalize_lookup_codes(series):
+    """Vectorized `_normalize_lookup_code` for a whole Series; returns an object array of str.
+
+    Numeric columns are converted with array operations and text with
+    pandas string methods; only values of unusual types fall back to the
+    scalar function.
+    """
+    import numpy as np
+    if series.dtype.kind == 'f':
+        return _normalize_float_codes(series.to_numpy(dtype=np.float64))
+    if series.dtype.kind in 'iu':
+        return series.to_numpy().astype(str).astype(object)
+
+    values = series.to_numpy(dtype=object)
+    out = np.full(values.shape, '', dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=False) == 'string':
+        kinds = np.zeros(len(values), dtype=np.int8)  # all str: no per-value check needed
+    else:
+        kinds = np.fromiter((0 if isinstance(v, str) else 1 if isinstance(v, float) else 2 for v in values),
+                            dtype=np.int8, count=len(values))
+    is_float = kinds == 1
+    if is_float.any():
+        out[is_float] = _normalize_float_codes(values[is_float].astype(np.float64))
+    other = kinds == 2
+    if other.any():
+        # dates, bools, ints in mixed columns: normalize each distinct value once
+        uniques = {}
+        out[other] = [uniques[v] if v in uniques else uniques.setdefault(v, _normalize_lookup_code(v))
+                      for v in values[other]]
+    is_str = kinds == 0
+    if is_str.any():
+        text = pd.Series(values[is_str], dtype=object).str.strip()
+        lengths = np.fromiter(map(len, text), dtype=np.int64, count=len(text))
+        # only 3- and 4-character values can spell nan/none
+        short = text[(lengths == 3) | (lengths == 4)]
+        text[short.index[short.str.lower().isin(('nan', 'none'))]] = ''
+        # "123.00" -> "123": strip the zeros, then the dot must close a run of digits
+        zeros = text[text.str.endswith('0')]
+        head = zeros.str.rstrip('0')
+        head = head[head.str.endswith('.')].str[:-1]
+        head = head[head.str.isdecimal()]
+        text[head.index] = head
+        out[is_str] = text.to_numpy(dtype=object)
+    return out
+
+
 def _extract_http_url(value):
     if _is_blank(value):
         return None
@@ -395,6 +557,23 @@ def _extract_http_url(value):
     return None
 
 
+def _extract_http_urls(series):
+    """Vectorized `_extract_http_url` for a whole Series; returns an object array of str/None."""
+    import numpy as np
+    values = series.to_numpy(dtype=object)
+    out = np.full(values.shape, None, dtype=object)
+    present = ~pd.isna(series.to_numpy())
+    if not present.any():
+        return out
+    text = pd.Series(values[present], dtype=object).astype(str).str.strip()
+    text = text.where(~text.str.lower().isin(('', 'nan', 'none')))
+    relative = text.str.startswith('//', na=False)
+    urls = text.str.extract(r'(https?://[^\s;]+)', flags=re.IGNORECASE, expand=False)
+    urls[relative] = 'https:' + text[relative]
+    out[present] = urls.astype(object).where(urls.notna(), None).to_numpy()
+    return out
+
+
 def _normalize_library_field_name(value):
     text = str(value).strip()
     if not text or text.startswith("Unnamed"):
@@ -419,6 +598,470 @@ def _json_safe_value(value):
     return str(value)
 
 
+def _json_safe_values(series):
+    """Vectorized `_json_safe_value` for a whole Series; returns a list."""
+    import numpy as np
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else ''
+    if kind in ('i', 'u', 'b'):
+        return series.tolist()
+    if kind == 'f':
+        return series.astype(object).where(series.notna(), '').tolist()
+    if pd.api.types.is_string_dtype(series.dtype) and series.dtype != object:
+        text = series.astype(object)
+        return text.where(series.notna() & (series.str.strip() != ''), '').tolist()
+    return [_json_safe_value(v) for v in series.tolist()]
+
+
+def _url_library_entries(df, code_col_indices, url_col_idx, field_columns):
+    """(codes, urls, records) of an import table in the order a merge applies them.
+
+    Rows without a URL are skipped; every distinct non-blank code of a row
+    maps to that row's URL and record ({field_name: value} over
+    `field_columns`, shared by the row's codes). Entries are listed row by
+    row, so later rows win when a code repeats, as with `dict.update`.
+    """
+    import numpy as np
+    if df.empty or not code_col_indices:
+        return [], [], []
+    urls = _extract_http_urls(df.iloc[:, url_col_idx])
+    has_url = pd.notna(urls)
+    codes = np.column_stack([_normalize_lookup_codes(df.iloc[:, i]) for i in code_col_indices])
+    valid = (codes != '') & has_url[:, None]
+    for j in range(1, codes.shape[1]):
+        for prev in range(j):
+            valid[:, j] &= codes[:, j] != codes[:, prev]
+    rows, cols = np.nonzero(valid)  # row-major, like the per-row loop it replaces
+
+    entry_rows = np.unique(rows)
+    if field_columns:
+        names = [name for _, name in field_columns]
+        subset = df.iloc[entry_rows, [idx for idx, _ in field_columns]]
+        columns = [_json_safe_values(subset.iloc[:, k]) for k in range(len(names))]
+        row_records = [dict(zip(names, values)) for values in zip(*columns)]
+    else:
+        row_records = [{} for _ in entry_rows]
+    position = np.searchsorted(entry_rows, rows)
+    return (
+        codes[rows, cols].tolist(),
+        urls[rows].tolist(),
+        [row_records[k] for k in position],
+    )
+
+
+CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".sheetpic_config")
+
+
+def _read_config(path=CONFIG_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return {}
+
+
+def _parse_url_library(raw):
+    """Clean a saved {code: url} mapping; drops blank codes and non-http values."""
+    if not isinstance(raw, dict):
+        return {}
+    library = {}
+    for code, url in raw.items():
+        key = _normalize_lookup_code(code)
+        clean_url = _extract_http_url(url)
+        if key and clean_url:
+            library[key] = clean_url
+    return library
+
+
+def _parse_url_library_records(raw):
+    """Clean saved {code: {field: value}} records."""
+    if not isinstance(raw, dict):
+        return {}
+    records = {}
+    for code, record in raw.items():
+        key = _normalize_lookup_code(code)
+        if not key or not isinstance(record, dict):
+            continue
+        clean_record = {}
+        for field, value in record.items():
+            field_name = _normalize_library_field_name(field)
+            if field_name:
+                clean_record[field_name] = _json_safe_value(value)
+        if clean_record:
+            records[key] = clean_record
+    return records
+
+
+URL_LIBRARY_PATH = os.path.join(os.path.expanduser("~"), ".sheetpic_url_library.db")
+
+
+class _UrlTable:
+    """Compact {code: url} mapping for the in-memory URL library.
+
+    Codes are UTF-8 encoded into one sorted fixed-width bytes array, so a
+    code's row is found by binary search rather than through a hash table of
+    Python strings. Codes longer than `CODE_WIDTH` bytes go to a small
+    dict instead, so one oversized code cannot widen every row. URLs live
+    in a string table (one bytes blob plus offsets) that each code points
+    into with an int32 id, and the codes of one catalog row share their
+    URL. Reads behave like the dict it replaces: `get`, `[]`, `in`, `len`,
+    iteration, `items` and `update`.
+    """
+
+    CODE_WIDTH = 32  # bytes; barcodes and SKUs are far shorter
+
+    def __init__(self, pairs=()):
+        import numpy as np
+        self._codes = np.zeros(0, dtype='S1')
+        self._url_ids = np.zeros(0, dtype=np.int32)
+        self._long = {}  # code -> url id, for codes the array cannot hold
+        self._blob = b''
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self.update(pairs)
+
+    @classmethod
+    def from_unique(cls, chunks):
+        """Table from chunks of (code, url) pairs whose codes are all distinct.
+
+        Each chunk is encoded straight into the arrays, so no mapping of the
+        whole library is built first. Chunks in UTF-8 byte order of code, as
+        SQLite's `ORDER BY code` yields them, need no sort at the end.
+        """
+        import numpy as np
+        table = cls()
+        url_ids, blob, lengths = {}, [], []
+        keys, ids = [], []
+        for chunk in chunks:
+            codes, urls = np.array(chunk, dtype=object).reshape(-1, 2).T
+            fresh = list(dict.fromkeys(url for url in urls if url not in url_ids))
+            url_ids.update(zip(fresh, range(len(url_ids), len(url_ids) + len(fresh))))
+            data = [url.encode('utf-8') for url in fresh]
+            blob.extend(data)
+            lengths.extend(map(len, data))
+            chunk_ids = np.fromiter(map(url_ids.__getitem__, urls), dtype=np.int32, count=len(urls))
+            encoded, fits = table._encode(codes)
+            keys.append(table._narrow(encoded[fits]))
+            ids.append(chunk_ids[fits])
+            for i in np.flatnonzero(~fits):
+                table._long[codes[i]] = int(chunk_ids[i])
+        if keys:
+            codes, ids = np.concatenate(keys), np.concatenate(ids)
+            if len(codes) > 1 and not (codes[1:] > codes[:-1]).all():
+                order = np.argsort(codes, kind='stable')
+                codes, ids = codes[order], ids[order]
+            table._codes, table._url_ids = codes, ids
+        table._blob = b''.join(blob)
+        table._offsets = np.concatenate([[0], np.cumsum(np.array(lengths, dtype=np.int64))]).astype(np.int64)
+        return table
+
+    def _encode(self, codes):
+        """Codes (str) as bytes one spare byte wide, and which of them the code array can hold."""
+        import numpy as np
+        import pandas as pd
+        values = np.asarray(codes, dtype=object)
+        width = self.CODE_WIDTH + 1  # the spare byte is non-zero only for over-width codes
+        try:
+            keys = values.astype(f'S{width}')
+        except UnicodeEncodeError:
+            keys = pd.Series(values, dtype=object).str.encode('utf-8').to_numpy().astype(f'S{width}')
+        fits = keys.view(np.uint8).reshape(len(keys), width)[:, -1] == 0
+        if '\0' in ''.join(values):
+            fits &= ~pd.Series(values, dtype=object).str.endswith('\0').to_numpy(dtype=bool)
+        return keys, fits
+
+    @staticmethod
+    def _narrow(keys):
+        """`keys` cast down to the width of their longest code."""
+        import numpy as np
+        used = np.flatnonzero(keys.view(np.uint8).reshape(len(keys), keys.itemsize).any(axis=0))
+        return keys.astype(f'S{used[-1] + 1 if len(used) else 1}')
+
+    def _fits(self, key):
+        # numpy drops trailing NUL bytes, so such codes would compare wrongly
+        return len(key) <= self.CODE_WIDTH and not key.endswith(b'\0')
+
+    def _rows(self, keys):
+        """Row of each encoded code in `keys` (all fitting), -1 where it is absent."""
+        import numpy as np
+        keys = np.asarray(keys, dtype=bytes)
+        if not len(self._codes) or not len(keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self._codes, keys), len(self._codes) - 1)
+        return np.where(self._codes[rows] == keys, rows, -1)
+
+    def _add_urls(self, urls):
+        import numpy as np
+        data = [url.encode('utf-8') for url in urls]
+        first = len(self._offsets) - 1
+        ends = self._offsets[-1] + np.cumsum(np.fromiter(map(len, data), dtype=np.int64, count=len(data)))
+        self._offsets = np.concatenate([self._offsets, ends])
+        self._blob += b''.join(data)
+        return {url: first + i for i, url in enumerate(urls)}
+
+    def _compact(self):
+        """Drop URLs no code points to once they make up most of the table."""
+        import numpy as np
+        used = np.unique(np.concatenate([self._url_ids, np.fromiter(self._long.values(), dtype=np.int32)]))
+        if len(self._offsets) - 1 <= 2 * len(used) + 1024:
+            return
+        offsets = self._offsets
+        self._blob = b''.join([self._blob[offsets[i]:offsets[i + 1]] for i in used.tolist()])
+        self._offsets = np.concatenate([[0], np.cumsum(offsets[used + 1] - offsets[used])])
+        self._url_ids = np.searchsorted(used, self._url_ids).astype(np.int32)
+        self._long = {code: int(np.searchsorted(used, i)) for code, i in self._long.items()}
+
+    def update(self, pairs):
+        """Set the url of each (code, url); later pairs win, as with dict.update."""
+        import numpy as np
+        latest = dict(pairs)
+        if not latest:
+            return
+        url_ids = self._add_urls(list(dict.fromkeys(latest.values())))
+        keys, ids = [], []
+        for code, url in latest.items():
+            key = code.encode('utf-8')
+            if self._fits(key):
+                keys.append(key)
+                ids.append(url_ids[url])
+            else:
+                self._long[code] = url_ids[url]
+        if keys:
+            keys = np.array(keys, dtype=bytes)
+            ids = np.array(ids, dtype=np.int32)
+            rows = self._rows(keys)
+            known = rows >= 0
+            self._url_ids[rows[known]] = ids[known]
+            if not known.all():
+                codes = np.concatenate([self._codes, keys[~known]])
+                ids = np.concatenate([self._url_ids, ids[~known]])
+                order = np.argsort(codes, kind='stable')
+                self._codes, self._url_ids = codes[order], ids[order]
+        self._compact()
+
+    def _url(self, i):
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+    def _url_id(self, code):
+        if not isinstance(code, str):
+            return None
+        key = code.encode('utf-8')
+        if not self._fits(key):
+            return self._long.get(code)
+        row = int(self._codes.searchsorted(key)) if len(self._codes) else 0
+        if row < len(self._codes) and self._codes[row] == key:
+            return self._url_ids[row]
+        return None
+
+    def get(self, code, default=None):
+        i = self._url_id(code)
+        return default if i is None else self._url(i)
+
+    def isin(self, codes):
+        """Boolean array: which of `codes` (str) are in the table."""
+        import numpy as np
+        values = np.asarray(codes, dtype=object)
+        keys, fits = self._encode(values)
+        found = np.zeros(len(keys), dtype=bool)
+        found[fits] = self._rows(keys[fits].astype(f'S{self.CODE_WIDTH}')) >= 0
+        for i in np.flatnonzero(~fits):
+            found[i] = values[i] in self._long
+        return found
+
+    def __getitem__(self, code):
+        url = self.get(code)
+        if url is None:
+            raise KeyError(code)
+        return url
+
+    def __contains__(self, code):
+        return self._url_id(code) is not None
+
+    def __len__(self):
+        return len(self._codes) + len(self._long)
+
+    def __iter__(self):
+        yield from (key.decode('utf-8') for key in self._codes.tolist())
+        yield from self._long
+
+    def items(self):
+        for row, key in enumerate(self._codes.tolist()):
+            yield key.decode('utf-8'), self._url(self._url_ids[row])
+        for code, i in self._long.items():
+            yield code, self._url(i)
+
+
+class _UrlLibraryStore:
+    """SQLite-backed URL library: {code: url} plus the imported record per code.
+
+    Codes are the primary key, so imports upsert only the rows they touch and
+    embed runs can fetch just the codes a sheet needs. Each entry keeps a
+    digest of its url and record (`_url_library_digest`) so re-imports can
+    skip unchanged codes. The library's field names and selected fields live
+    in a small `meta` table.
+    """
+
+    LOOKUP_BATCH = 500  # codes per query; below SQLite's bound-parameter limit
+    LOAD_BATCH = 20000  # rows per fetch when loading the whole library
+
+    def __init__(self, path=URL_LIBRARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (code TEXT PRIMARY KEY, url TEXT NOT NULL, "
+                         "record TEXT NOT NULL, digest TEXT NOT NULL DEFAULT '') WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            if 'digest' not in [row[1] for row in conn.execute("PRAGMA table_info(entries)")]:
+                conn.execute("ALTER TABLE entries ADD COLUMN digest TEXT NOT NULL DEFAULT ''")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def urls(self):
+        """The whole {code: url} mapping as a `_UrlTable`, streamed in code order."""
+        with self._lock:
+            cursor = self._connect().execute("SELECT code, url FROM entries ORDER BY code")
+            return _UrlTable.from_unique(iter(lambda: cursor.fetchmany(self.LOAD_BATCH), []))
+
+    def _select(self, columns, codes):
+        codes = list(dict.fromkeys(codes))
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(codes), self.LOOKUP_BATCH):
+                batch = codes[start:start + self.LOOKUP_BATCH]
+                yield from conn.execute(
+                    "SELECT code, %s FROM entries WHERE code IN (%s)" % (columns, ','.join('?' * len(batch))),
+                    batch,
+                ).fetchall()
+
+    def lookup(self, codes):
+        """{code: (url, record)} for those of `codes` that are in the library."""
+        return {code: (url, json.loads(record)) for code, url, record in self._select('url, record', codes)}
+
+    def digests(self, codes):
+        """{code: digest} for those of `codes` that are in the library."""
+        return dict(self._select('digest', codes))
+
+    def upsert(self, entries):
+        """Insert or replace (code, url, record) entries in one transaction."""
+        self.upsert_rows(_url_library_rows(entries))
+
+    def upsert_rows(self, rows):
+        """Insert or replace (code, url, record_json, digest) rows from `_url_library_rows`."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO entries (code, url, record, digest) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(code) DO UPDATE SET url = excluded.url, record = excluded.record, "
+                    "digest = excluded.digest",
+                    rows,
+                )
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM entries")
+                conn.execute("DELETE FROM meta")
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_meta(self, key, value):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False)))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class _UrlLibraryRecords:
+    """Read-only {code: record} view of a `_UrlLibraryStore`.
+
+    Records are read from the database when asked for, so the product
+    fields of a large library are never all in memory; `fetch` reads the
+    codes of one sheet in batched queries.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def fetch(self, codes):
+        return {code: record for code, (_, record) in self._store.lookup(codes).items()}
+
+    def get(self, code, default=None):
+        return self.fetch([code]).get(code, default)
+
+    def __getitem__(self, code):
+        record = self.get(code)
+        if record is None:
+            raise KeyError(code)
+        return record
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __len__(self):
+        return len(self._store)
+
+
+_URL_LIBRARY_JSON = json.JSONEncoder(ensure_ascii=False, sort_keys=True)
+
+
+def _url_library_digest(url, record_json):
+    """Content hash of a library entry from its url and `_URL_LIBRARY_JSON` record text."""
+    return hashlib.blake2b(f'{url}\0{record_json}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _url_library_rows(entries):
+    """(code, url, record_json, digest) rows for (code, url, record) entries.
+
+    The codes of one imported row share its record, which is encoded once.
+    """
+    encoded = {}  # id(record) -> (record, json); holding the record keeps its id unique
+    for code, url, record in entries:
+        cached = encoded.get(id(record))
+        if cached is None:
+            cached = encoded[id(record)] = (record, _URL_LIBRARY_JSON.encode(record))
+        yield code, url, cached[1], _url_library_digest(url, cached[1])
+
+
+def _open_url_library(path=URL_LIBRARY_PATH, config_path=CONFIG_PATH):
+    """Open the URL library store, moving a library still saved in the JSON config into it."""
+    store = _UrlLibraryStore(path)
+    cfg = _read_config(config_path)
+    keys = (URL_LIBRARY_CONFIG_KEY, URL_LIBRARY_RECORDS_CONFIG_KEY,
+            URL_LIBRARY_FIELDS_CONFIG_KEY, URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY)
+    if not any(key in cfg for key in keys):
+        return store
+    library = _parse_url_library(cfg.get(URL_LIBRARY_CONFIG_KEY, {}))
+    records = _parse_url_library_records(cfg.get(URL_LIBRARY_RECORDS_CONFIG_KEY, {}))
+    store.upsert((code, url, records.get(code, {})) for code, url in library.items())
+    for key in (URL_LIBRARY_FIELDS_CONFIG_KEY, URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY):
+        if key in cfg:
+            store.set_meta(key, cfg[key])
+    for key in keys:
+        cfg.pop(key, None)
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(cfg, f, ensure_ascii=False)
+    return store
+
+
 def _cell_type(v):
     """Classify a cell into one of: blank/str/num/date/url."""
     if _is_blank(v):
@@ -577,24 +1220,74 @@ def _extract_options_require_processing(options):
     )
 
 
-def _row_signature(row):
-    """Return (n_filled, type_counts dict, values list)."""
-    vals = [v for v in row if not _is_blank(v)]
-    types = {'str': 0, 'num': 0, 'date': 0, 'url': 0}
-    for v in row:
-        t = _cell_type(v)
-        if t == 'blank':
-            continue
-        types[t] = types.get(t, 0) + 1
-    return len(vals), types, vals
+_CELL_TYPE_CODES = {'blank': 0, 'str': 1, 'num': 2, 'date': 3, 'url': 4}
+# A string containing any other character can't pass float(s.replace(',', ''))
+_NOT_FLOAT_RE = r'[^\d\s,+\-._eEinftyaINFTYA]'
+
+
+def _cell_type_codes(cells):
+    """`_cell_type` of every cell of an object array, as _CELL_TYPE_CODES int8 codes.
+
+    Cells are grouped by Python type so numbers, dates and blanks are
+    classified with array operations; strings go through pandas' vectorized
+    string methods, and only the few that could still be exotic floats
+    ("1_000", "inf") are tried with float().
+    """
+    import datetime as _dt
+    import numpy as np
+    flat = cells.ravel()
+    codes = np.full(flat.shape, _CELL_TYPE_CODES['str'], dtype=np.int8)
+    kind_ids = {}
+    ids = np.fromiter((kind_ids.setdefault(k, len(kind_ids)) for k in map(type, flat)),
+                      dtype=np.intp, count=flat.size)
+    for kind, kind_id in kind_ids.items():
+        mask = ids == kind_id
+        if kind is type(None):
+            codes[mask] = _CELL_TYPE_CODES['blank']
+        elif issubclass(kind, float):
+            codes[mask] = np.where(np.isnan(flat[mask].astype(float)),
+                                   _CELL_TYPE_CODES['blank'], _CELL_TYPE_CODES['num'])
+        elif issubclass(kind, int):
+            codes[mask] = _CELL_TYPE_CODES['num']
+        elif issubclass(kind, (_dt.datetime, _dt.date)):
+            codes[mask] = _CELL_TYPE_CODES['date']
+        elif issubclass(kind, str):
+            idx = np.flatnonzero(mask)
+            text = pd.Series(flat[idx], dtype=object).str.strip()
+            lowered = text.str.lower()
+            is_blank = (text == '').to_numpy()
+            is_url = lowered.str.startswith(('http://', 'https://', '//')).to_numpy()
+            maybe_num = ~(is_blank | is_url) & ~text.str.contains(_NOT_FLOAT_RE, regex=True).to_numpy()
+            is_num = np.zeros(len(idx), dtype=bool)
+            for i in np.flatnonzero(maybe_num):
+                try:
+                    float(text.iat[i].replace(',', ''))
+                    is_num[i] = True
+                except ValueError:
+                    pass
+            sub = np.full(len(idx), _CELL_TYPE_CODES['str'], dtype=np.int8)
+            sub[is_num] = _CELL_TYPE_CODES['num']
+            sub[is_url] = _CELL_TYPE_CODES['url']
+            sub[is_blank] = _CELL_TYPE_CODES['blank']
+            codes[idx] = sub
+    return codes.reshape(cells.shape)
+
+
+def _header_keyword_hit(v):
+    """True when a string cell is, or contains (2+ chars), a HEADER_KEYWORDS entry."""
+    return _HEADER_KEYWORD_MATCHER.match(v.strip().lower())
 
 
 def _score_header_row(df_raw, scan_rows=15):
     """Score the first `scan_rows` rows of `df_raw` and return the best index.
 
-    `df_raw` is a pandas DataFrame loaded with header=None.
+    `df_raw` is a pandas DataFrame loaded with header=None. Every cell is
+    classified once into a type matrix; widths, type ratios and the
+    look-ahead "followed by data" signal are then computed with NumPy for
+    all candidate rows at once.
     """
-    import math as _math
+    import numpy as np
+    from collections import Counter
     if df_raw is None or df_raw.empty:
         return 0
     n_total_rows = len(df_raw)
@@ -603,15 +1296,17 @@ def _score_header_row(df_raw, scan_rows=15):
         return 0
 
     scan_rows = min(scan_rows, n_total_rows)
+    cells = df_raw.to_numpy(dtype=object)
+    codes = _cell_type_codes(cells)
+    filled = codes != 0
     # Widest non-trivial row width across the whole sample → expected col count
-    row_widths = [_row_signature(df_raw.iloc[i].tolist())[0] for i in range(n_total_rows)]
-    max_width = max(row_widths) if row_widths else 0
+    row_widths = filled.sum(axis=1)
+    max_width = int(row_widths.max())
     if max_width == 0:
         return 0
 
     # Most common width across data-region rows (skip first 3 to avoid title bias)
-    from collections import Counter
-    tail_widths = [w for w in row_widths[3:] if w > 0]
+    tail_widths = [int(w) for w in row_widths[3:] if w > 0]
     if tail_widths:
         mode_width = Counter(tail_widths).most_common(1)[0][0]
     else:
@@ -619,70 +1314,61 @@ def _score_header_row(df_raw, scan_rows=15):
 
     expected_width = max(mode_width, int(max_width * 0.6))
 
+    n_str = (codes == 1).sum(axis=1)
+    n_url = (codes == 4).sum(axis=1)
+    n_num_date = ((codes == 2) | (codes == 3)).sum(axis=1)
+    n_mixed = n_num_date + n_url
+
+    # "Followed by data" — next 3 rows should be ≥ as wide and contain MORE
+    # numbers/dates/URLs than the candidate (mixed types).
+    cand = np.arange(scan_rows)
+    n_filled = row_widths[:scan_rows]
+    look = np.minimum(3, n_total_rows - cand - 1)
+    wider_or_equal = np.zeros(scan_rows)
+    more_mixed = np.zeros(scan_rows)
+    for j in range(1, 4):
+        nxt = np.minimum(cand + j, n_total_rows - 1)
+        valid = j <= look
+        wider_or_equal += valid & (row_widths[nxt] >= np.maximum(1, n_filled - 1))
+        # data rows typically have more non-string content than the header
+        more_mixed += valid & (n_mixed[nxt] > n_mixed[:scan_rows])
+    safe_look = np.maximum(look, 1)
+    # last row of the sheet can't be a header
+    followed_score = np.where(look > 0, (wider_or_equal / safe_look) * 0.5 + (more_mixed / safe_look) * 0.5, -1.0)
+
     best_idx = 0
-    best_score = -_math.inf
+    best_score = -math.inf
 
     for idx in range(scan_rows):
-        row_vals = df_raw.iloc[idx].tolist()
-        n_filled, types, vals = _row_signature(row_vals)
-        if n_filled == 0:
+        n = int(n_filled[idx])
+        if n == 0:
             continue
+        vals = cells[idx][filled[idx]]
 
         # Fill ratio relative to expected width
-        fill_ratio = min(1.0, n_filled / expected_width) if expected_width else 0
+        fill_ratio = min(1.0, n / expected_width) if expected_width else 0
         # String purity
-        str_ratio = types['str'] / n_filled
+        str_ratio = int(n_str[idx]) / n
         # No URLs in headers
-        url_penalty = -0.5 if types['url'] > 0 else 0
+        url_penalty = -0.5 if n_url[idx] > 0 else 0
         # Numbers in a "header" row are suspicious — but tolerated up to ~30%
-        num_ratio = (types['num'] + types['date']) / n_filled
+        num_ratio = int(n_num_date[idx]) / n
 
         # Uniqueness (case-insensitive, stripped)
-        normalized = [str(v).strip().lower() for v in vals]
-        uniq_ratio = len(set(normalized)) / len(normalized) if normalized else 0
+        texts = [str(v) for v in vals]
+        uniq_ratio = len({t.strip().lower() for t in texts}) / n
 
         # Average label length — headers are short
-        avg_len = sum(len(str(v)) for v in vals) / len(vals)
+        avg_len = sum(len(t) for t in texts) / n
         # Penalize very long cells (likely descriptions/titles)
         len_score = 1.0 if avg_len <= 12 else max(0.0, 1.0 - (avg_len - 12) / 30.0)
 
         # Keyword match
-        kw_hits = 0
-        for v in vals:
-            if not isinstance(v, str):
-                continue
-            low = v.strip().lower()
-            if low in HEADER_KEYWORDS:
-                kw_hits += 1
-                continue
-            # Substring match for common Chinese keywords
-            for kw in HEADER_KEYWORDS:
-                if len(kw) >= 2 and kw in low:
-                    kw_hits += 1
-                    break
-        kw_score = min(1.0, kw_hits / max(1, n_filled))
-
-        # "Followed by data" — look at next 3 rows: should be ≥ as wide and
-        # contain MORE numbers/dates/URLs than this row (mixed types).
-        followed_score = 0.0
-        look = min(3, n_total_rows - idx - 1)
-        if look > 0:
-            wider_or_equal = 0
-            more_mixed = 0
-            for j in range(1, look + 1):
-                nf, tt, _ = _row_signature(df_raw.iloc[idx + j].tolist())
-                if nf >= max(1, n_filled - 1):
-                    wider_or_equal += 1
-                # data rows typically have more non-string content than the header
-                if (tt['num'] + tt['date'] + tt['url']) > types['num'] + types['date'] + types['url']:
-                    more_mixed += 1
-            followed_score = (wider_or_equal / look) * 0.5 + (more_mixed / look) * 0.5
-        else:
-            # last row of the sheet can't be a header
-            followed_score = -1.0
+        kw_hits = sum(1 for v in vals if isinstance(v, str) and _header_keyword_hit(v))
+        kw_score = min(1.0, kw_hits / max(1, n))
 
         # Sparse-row penalty (likely a merged title spanning few cells)
-        sparse_penalty = -0.6 if n_filled < max(2, expected_width * 0.5) else 0.0
+        sparse_penalty = -0.6 if n < max(2, expected_width * 0.5) else 0.0
 
         score = (
             fill_ratio * 2.0 +
@@ -690,7 +1376,7 @@ def _score_header_row(df_raw, scan_rows=15):
             uniq_ratio * 1.5 +
             len_score * 1.0 +
             kw_score * 1.5 +
-            followed_score * 2.0 +
+            float(followed_score[idx]) * 2.0 +
             url_penalty +
             sparse_penalty -
             num_ratio * 1.2
@@ -704,196 +1390,2765 @@ def _score_header_row(df_raw, scan_rows=15):
     return best_idx
 
 
-class SheetPicApp:
-    def __init__(self, root):
-        self.root = root
-        self.setup_lang()
-        self.root.title(f"{self.T['title']}  v{APP_VERSION}")
-        self.root.configure(bg=COLORS['bg'])
-        if platform.system() == "Darwin":
-            self.root.geometry("620x750")
-            self.root.minsize(620, 750)
-        else:
-            self.root.geometry("600x730")
-            self.root.minsize(600, 730)
+def _find_header_row(file_path, sheet_name=0):
+    """Locate the header row in an Excel sheet.
 
-        self.default_dir = os.path.join(os.path.expanduser("~"), "Desktop")
-        self.file_path = None
-        self.df = None
-        self.wb = None
-        self.ws = None
-        self.header_row = 0
-        self.is_running = False
-        self.sheet_names = []
-        self._ui_thread = threading.current_thread()
+    Strategy: score the first ~15 rows on multiple signals and pick the
+    best. A real header row is characterized by:
+      - High fill ratio (close to the widest row in the sheet)
+      - Mostly string cells with short labels
+      - Unique non-null values (no duplicate column names)
+      - Followed by data rows of comparable width but with mixed types
+        (numbers / dates / mixed strings)
+      - Bonus when cells contain common header keywords
+      - Penalty when the row is sparse (likely a merged title)
+    """
+    try:
+        if os.path.splitext(file_path)[1].lower() == '.csv':
+            return 0
+        df_raw = pd.read_excel(file_path, header=None, nrows=40, sheet_name=sheet_name)
+        return _score_header_row(df_raw)
+    except Exception:
+        return 0
 
-        # Extract state
-        self.sorted_img_cols = []
-        self.var_extract_bg = None
-        self.var_extract_shape = None
 
-        # Embed state
-        self.embed_url_col_idx = 0
-        self.embed_sku_col_idx = 0
-        self.embed_url_cols = []
-        self.embed_use_url_library = False
-        self.url_library = self._load_url_library()
-        self.url_library_records = self._load_url_library_records()
-        self.url_library_field_names = self._load_url_library_fields()
-        self.url_library_selected_fields = self._load_url_library_selected_fields()
-        self._url_library_combo_value = None
-        self.var_img_bg = None
-        self.extract_failed_tasks = []
+SHEET_CACHE_MAX_BYTES = 256 * 1024 * 1024
 
-        self.setup_style()
-        self.setup_ui()
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.root.after(2000, lambda: self.check_update(auto=True))
 
-    CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".sheetpic_config")
+class _SheetCache:
+    """In-process LRU of parsed sheets, keyed by (path, size, mtime, sheet, kind).
 
-    def setup_lang(self):
-        # 1. 读取用户手动设置
-        saved = self._load_config().get('lang')
-        if saved in LANG_MAP:
-            self.lang = saved
-            self.T = LANG_MAP[self.lang]
-            return
+    Holds `_read_excel_sheet` results and picture anchors so going back to a
+    sheet of an unchanged file skips the parse. Entries are evicted least
+    recently used first once their estimated footprint exceeds `max_bytes`.
+    """
 
-        # 2. 自动检测系统语言
-        self.lang = self._detect_system_lang()
-        self.T = LANG_MAP[self.lang]
+    def __init__(self, max_bytes=SHEET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
 
-    def _detect_system_lang(self):
-        try:
-            if platform.system() == "Darwin":
-                import subprocess
-                result = subprocess.run(
-                    ['defaults', 'read', '-g', 'AppleLanguages'],
-                    capture_output=True, text=True, timeout=3
-                )
-                if result.returncode == 0 and 'zh' in result.stdout.lower():
-                    return 'zh'
-            elif platform.system() == "Windows":
-                # Windows API: GetUserDefaultUILanguage → LANGID
-                import ctypes
-                lang_id = ctypes.windll.kernel32.GetUserDefaultUILanguage()
-                # 0x0804=zh-CN, 0x0404=zh-TW, 0x0C04=zh-HK, 0x1004=zh-SG
-                if lang_id in (0x0804, 0x0404, 0x0C04, 0x1004):
-                    return 'zh'
-                # 也检查 MUI language list
-                buf = ctypes.create_unicode_buffer(256)
-                ctypes.windll.kernel32.GetUserPreferredUILanguages(
-                    0x08, None, buf, ctypes.byref(ctypes.c_uint(256)))
-                if 'zh' in buf.value.lower():
-                    return 'zh'
-            else:
-                for var in ('LANG', 'LC_ALL', 'LC_MESSAGES'):
-                    val = os.environ.get(var, '')
-                    if 'zh' in val.lower():
-                        return 'zh'
-        except Exception:
-            pass
-        return 'en'
+    @staticmethod
+    def key(path, sheet_name, kind):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime_ns, sheet_name, kind)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _key, (_value, size) = self._entries.popitem(last=False)
+                self._bytes -= size
 
-    def _load_config(self):
-        try:
-            with open(self.CONFIG_PATH, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError, OSError):
-            return {}
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
 
-    def _write_config(self, cfg):
-        with open(self.CONFIG_PATH, 'w', encoding='utf-8') as f:
-            json.dump(cfg, f, ensure_ascii=False)
 
-    def _save_config(self, lang):
-        cfg = self._load_config()
-        cfg['lang'] = lang
-        self._write_config(cfg)
+_sheet_cache = _SheetCache()
 
-    def _load_url_library(self):
-        raw = self._load_config().get(URL_LIBRARY_CONFIG_KEY, {})
-        if not isinstance(raw, dict):
-            return {}
-        library = {}
-        for code, url in raw.items():
-            key = _normalize_lookup_code(code)
-            clean_url = _extract_http_url(url)
-            if key and clean_url:
-                library[key] = clean_url
-        return library
-
-    def _load_url_library_records(self):
-        raw = self._load_config().get(URL_LIBRARY_RECORDS_CONFIG_KEY, {})
-        if not isinstance(raw, dict):
-            return {}
-        records = {}
-        for code, record in raw.items():
-            key = _normalize_lookup_code(code)
-            if not key or not isinstance(record, dict):
-                continue
-            clean_record = {}
-            for field, value in record.items():
-                field_name = _normalize_library_field_name(field)
-                if field_name:
-                    clean_record[field_name] = _json_safe_value(value)
-            if clean_record:
-                records[key] = clean_record
-        return records
 
-    def _load_url_library_fields(self):
-        raw = self._load_config().get(URL_LIBRARY_FIELDS_CONFIG_KEY, [])
-        if not isinstance(raw, list):
-            return []
-        fields = []
-        seen = set()
-        for field in raw:
-            field_name = _normalize_library_field_name(field)
-            if field_name and field_name not in seen:
-                fields.append(field_name)
-                seen.add(field_name)
-        return fields
+def _frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
 
-    def _load_url_library_selected_fields(self):
-        raw = self._load_config().get(URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY, [])
-        if not isinstance(raw, list):
-            return []
-        available = set(getattr(self, 'url_library_field_names', []) or [])
-        selected = []
-        seen = set()
-        for field in raw:
-            field_name = _normalize_library_field_name(field)
-            if field_name and field_name not in seen and (not available or field_name in available):
-                selected.append(field_name)
-                seen.add(field_name)
-        return selected
 
-    def _save_url_library(self):
-        cfg = self._load_config()
-        cfg[URL_LIBRARY_CONFIG_KEY] = getattr(self, 'url_library', {})
-        cfg[URL_LIBRARY_RECORDS_CONFIG_KEY] = getattr(self, 'url_library_records', {})
-        cfg[URL_LIBRARY_FIELDS_CONFIG_KEY] = getattr(self, 'url_library_field_names', [])
-        cfg[URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY] = getattr(self, 'url_library_selected_fields', [])
-        self._write_config(cfg)
+def _header_row_from_grid(raw):
+    """`_find_header_row` for an already parsed raw grid."""
+    try:
+        return _score_header_row(raw.head(40))
+    except Exception:
+        return 0
 
-    def switch_lang(self, lang):
-        if lang == self.lang:
-            return
-        self.lang = lang
-        self.T = LANG_MAP[lang]
-        self._save_config(lang)
-        messagebox.showinfo(
-            self.T['title'],
-            "语言已切换，程序将重启以应用更改。\nLanguage changed, restarting..." if lang == 'zh'
-            else "Language changed. The app will restart to apply.\n语言已切换，程序将重启。"
-        )
-        self.root.destroy()
-        os.execl(sys.executable, sys.executable, *sys.argv)
 
-    def setup_style(self):
-        style = ttk.Style()
-        style.theme_use('clam')
+def _frame_from_grid(raw, header_row=0):
+    """Build the DataFrame `pd.read_excel(header=header_row)` would return from a raw grid.
+
+    Blank cells go back to '' so pandas' own TextParser applies the same
+    header naming (Unnamed: N, .1 suffixes) and type inference as read_excel.
+    """
+    from pandas.io.parsers import TextParser
+    rows = raw.astype(object).where(raw.notna(), '').values.tolist()
+    return TextParser(rows, header=header_row).read()
+
+
+def _read_excel_sheet(path, sheet_name=0):
+    """Parse one Excel sheet once. Returns {'raw', 'header_row', 'df', 'engine'}.
+
+    `raw` is the sheet as read (header=None, values untouched); header
+    detection and the DataFrame are both derived from it, so the file's
+    XML is parsed a single time. Results are kept in `_sheet_cache`; the
+    returned `df` is a shallow copy callers may rename columns on.
+    """
+    key = _sheet_cache.key(path, sheet_name, 'grid')
+    sheet = _sheet_cache.get(key)
+    if sheet is None:
+        raw, engine = _read_excel_grid(path, sheet_name)
+        header_row = _header_row_from_grid(raw)
+        sheet = {'raw': raw, 'header_row': header_row, 'df': _frame_from_grid(raw, header_row), 'engine': engine}
+        _sheet_cache.put(key, sheet, _frame_nbytes(raw) + _frame_nbytes(sheet['df']))
+    return dict(sheet, df=sheet['df'].copy(deep=False))
+
+
+# ==========================================
+# 批处理引擎 (无界面)
+# ExtractJob / EmbedJob 只接收普通参数并通过 on_event 回调报告进度,
+# 供 Tk 界面、命令行和后台工作进程共用。
+# ==========================================
+MAX_DOWNLOAD_SIZE = 50 * 1024 * 1024  # 50MB
+DOWNLOAD_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_WORKERS = 10  # starting concurrency; adapted at runtime
+DOWNLOAD_MIN_WORKERS = 2
+DOWNLOAD_MAX_WORKERS = 64
+DOWNLOAD_CONGESTION_STATUS = (429, 503)
+DOWNLOAD_MAX_RETRY_AFTER = 10  # seconds
+HTTP_POOL_SIZE = DOWNLOAD_MAX_WORKERS  # keep-alive connections kept per host
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".sheetpic_cache")
+DOWNLOAD_CACHE_DIR = os.path.join(CACHE_DIR, "downloads")
+PROCESSED_CACHE_DIR = os.path.join(CACHE_DIR, "processed")
+PROCESSED_CACHE_MAX_BYTES = 256 * 1024 * 1024
+EMBED_PROCESS_VERSION = 1  # bump when _prepare_embed_image_bytes output changes
+DOWNLOAD_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DOWNLOAD_CACHE_MAX_AGE = 7 * 24 * 3600  # seconds an entry is reused without asking the server
+DOWNLOAD_PER_HOST = 0  # concurrent downloads per hostname; 0 = up to the job's concurrency ceiling
+DOWNLOAD_HOST_RATE = 0  # request starts per second per hostname; 0 = unlimited
+EMBED_IMAGE_HEADER = "图片"
+EMBED_ROW_HEIGHT_PT = 40
+EMBED_WINDOW = 256  # unique URLs downloaded ahead of the row being written
+EMBED_WRITER_STREAM = "stream"      # write-only xlsx streamed straight into the zip
+EMBED_WRITER_OPENPYXL = "openpyxl"  # full openpyxl workbook (always used for write-original)
+EMBED_PLACEMENT_FLOATING = "floating"  # pictures float over the cells (drawing anchors)
+EMBED_PLACEMENT_CELL = "cell"          # Excel "Place in Cell" pictures (richData)
+EMBED_PLACEMENT_WPS = "wps"            # WPS in-cell pictures (cellimages.xml + DISPIMG)
+
+
+def _clean_image_url(url):
+    """Strip CDN thumbnail/resize parameters so the original image is fetched."""
+    url = re.sub(r'!\d+x\d+', '', url)
+    url = re.sub(r'\?imageView2/[^&]*', '', url)
+    url = re.sub(r'\?x-oss-process=[^&]*', '', url)
+    url = re.sub(r'[?&](width|height|w|h|size|resize|quality|format)=[^&]*', '', url)
+    url = re.sub(r'\?\d+$', '', url)
+    url = re.sub(r'\?&+', '?', url)
+    url = re.sub(r'\?$', '', url)
+    return url
+
+
+def _count_http_values(series):
+    sample = series.dropna().head(50)
+    if sample.empty:
+        return 0
+    sample_text = sample.astype(str)
+    if not sample_text.str.contains("http", case=False, na=False, regex=False).any():
+        return 0
+    full_text = series.dropna().astype(str)
+    return int(full_text.str.contains("http", case=False, na=False, regex=False).sum())
+
+
+READER_AUTO = "auto"      # fast native engine when installed, else pandas' default
+READER_PANDAS = "pandas"  # always pandas' default engines
+_reader_mode = READER_AUTO
+# kind -> (pandas engine name, module that provides it)
+_FAST_READERS = {'excel': ('calamine', 'python_calamine'), 'csv': ('pyarrow', 'pyarrow')}
+_DEFAULT_EXCEL_ENGINES = {'.xls': 'xlrd', '.ods': 'odf', '.xlsb': 'pyxlsb'}
+
+
+def configure_reader(mode=READER_AUTO):
+    """Choose READER_AUTO (prefer python-calamine / pyarrow) or READER_PANDAS."""
+    global _reader_mode
+    _reader_mode = mode
+
+
+def _fast_reader(kind):
+    """pandas engine name of the fast reader for 'excel' / 'csv', or None if unavailable."""
+    if _reader_mode != READER_AUTO:
+        return None
+    import importlib.util
+    engine, module = _FAST_READERS[kind]
+    try:
+        return engine if importlib.util.find_spec(module) is not None else None
+    except (ImportError, ValueError):
+        return None
+
+
+def _read_csv(path):
+    """Read a CSV (UTF-8, then GBK). Returns (df, engine name)."""
+    engine = _fast_reader('csv')
+    if engine:
+        for encoding in ('utf-8-sig', 'gbk'):
+            try:
+                return pd.read_csv(path, encoding=encoding, on_bad_lines='skip', engine=engine), engine
+            except Exception:
+                continue
+    try:
+        return pd.read_csv(path, encoding='utf-8-sig', on_bad_lines='skip'), 'c'
+    except Exception:
+        return pd.read_csv(path, encoding='gbk', on_bad_lines='skip'), 'c'
+
+
+def _read_csv_table(path):
+    return _read_csv(path)[0]
+
+
+def _read_excel_grid(path, sheet_name=0):
+    """Read a sheet as a raw object grid (header=None). Returns (raw, engine name).
+
+    Uses the fast engine when available and falls back to pandas' default
+    reader if it is missing, too old for this pandas, or fails on the file.
+    """
+    engine = _fast_reader('excel')
+    if engine:
+        try:
+            raw = pd.read_excel(path, header=None, sheet_name=sheet_name, dtype=object, engine=engine)
+            return raw, engine
+        except Exception:
+            pass
+    raw = pd.read_excel(path, header=None, sheet_name=sheet_name, dtype=object)
+    return raw, _DEFAULT_EXCEL_ENGINES.get(os.path.splitext(path)[1].lower(), 'openpyxl')
+
+
+def _dedupe_column_names(columns, unnamed):
+    """Rename "Unnamed: N" placeholders, then suffix duplicates (.1, .2, ...)."""
+    new_cols = []
+    seen = {}
+    for c in columns:
+        base = unnamed if str(c).startswith("Unnamed") else str(c)
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        new_cols.append(base if n == 0 else f"{base}.{n}")
+    return new_cols
+
+
+def _default_code_col_idx(names):
+    """Index of the first filename-like column (code/SKU/barcode), else 0."""
+    for i, name in enumerate(names):
+        low = str(name).lower()
+        if any(k in low for k in ("code", "sku", "条码", "货号")):
+            return i
+    return 0
+
+
+def _best_url_library_match_col_idx(df, library):
+    """Column whose normalized values hit the URL library most often (ties → SKU-like name)."""
+    if df is None or df.empty or not library:
+        return None
+
+    if not isinstance(library, _UrlTable):
+        library = _UrlTable(library.items())  # built once, searched per column
+
+    def _hits(column):
+        codes = _normalize_lookup_codes(column)
+        return int(((codes != '') & library.isin(codes)).sum())
+
+    # Score a leading sample of every column first; a column is scored in
+    # full only while its sample hits plus every unsampled row could still
+    # beat the best full score. Ties go to the SKU-like name, then the
+    # leftmost column, exactly as a full scan would pick.
+    sample = df.iloc[:URL_LIBRARY_MATCH_SAMPLE_ROWS]
+    unsampled = len(df) - len(sample)
+    candidates = sorted(((_hits(sample.iloc[:, i]), SheetPicApp._score_sku_column_name(col_name), -i)
+                         for i, col_name in enumerate(df.columns)), reverse=True)
+    best = None
+    for sample_hits, name_score, neg_idx in candidates:
+        if best is not None:
+            if sample_hits + unsampled < best[0]:
+                break
+            if (sample_hits + unsampled, name_score, neg_idx) < best:
+                continue
+        hits = _hits(df.iloc[:, -neg_idx]) if unsampled else sample_hits
+        if hits > 0 and (best is None or (hits, name_score, neg_idx) > best):
+            best = (hits, name_score, neg_idx)
+
+    return -best[2] if best is not None else None
+
+
+def _xml_local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _zip_part(base_part, target):
+    """Resolve a relationship `target` relative to the part that owns it."""
+    import posixpath
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+def _zip_rels(zf, part):
+    """{rId: (type, target part)} from the .rels of `part`; {} when it has none."""
+    import posixpath
+    import xml.etree.ElementTree as ET
+    folder, name = posixpath.split(part)
+    try:
+        root = ET.fromstring(zf.read(posixpath.join(folder, '_rels', name + '.rels')))
+    except KeyError:
+        return {}
+    return {
+        rel.get('Id'): (rel.get('Type', ''), _zip_part(part, rel.get('Target', '')))
+        for rel in root if rel.get('TargetMode') != 'External'
+    }
+
+
+class _XlsxImage:
+    """A floating picture found by `_XlsxImages`; bytes are read on demand."""
+
+    __slots__ = ('book', 'part', 'row', 'col', 'format')
+
+    def __init__(self, book, part, row, col):
+        self.book = book
+        self.part = part
+        self.row = row
+        self.col = col
+        ext = os.path.splitext(part)[1].lower().lstrip('.')
+        self.format = 'jpeg' if ext == 'jpg' else ext
+
+    def _data(self):
+        return self.book.read(self.part)
+
+
+_DISPIMG_RE = re.compile(r'DISPIMG\(\s*"([^"]+)"', re.IGNORECASE)
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)$')
+
+
+class _XlsxImages:
+    """Pictures of an `.xlsx`, read straight from the zip.
+
+    Floating pictures come from the sheet's drawing XML and rels. In-cell
+    pictures (WPS `cellimages.xml` + `DISPIMG` formulas, Excel richData
+    `_localImage` values) are resolved by streaming the sheet XML for cells
+    that reference them, which only happens when the workbook has such parts.
+    Cells are never loaded, so image-heavy workbooks open quickly, and media
+    bytes are only read, one part at a time, when a picture is exported.
+    """
+
+    def __init__(self, path):
+        import xml.etree.ElementTree as ET
+        from zipfile import ZipFile
+        self.path = path
+        self._lock = threading.Lock()
+        self._zip = ZipFile(path)
+        try:
+            wb_part = 'xl/workbook.xml'
+            for rtype, target in _zip_rels(self._zip, '').values():
+                if rtype.endswith('/officeDocument'):
+                    wb_part = target
+            rels = _zip_rels(self._zip, wb_part)
+            self._wb_part = wb_part
+            self._wb_rels = rels
+            self._cell_pictures = None
+            self._sheet_parts = {}
+            active = 0
+            for el in ET.fromstring(self._zip.read(wb_part)).iter():
+                tag = _xml_local(el.tag)
+                if tag == 'workbookView':
+                    active = int(el.get('activeTab') or 0)
+                elif tag == 'sheet':
+                    rid = next((v for k, v in el.attrib.items() if _xml_local(k) == 'id'), None)
+                    self._sheet_parts[el.get('name')] = rels.get(rid, ('', ''))[1]
+        except Exception:
+            self._zip.close()
+            raise
+        self.sheetnames = list(self._sheet_parts)
+        self.active = self.sheetnames[min(active, len(self.sheetnames) - 1)] if self.sheetnames else None
+
+    def images(self, sheet_name=None):
+        """Pictures anchored on `sheet_name` (default: the active sheet).
+
+        Anchors are kept in `_sheet_cache`, so asking again for a sheet of an
+        unchanged file does not re-read its drawings or cells.
+        """
+        sheet = sheet_name if sheet_name is not None else self.active
+        sheet_part = self._sheet_parts[sheet]
+        key = _sheet_cache.key(self.path, sheet, 'images')
+        anchors = _sheet_cache.get(key)
+        if anchors is None:
+            with self._lock:
+                anchors = self._drawing_anchors(sheet_part) + self._cell_anchors(sheet_part)
+            _sheet_cache.put(key, anchors, 200 * len(anchors))
+        return [_XlsxImage(self, part, row, col) for part, row, col in anchors]
+
+    def _drawing_anchors(self, sheet_part):
+        """(media part, row, col) of the floating pictures in the sheet's drawings."""
+        import xml.etree.ElementTree as ET
+        anchors = []
+        for rtype, drawing_part in _zip_rels(self._zip, sheet_part).values():
+            if not rtype.endswith('/drawing'):
+                continue
+            media = _zip_rels(self._zip, drawing_part)
+            with self._zip.open(drawing_part) as f:
+                for _event, el in ET.iterparse(f):
+                    if _xml_local(el.tag) not in ('twoCellAnchor', 'oneCellAnchor'):
+                        continue
+                    cell = {}
+                    embed = None
+                    for child in el:
+                        tag = _xml_local(child.tag)
+                        if tag == 'from':
+                            cell = {_xml_local(c.tag): c.text for c in child}
+                        elif tag == 'pic':
+                            for node in child.iter():
+                                if _xml_local(node.tag) == 'blip':
+                                    embed = next((v for k, v in node.attrib.items()
+                                                  if _xml_local(k) == 'embed'), None)
+                    target = media.get(embed)
+                    if target and 'row' in cell and 'col' in cell:
+                        anchors.append((target[1], int(cell['row']), int(cell['col'])))
+                    el.clear()
+        return anchors
+
+    def _wb_rel_part(self, type_suffix, default):
+        for rtype, target in self._wb_rels.values():
+            if rtype.endswith(type_suffix):
+                return target
+        return default
+
+    def _read_xml(self, part):
+        import xml.etree.ElementTree as ET
+        try:
+            return ET.fromstring(self._zip.read(part))
+        except KeyError:
+            return None
+
+    def _wps_cell_pictures(self):
+        """{image id: media part} from WPS `xl/cellimages.xml`."""
+        part = self._wb_rel_part('/cellImage', 'xl/cellimages.xml')
+        root = self._read_xml(part)
+        if root is None:
+            return {}
+        media = _zip_rels(self._zip, part)
+        pictures = {}
+        for pic in root.iter():
+            if _xml_local(pic.tag) != 'pic':
+                continue
+            name = embed = None
+            for node in pic.iter():
+                tag = _xml_local(node.tag)
+                if tag == 'cNvPr':
+                    name = node.get('name')
+                elif tag == 'blip':
+                    embed = next((v for k, v in node.attrib.items() if _xml_local(k) == 'embed'), None)
+            if name and embed in media:
+                pictures[name] = media[embed][1]
+        return pictures
+
+    def _rich_cell_pictures(self):
+        """{cell `vm` index: media part} from Excel richData `_localImage` values."""
+        metadata = self._read_xml(self._wb_rel_part('/sheetMetadata', 'xl/metadata.xml'))
+        rv_part = self._wb_rel_part('/rdRichValue', 'xl/richData/rdrichvalue.xml')
+        rel_part = self._wb_rel_part('/richValueRel', 'xl/richData/richValueRel.xml')
+        values = self._read_xml(rv_part)
+        rel_list = self._read_xml(rel_part)
+        if metadata is None or values is None or rel_list is None:
+            return {}
+
+        structures = self._read_xml(
+            self._wb_rel_part('/rdRichValueStructure', 'xl/richData/rdrichvaluestructure.xml'))
+        if structures is None:
+            return {}
+        image_key = {}  # structure index -> position of the image relation key
+        for s_idx, struct in enumerate(el for el in structures if _xml_local(el.tag) == 's'):
+            keys = [k.get('n') for k in struct if _xml_local(k.tag) == 'k']
+            if '_rvRel:LocalImageIdentifier' in keys:
+                image_key[s_idx] = keys.index('_rvRel:LocalImageIdentifier')
+        rel_media = _zip_rels(self._zip, rel_part)
+        rel_ids = [next((v for k, v in rel.attrib.items() if _xml_local(k) == 'id'), None)
+                   for rel in rel_list if _xml_local(rel.tag) == 'rel']
+        rich_media = []  # rich value index -> media part or None
+        for rv in (el for el in values if _xml_local(el.tag) == 'rv'):
+            pos = image_key.get(int(rv.get('s') or 0))
+            v = [el.text for el in rv if _xml_local(el.tag) == 'v']
+            part = None
+            if pos is not None and pos < len(v):
+                rel_idx = int(v[pos])
+                if rel_idx < len(rel_ids) and rel_ids[rel_idx] in rel_media:
+                    part = rel_media[rel_ids[rel_idx]][1]
+            rich_media.append(part)
+
+        type_names = [el.get('name') for el in metadata.iter() if _xml_local(el.tag) == 'metadataType']
+        rich_type = type_names.index('XLRICHVALUE') + 1 if 'XLRICHVALUE' in type_names else None
+        future = []
+        for block in metadata:
+            if _xml_local(block.tag) == 'futureMetadata' and block.get('name') == 'XLRICHVALUE':
+                for bk in block:
+                    rvb = next((el for el in bk.iter() if _xml_local(el.tag) == 'rvb'), None)
+                    future.append(int(rvb.get('i')) if rvb is not None else None)
+        pictures = {}
+        for block in metadata:
+            if _xml_local(block.tag) != 'valueMetadata':
+                continue
+            for vm, bk in enumerate((el for el in block if _xml_local(el.tag) == 'bk'), start=1):
+                rc = next((el for el in bk if _xml_local(el.tag) == 'rc'), None)
+                if rc is None or rich_type is None or int(rc.get('t') or 0) != rich_type:
+                    continue
+                v = int(rc.get('v') or 0)
+                rv_idx = future[v] if v < len(future) else None
+                if rv_idx is not None and rv_idx < len(rich_media) and rich_media[rv_idx]:
+                    pictures[vm] = rich_media[rv_idx]
+        return pictures
+
+    def _cell_anchors(self, sheet_part):
+        """(media part, row, col) of in-cell pictures, found by streaming the sheet's cells."""
+        import xml.etree.ElementTree as ET
+        if self._cell_pictures is None:
+            self._cell_pictures = (self._wps_cell_pictures(), self._rich_cell_pictures())
+        wps, rich = self._cell_pictures
+        if not wps and not rich:
+            return []
+        anchors = []
+        with self._zip.open(sheet_part) as f:
+            for _event, el in ET.iterparse(f):
+                tag = _xml_local(el.tag)
+                if tag == 'row':
+                    el.clear()
+                if tag != 'c':
+                    continue
+                part = None
+                vm = el.get('vm')
+                if vm and rich:
+                    part = rich.get(int(vm))
+                if part is None and wps:
+                    for child in el:
+                        if _xml_local(child.tag) in ('f', 'v') and child.text and 'DISPIMG' in child.text.upper():
+                            m = _DISPIMG_RE.search(child.text)
+                            if m and m.group(1) in wps:
+                                part = wps[m.group(1)]
+                                break
+                m = _CELL_REF_RE.match(el.get('r') or '')
+                if part and m:
+                    anchors.append((part, int(m.group(2)) - 1, column_index_from_string(m.group(1)) - 1))
+                el.clear()
+        return anchors
+
+    def read(self, part):
+        with self._lock:
+            return self._zip.read(part)
+
+    def close(self):
+        self._zip.close()
+
+
+def _load_sheet(path, sheet_name=None, unnamed=None):
+    """Headless counterpart of analyze_data for one file.
+
+    Returns {'df', 'header_row', 'sheet', 'sheet_names', 'images', 'book', 'engine'}
+    where `images` are the sheet's pictures (xlsx only), `book` is the
+    `_XlsxImages` they are read from (close it when done) and `engine` names
+    the reader that parsed the table.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    images = []
+    book = None
+    sheet_names = []
+    selected_sheet = sheet_name if sheet_name is not None else 0
+    header_row = 0
+    if ext == '.xlsx':
+        book = _XlsxImages(path)
+        try:
+            selected_sheet = sheet_name if sheet_name is not None else book.active
+            images = book.images(selected_sheet)
+            sheet_names = book.sheetnames
+        except Exception:
+            book.close()
+            raise
+
+    engine = None
+    if ext == '.csv':
+        df, engine = _read_csv(path)
+    elif ext == '.html':
+        df = pd.read_html(path)[0]
+    else:
+        sheet = _read_excel_sheet(path, sheet_name=selected_sheet)
+        header_row, df, engine = sheet['header_row'], sheet['df'], sheet['engine']
+    df.columns = _dedupe_column_names(df.columns, unnamed or LANG_MAP['en']['unnamed'])
+    return {
+        'df': df,
+        'header_row': header_row,
+        'sheet': selected_sheet,
+        'sheet_names': sheet_names,
+        'images': images,
+        'book': book,
+        'engine': engine,
+    }
+
+
+def _image_anchor_cell(img):
+    """0-based (row, col) of a picture's top-left anchor (`_XlsxImage` or openpyxl image)."""
+    if isinstance(img, _XlsxImage):
+        return img.row, img.col
+    return img.anchor._from.row, img.anchor._from.col
+
+
+def _build_image_anchor_map(images):
+    """Map floating images to {sheet_row: {col: image}} by their top-left anchor."""
+    anchors = {}
+    for img in images or []:
+        try:
+            r, c = _image_anchor_cell(img)
+        except AttributeError:
+            continue
+        anchors.setdefault(r, {})[c] = img
+    return anchors
+
+
+def _count_anchor_columns(images):
+    counts = {}
+    for img in images or []:
+        try:
+            c = _image_anchor_cell(img)[1]
+        except (AttributeError, IndexError):
+            continue
+        counts[c] = counts.get(c, 0) + 1
+    return counts
+
+
+def _detect_image_columns(df, embed_counts=None):
+    """Rank image source columns by item count.
+
+    Returns (img_cols, url_counts) where each img_cols entry is
+    {'idx', 'count', 'type'} and type is 'embed' or 'url'.
+    """
+    embed_counts = embed_counts or {}
+    url_counts = {}
+    for i in range(df.shape[1]):
+        # Access by position to avoid duplicate-name pitfalls.
+        count = _count_http_values(df.iloc[:, i])
+        if count > 0:
+            url_counts[i] = count
+
+    img_cols = []
+    for idx in set(embed_counts.keys()) | set(url_counts.keys()):
+        count = max(embed_counts.get(idx, 0), url_counts.get(idx, 0))
+        type_str = "embed" if idx in embed_counts else "url"
+        img_cols.append({'idx': idx, 'count': count, 'type': type_str})
+    img_cols.sort(key=lambda x: x['count'], reverse=True)
+    return img_cols, url_counts
+
+
+def _safe_filename_base(value, row_idx):
+    code = str(value).strip()
+    base_name = "".join([c for c in code if c.isalnum() or c in '-_'])
+    return base_name or f"Row_{row_idx + 1}"
+
+
+def _remove_file_quietly(path):
+    if not path:
+        return
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_file_atomic(path, data):
+    temp_path = path + ".part"
+    _remove_file_quietly(temp_path)
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return True
+    except OSError:
+        _remove_file_quietly(temp_path)
+        return False
+
+
+def _extract_output_exists(out_dir, filename_base):
+    try:
+        for name in os.listdir(out_dir):
+            stem, ext = os.path.splitext(name)
+            if stem == filename_base and ext:
+                path = os.path.join(out_dir, name)
+                try:
+                    if os.path.isfile(path) and os.path.getsize(path) == 0:
+                        _remove_file_quietly(path)
+                        continue
+                except OSError:
+                    pass
+                return True
+    except OSError:
+        return False
+    return False
+
+
+def _find_extract_output(out_dir, filename_base):
+    try:
+        for name in os.listdir(out_dir):
+            stem, ext = os.path.splitext(name)
+            if stem == filename_base and ext and not name.endswith('.part'):
+                return os.path.join(out_dir, name)
+    except OSError:
+        pass
+    return None
+
+
+def _link_or_copy(src, dst):
+    """Hardlink `dst` to `src`, falling back to a copy across devices or on FAT/SMB."""
+    _remove_file_quietly(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _save_processed_extract_image(image_data, filename_base, out_dir, options, T):
+    try:
+        pil_img = PILImage.open(BytesIO(image_data))
+        pil_img.load()
+        buf, ext = _prepare_extract_image_bytes(
+            pil_img,
+            bg_mode=options.get('bg_mode', EXTRACT_BG_ORIGINAL),
+            shape=options.get('shape', EXTRACT_SHAPE_ORIGINAL),
+            add_border=bool(options.get('add_border')),
+        )
+    except Exception as e:
+        return False, T['msg_bad_image'].format(filename_base, str(e)[:60])
+
+    path = os.path.join(out_dir, filename_base + ext)
+    if not _write_file_atomic(path, buf.getvalue()):
+        return False, T['msg_err'].format(filename_base, "Could not write file")
+    return True, "OK"
+
+
+class _AdaptiveLimit:
+    """AIMD limit on concurrent downloads.
+
+    Starts at `initial`. After every window of `limit` successful downloads
+    the limit grows by one while throughput keeps improving; timeouts,
+    connection resets and HTTP 429/503 halve it, at most once per window.
+    """
+
+    def __init__(self, initial=DOWNLOAD_WORKERS, minimum=DOWNLOAD_MIN_WORKERS, maximum=DOWNLOAD_MAX_WORKERS):
+        self.minimum = max(1, min(minimum, initial))
+        self.maximum = max(initial, maximum)
+        self.limit = max(self.minimum, initial)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._window_done = 0
+        self._window_start = time.monotonic()
+        self._last_rate = 0.0
+        self._backed_off = False
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def record_success(self):
+        with self._cond:
+            self._window_done += 1
+            if self._window_done < self.limit:
+                return
+            now = time.monotonic()
+            rate = self._window_done / max(now - self._window_start, 1e-6)
+            if not self._backed_off and rate >= self._last_rate and self.limit < self.maximum:
+                self.limit += 1
+                self._cond.notify()
+            self._last_rate = rate
+            self._window_done = 0
+            self._window_start = now
+            self._backed_off = False
+
+    def record_congestion(self):
+        with self._cond:
+            if self._backed_off:
+                return
+            self.limit = max(self.minimum, self.limit // 2)
+            self._backed_off = True
+            self._last_rate = 0.0
+            self._window_done = 0
+            self._window_start = time.monotonic()
+
+
+# Limiters of the job (and host) whose task is running on this worker thread,
+# so the download helpers can report congestion without changing their signatures.
+_download_context = threading.local()
+
+
+def _note_download_congestion():
+    for name in ('limiter', 'host_limiter'):
+        limiter = getattr(_download_context, name, None)
+        if limiter is not None:
+            limiter.record_congestion()
+
+
+def _url_host(url):
+    try:
+        return (urllib.parse.urlsplit(str(url)).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+class _HostScheduler:
+    """Per-hostname queues in front of a download executor.
+
+    Each host gets its own `_AdaptiveLimit`: it starts at `initial`, grows
+    while the host keeps up to its cap (`per_host`, or `ceiling` when that is
+    0) and congestion on one host only shrinks that host. An optional request
+    rate paces starts. Tasks wait in their host's queue instead of in the
+    pool, so a slow host only holds back its own rows. `run(host_limit, fn,
+    *args)` executes one task. `host_limits` maps hostname -> (cap, rate)
+    overrides. `clock` and `sleep` drive the pacing.
+    """
+
+    def __init__(self, executor, run, per_host=DOWNLOAD_PER_HOST, rate=DOWNLOAD_HOST_RATE, host_limits=None,
+                 initial=DOWNLOAD_WORKERS, ceiling=DOWNLOAD_MAX_WORKERS, clock=time.monotonic, sleep=time.sleep):
+        self.executor = executor
+        self._run = run
+        self._clock = clock
+        self._sleep = sleep
+        self.per_host = max(0, int(per_host))
+        self.initial = max(1, int(initial))
+        self.ceiling = max(1, int(ceiling))
+        self.rate = rate or 0
+        self.host_limits = host_limits or {}
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            cap, rate = self.host_limits.get(host, (self.per_host, self.rate))
+            cap = int(cap) if cap and int(cap) > 0 else self.ceiling
+            state = {
+                'queue': deque(),
+                'active': 0,
+                'limit': _AdaptiveLimit(min(self.initial, cap), minimum=1, maximum=cap),
+                'interval': 1.0 / rate if rate else 0.0,
+                'next_start': 0.0,
+            }
+            self._hosts[host] = state
+        return state
+
+    def submit(self, url, fn, *args):
+        future = concurrent.futures.Future()
+        host = _url_host(url)
+        with self._lock:
+            self._host(host)['queue'].append((future, fn, args))
+        self._pump(host)
+        return future
+
+    def _pump(self, host):
+        while True:
+            with self._lock:
+                state = self._hosts[host]
+                if not state['queue'] or state['active'] >= state['limit'].limit:
+                    return
+                future, fn, args = state['queue'].popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue  # cancelled by the caller while queued
+                state['active'] += 1
+            try:
+                inner = self.executor.submit(self._run_task, host, state, fn, args)
+            except RuntimeError:
+                # Executor already shut down (job stopped); drop the rest quietly.
+                with self._lock:
+                    state['active'] -= 1
+                future.set_result((False, "Stopped"))
+                continue
+            inner.add_done_callback(lambda f, out=future: self._finish(host, f, out))
+
+    def _run_task(self, host, state, fn, args):
+        if state['interval']:
+            with self._lock:
+                now = self._clock()
+                start = max(now, state['next_start'])
+                state['next_start'] = start + state['interval']
+            if start > now:
+                self._sleep(start - now)
+        return self._run(state['limit'], fn, *args)
+
+    def _finish(self, host, inner, future):
+        with self._lock:
+            self._hosts[host]['active'] -= 1
+        self._pump(host)
+        exc = inner.exception()
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(inner.result())
+
+
+def _retry_after_seconds(response, attempt):
+    try:
+        delay = float(response.headers.get('Retry-After', ''))
+    except (TypeError, ValueError):
+        delay = attempt + 1
+    return min(max(delay, 0), DOWNLOAD_MAX_RETRY_AFTER)
+
+
+_http_session_lock = threading.Lock()
+_http_session_obj = None
+
+
+def _new_http_session(pool_size=HTTP_POOL_SIZE, keep_alive=True):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=0,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DOWNLOAD_HEADERS)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def configure_http_session(pool_size=HTTP_POOL_SIZE, keep_alive=True):
+    """Rebuild the shared download session used by extract, retry and embed.
+
+    `pool_size` is the number of connections kept open per host; it should be
+    at least the number of download workers hitting the same CDN.
+    """
+    global _http_session_obj
+    session = _new_http_session(pool_size, keep_alive)
+    with _http_session_lock:
+        old, _http_session_obj = _http_session_obj, session
+    if old is not None:
+        old.close()
+    return session
+
+
+def _http_session():
+    """Shared pooled session so worker threads reuse TCP/TLS connections per host."""
+    global _http_session_obj
+    session = _http_session_obj
+    if session is None:
+        with _http_session_lock:
+            if _http_session_obj is None:
+                _http_session_obj = _new_http_session()
+            session = _http_session_obj
+    return session
+
+
+class _DownloadCache:
+    """On-disk cache of downloaded image bytes, shared across runs.
+
+    Entries are keyed by the cleaned URL and point to a blob named by the
+    SHA-256 of its content, so identical images behind different URLs are
+    stored once. ETag/Last-Modified are kept for conditional requests; entries
+    younger than `max_age` skip the network entirely. A running total of
+    blob sizes is kept; once it passes `max_bytes`, least recently used
+    blobs are evicted down to `EVICT_TARGET` of the budget.
+    """
+
+    INDEX_NAME = 'index.json'
+    FLUSH_INTERVAL = 10  # seconds between index writes while downloading
+    EVICT_TARGET = 0.9  # fraction of max_bytes left after an eviction sweep
+
+    def __init__(self, path=DOWNLOAD_CACHE_DIR, max_bytes=DOWNLOAD_CACHE_MAX_BYTES, max_age=DOWNLOAD_CACHE_MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = self._read_index()
+        self._count_blobs_locked()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def _count_blobs_locked(self):
+        self._blobs = {}  # digest -> [size, number of entries pointing to it]
+        self._total_bytes = 0
+        for entry in self._entries.values():
+            self._ref_locked(entry)
+
+    def _ref_locked(self, entry):
+        blob = self._blobs.get(entry['hash'])
+        if blob is None:
+            blob = self._blobs[entry['hash']] = [entry.get('size', 0), 0]
+            self._total_bytes += blob[0]
+        blob[1] += 1
+
+    def _set_entry_locked(self, url, entry):
+        old = self._entries.get(url)
+        if old is not None:
+            blob = self._blobs[old['hash']]
+            blob[1] -= 1
+            if not blob[1]:
+                del self._blobs[old['hash']]
+                self._total_bytes -= blob[0]
+        self._entries[url] = entry
+        self._ref_locked(entry)
+
+    def _index_path(self):
+        return os.path.join(self.path, self.INDEX_NAME)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return {}
+        entries = data.get('entries') if isinstance(data, dict) else None
+        if not isinstance(entries, dict):
+            return {}
+        return {url: e for url, e in entries.items() if isinstance(e, dict) and e.get('hash')}
+
+    def lookup(self, url):
+        """Entry dict for `url` (hash, size, etag, last_modified, content_type, fetched) or None."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            entry['used'] = time.time()
+            self._dirty = True
+            return dict(entry)
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get('fetched', 0) < self.max_age
+
+    def read(self, entry):
+        try:
+            with open(self._blob_path(entry['hash']), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        return data if len(data) == entry.get('size') else None
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def revalidated(self, url):
+        """Record a 304 answer: the cached bytes are good for another `max_age`."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                entry['fetched'] = entry['used'] = time.time()
+                self._dirty = True
+        self._maybe_flush()
+
+    def store(self, url, data, headers=None):
+        headers = headers or {}
+        if not data or 'no-store' in str(headers.get('Cache-Control', '')).lower():
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except OSError:
+                _remove_file_quietly(temp_path)
+                return
+        now = time.time()
+        with self._lock:
+            self._set_entry_locked(url, {
+                'hash': digest,
+                'size': len(data),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'content_type': headers.get('Content-Type', ''),
+                'fetched': now,
+                'used': now,
+            })
+            self._dirty = True
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+        self._maybe_flush()
+
+    def store_file(self, url, path, headers=None):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        self.store(url, data, headers)
+
+    def _evict_locked(self):
+        used = {}
+        for entry in self._entries.values():
+            used[entry['hash']] = max(used.get(entry['hash'], 0), entry.get('used', 0))
+        target = self.max_bytes * self.EVICT_TARGET
+        total = self._total_bytes
+        evicted = set()
+        for digest in sorted(used, key=used.get):
+            if total <= target:
+                break
+            evicted.add(digest)
+            total -= self._blobs[digest][0]
+            _remove_file_quietly(self._blob_path(digest))
+        self._entries = {url: e for url, e in self._entries.items() if e['hash'] not in evicted}
+        self._count_blobs_locked()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write the index, keeping entries other processes added meanwhile."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        # Disk reads happen without the lock so downloads can keep using the cache.
+        on_disk = self._read_index()
+        with self._lock:
+            added = [(url, entry) for url, entry in on_disk.items() if url not in self._entries]
+        added = [(url, entry) for url, entry in added if os.path.exists(self._blob_path(entry['hash']))]
+        with self._lock:
+            for url, entry in added:
+                if url not in self._entries:
+                    self._set_entry_locked(url, entry)
+            payload = json.dumps({'entries': self._entries}, ensure_ascii=False).encode('utf-8')
+        try:
+            os.makedirs(self.path, exist_ok=True)
+        except OSError:
+            return
+        index_path = self._index_path()
+        temp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(temp_path, index_path)
+        except OSError:
+            _remove_file_quietly(temp_path)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'blobs': len(self._blobs), 'bytes': self._total_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._count_blobs_locked()
+            self._dirty = False
+            for path in glob.glob(os.path.join(self.path, 'blobs', '*', '*')):
+                _remove_file_quietly(path)
+            _remove_file_quietly(self._index_path())
+
+
+_download_cache_lock = threading.Lock()
+_download_cache_obj = None
+_download_cache_enabled = True
+
+
+def configure_download_cache(path=DOWNLOAD_CACHE_DIR, max_bytes=DOWNLOAD_CACHE_MAX_BYTES,
+                             max_age=DOWNLOAD_CACHE_MAX_AGE, enabled=True):
+    """Replace the download cache used by extract, retry and embed; `enabled=False` turns it off."""
+    global _download_cache_obj, _download_cache_enabled
+    cache = _DownloadCache(path, max_bytes, max_age) if enabled else None
+    with _download_cache_lock:
+        old, _download_cache_obj = _download_cache_obj, cache
+        _download_cache_enabled = enabled
+    if old is not None:
+        old.flush()
+    return cache
+
+
+def _download_cache():
+    global _download_cache_obj
+    cache = _download_cache_obj
+    if cache is None and _download_cache_enabled:
+        with _download_cache_lock:
+            if _download_cache_obj is None and _download_cache_enabled:
+                _download_cache_obj = _DownloadCache()
+            cache = _download_cache_obj
+    return cache
+
+
+def _flush_download_cache():
+    cache = _download_cache_obj
+    if cache is not None:
+        cache.flush()
+
+
+atexit.register(_flush_download_cache)
+
+
+class _ProcessedImageCache:
+    """Final embed image bytes keyed by source content hash + (max_dim, bg_mode).
+
+    One file per key, so a repeat image costs a file read instead of the
+    Pillow decode/resize/encode. A hit refreshes the file's mtime and the
+    oldest files are evicted once the directory outgrows `max_bytes`.
+    """
+
+    def __init__(self, path=PROCESSED_CACHE_DIR, max_bytes=PROCESSED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+    def _key_path(self, digest, max_dim, bg_mode):
+        name = f"{digest}-{int(max_dim or 0)}-{bg_mode}-v{EMBED_PROCESS_VERSION}"
+        return os.path.join(self.path, digest[:2], name)
+
+    def _files(self):
+        files = []
+        for path in glob.glob(os.path.join(self.path, '*', '*')):
+            if path.endswith('.part'):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def get(self, digest, max_dim, bg_mode):
+        path = self._key_path(digest, max_dim, bg_mode)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data or None
+
+    def put(self, digest, max_dim, bg_mode, data):
+        path = self._key_path(digest, max_dim, bg_mode)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            _remove_file_quietly(temp_path)
+            return
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _mtime, size, _path in self._files())
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        files = sorted(self._files())
+        total = sum(size for _mtime, size, _path in files)
+        for _mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            _remove_file_quietly(path)
+            total -= size
+        self._total = total
+
+    def stats(self):
+        files = self._files()
+        return {'entries': len(files), 'bytes': sum(size for _mtime, size, _path in files)}
+
+    def clear(self):
+        with self._lock:
+            for _mtime, _size, path in self._files():
+                _remove_file_quietly(path)
+            self._total = 0
+
+
+_processed_cache_lock = threading.Lock()
+_processed_cache_obj = None
+_processed_cache_enabled = True
+
+
+def configure_processed_cache(path=PROCESSED_CACHE_DIR, max_bytes=PROCESSED_CACHE_MAX_BYTES, enabled=True):
+    """Replace the processed embed image cache; `enabled=False` turns it off."""
+    global _processed_cache_obj, _processed_cache_enabled
+    cache = _ProcessedImageCache(path, max_bytes) if enabled else None
+    with _processed_cache_lock:
+        _processed_cache_obj = cache
+        _processed_cache_enabled = enabled
+    return cache
+
+
+def _processed_cache():
+    global _processed_cache_obj
+    cache = _processed_cache_obj
+    if cache is None and _processed_cache_enabled:
+        with _processed_cache_lock:
+            if _processed_cache_obj is None and _processed_cache_enabled:
+                _processed_cache_obj = _ProcessedImageCache()
+            cache = _processed_cache_obj
+    return cache
+
+
+def _write_extract_bytes(data, content_type, filename_base, out_dir, extract_options, T):
+    if _extract_options_require_processing(extract_options):
+        return _save_processed_extract_image(data, filename_base, out_dir, extract_options, T)
+    ext = mimetypes.guess_extension((content_type or '').lower()) or ".jpg"
+    if not _write_file_atomic(os.path.join(out_dir, filename_base + ext), data):
+        return False, T['msg_err'].format(filename_base, "Could not write file")
+    return True, "OK"
+
+
+def _embed_image_from_bytes(data, url, max_dim, bg_mode, T):
+    cache = _processed_cache()
+    digest = hashlib.sha256(data).hexdigest() if cache is not None else None
+    if digest is not None:
+        cached = cache.get(digest, max_dim, bg_mode)
+        if cached is not None:
+            return True, BytesIO(cached)
+    try:
+        pil_img = PILImage.open(BytesIO(data))
+    except Exception as e:
+        return False, T['msg_bad_image'].format(url[:50], str(e)[:60])
+    out = _prepare_embed_image_bytes(pil_img, max_dim, bg_mode)
+    if digest is not None:
+        cache.put(digest, max_dim, bg_mode, out.getvalue())
+    return True, out
+
+
+def _download_url_to_file(url, filename_base, out_dir, extract_options=None, T=None, is_running=None):
+    """Download one extract image to `out_dir`. Returns (ok, message)."""
+    T = T or LANG_MAP['en']
+    is_running = is_running or (lambda: True)
+    if not is_running():
+        return False, "Stopped"
+    process_image = _extract_options_require_processing(extract_options)
+    cache = _download_cache()
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        data = cache.read(entry)
+        if data is not None:
+            return _write_extract_bytes(data, entry.get('content_type'), filename_base, out_dir, extract_options, T)
+    for attempt in range(EXTRACT_TIMEOUT_RETRIES + 1):
+        path = None
+        temp_path = None
+        r = None
+        try:
+            r = _http_session().get(url, timeout=DOWNLOAD_TIMEOUT, stream=True,
+                                    headers=cache.conditional_headers(entry) if cache is not None else None)
+            if not is_running():
+                return False, "Stopped"
+            if r.status_code == 304 and entry is not None:
+                data = cache.read(entry)
+                if data is not None:
+                    cache.revalidated(url)
+                    return _write_extract_bytes(data, entry.get('content_type'), filename_base, out_dir, extract_options, T)
+                entry = None  # blob vanished; ask again without validators
+                continue
+            if r.status_code == 200:
+                cl = int(r.headers.get('Content-Length', 0))
+                if cl > MAX_DOWNLOAD_SIZE:
+                    return False, T['msg_too_large'].format(filename_base, cl // 1024 // 1024)
+                ct = r.headers.get('Content-Type', '').lower()
+                ext = mimetypes.guess_extension(ct)
+                if not ext:
+                    ext = ".jpg"
+                path = os.path.join(out_dir, filename_base + ext)
+                written = 0
+                if process_image:
+                    chunks = []
+                    for chunk in r.iter_content(8192):
+                        if not is_running():
+                            return False, "Stopped"
+                        written += len(chunk)
+                        if written > MAX_DOWNLOAD_SIZE:
+                            return False, T['msg_too_large'].format(filename_base, written // 1024 // 1024)
+                        chunks.append(chunk)
+                    if written == 0:
+                        if attempt < EXTRACT_TIMEOUT_RETRIES:
+                            continue
+                        return False, T['msg_err'].format(filename_base, "Empty download")
+                    if cache is not None:
+                        cache.store(url, b''.join(chunks), r.headers)
+                    return _save_processed_extract_image(
+                        b''.join(chunks),
+                        filename_base,
+                        out_dir,
+                        extract_options,
+                        T
+                    )
+                else:
+                    temp_path = path + ".part"
+                    _remove_file_quietly(temp_path)
+                    with open(temp_path, 'wb') as f:
+                        for chunk in r.iter_content(8192):
+                            if not is_running():
+                                _remove_file_quietly(temp_path)
+                                return False, "Stopped"
+                            written += len(chunk)
+                            if written > MAX_DOWNLOAD_SIZE:
+                                f.close()
+                                _remove_file_quietly(temp_path)
+                                return False, T['msg_too_large'].format(filename_base, written // 1024 // 1024)
+                            f.write(chunk)
+                    if written == 0:
+                        _remove_file_quietly(temp_path)
+                        if attempt < EXTRACT_TIMEOUT_RETRIES:
+                            continue
+                        return False, T['msg_err'].format(filename_base, "Empty download")
+                    os.replace(temp_path, path)
+                    if cache is not None:
+                        cache.store_file(url, path, r.headers)
+                    return True, "OK"
+            elif r.status_code == 404:
+                return False, T['msg_404'].format(filename_base)
+            elif r.status_code in DOWNLOAD_CONGESTION_STATUS and attempt < EXTRACT_TIMEOUT_RETRIES:
+                _note_download_congestion()
+                time.sleep(_retry_after_seconds(r, attempt))
+                continue
+            else:
+                if r.status_code in DOWNLOAD_CONGESTION_STATUS:
+                    _note_download_congestion()
+                return False, T['msg_err'].format(filename_base, f"HTTP {r.status_code} ({url[:60]})")
+        except requests.exceptions.Timeout:
+            _remove_file_quietly(temp_path)
+            _note_download_congestion()
+            if attempt < EXTRACT_TIMEOUT_RETRIES:
+                continue
+            return False, T['msg_timeout'].format(filename_base)
+        except requests.exceptions.SSLError as e:
+            _remove_file_quietly(temp_path)
+            return False, T['msg_ssl_err'].format(filename_base, str(e)[:80])
+        except requests.exceptions.ConnectionError as e:
+            _remove_file_quietly(temp_path)
+            _note_download_congestion()
+            return False, T['msg_conn_err'].format(filename_base, str(e)[:80])
+        except Exception as e:
+            _remove_file_quietly(temp_path)
+            if attempt == 0:
+                continue
+            return False, T['msg_err'].format(filename_base, f"{type(e).__name__}: {str(e)[:60]}")
+        finally:
+            # Return the streamed connection to the pool even on early exits.
+            if r is not None:
+                r.close()
+    return False, T['msg_err'].format(filename_base, "Max retries exceeded")
+
+
+def _download_embed_image(url, max_dim=None, bg_mode=EMBED_BG_WHITE, T=None, is_running=None):
+    """Download one embed image. Returns (True, BytesIO) or (False, message)."""
+    T = T or LANG_MAP['en']
+    is_running = is_running or (lambda: True)
+    if not is_running():
+        return False, "Stopped"
+    cache = _download_cache()
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        data = cache.read(entry)
+        if data is not None:
+            return _embed_image_from_bytes(data, url, max_dim, bg_mode, T)
+    for attempt in range(2):
+        try:
+            r = _http_session().get(url, timeout=DOWNLOAD_TIMEOUT,
+                                    headers=cache.conditional_headers(entry) if cache is not None else None)
+            if not is_running():
+                return False, "Stopped"
+            if r.status_code == 304 and entry is not None:
+                data = cache.read(entry)
+                if data is not None:
+                    cache.revalidated(url)
+                    return _embed_image_from_bytes(data, url, max_dim, bg_mode, T)
+                entry = None
+                continue
+            if r.status_code == 200:
+                cl = int(r.headers.get('Content-Length', 0))
+                if cl > MAX_DOWNLOAD_SIZE:
+                    return False, T['msg_too_large'].format(url[:50], cl // 1024 // 1024)
+                ok, data = _embed_image_from_bytes(r.content, url, max_dim, bg_mode, T)
+                if ok and cache is not None:
+                    cache.store(url, r.content, r.headers)
+                return ok, data
+            elif r.status_code == 404:
+                return False, T['msg_404'].format(url[:50])
+            elif r.status_code in DOWNLOAD_CONGESTION_STATUS and attempt == 0:
+                _note_download_congestion()
+                time.sleep(_retry_after_seconds(r, attempt))
+                continue
+            else:
+                if r.status_code in DOWNLOAD_CONGESTION_STATUS:
+                    _note_download_congestion()
+                return False, T['msg_err'].format(url[:50], f"HTTP {r.status_code} ({url[:60]})")
+        except requests.exceptions.Timeout:
+            _note_download_congestion()
+            if attempt == 0:
+                continue
+            return False, T['msg_timeout'].format(url[:50])
+        except requests.exceptions.SSLError as e:
+            return False, T['msg_ssl_err'].format(url[:50], str(e)[:80])
+        except requests.exceptions.ConnectionError as e:
+            _note_download_congestion()
+            return False, T['msg_conn_err'].format(url[:50], str(e)[:80])
+        except Exception as e:
+            if attempt == 0:
+                continue
+            return False, T['msg_err'].format(url[:50], f"{type(e).__name__}: {str(e)[:60]}")
+    return False, T['msg_err'].format(url[:50], "Max retries exceeded")
+
+
+class _BatchJob:
+    """Shared plumbing for headless jobs: stop flag, message table and event callback.
+
+    Events are plain dicts with a 'type' key: 'start' (total), 'log' (message)
+    and 'progress' (current, total, success, fail, skipped, message).
+    """
+
+    def __init__(self, T=None, on_event=None, max_workers=DOWNLOAD_WORKERS, max_concurrency=DOWNLOAD_MAX_WORKERS,
+                 per_host=DOWNLOAD_PER_HOST, host_rate=DOWNLOAD_HOST_RATE, host_limits=None):
+        self.T = T or LANG_MAP['en']
+        self.on_event = on_event
+        self.limiter = _AdaptiveLimit(max_workers, maximum=max_concurrency)
+        self.per_host = per_host
+        self.host_rate = host_rate
+        self.host_limits = host_limits
+        self._scheduler = None
+        self.is_running = True
+
+    def _executor(self):
+        # Sized for the ceiling; the adaptive limiter decides how many run at once.
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.limiter.maximum)
+
+    def _run_limited(self, host_limit, fn, *args):
+        if not self.is_running:
+            return False, "Stopped"
+        self.limiter.acquire()
+        _download_context.limiter = self.limiter
+        _download_context.host_limiter = host_limit
+        try:
+            result = fn(*args)
+        finally:
+            _download_context.limiter = None
+            _download_context.host_limiter = None
+            self.limiter.release()
+        if result and result[0] is True:
+            self.limiter.record_success()
+            if host_limit is not None:
+                host_limit.record_success()
+        return result
+
+    def _submit_download(self, executor, fn, url, *args):
+        # Queue per host first; only tasks a host may start occupy pool threads.
+        if self._scheduler is None or self._scheduler.executor is not executor:
+            self._scheduler = _HostScheduler(
+                executor, self._run_limited, self.per_host, self.host_rate, self.host_limits,
+                initial=self.limiter.limit, ceiling=self.limiter.maximum,
+            )
+        return self._scheduler.submit(url, fn, url, *args)
+
+    def stop(self):
+        self.is_running = False
+
+    def _emit(self, event_type, **fields):
+        if self.on_event is None:
+            return
+        fields['type'] = event_type
+        self.on_event(fields)
+
+    def _log(self, message):
+        self._emit('log', message=message)
+
+    def _progress(self, current, total, success, fail, skipped=0, message=""):
+        self._emit('progress', current=current, total=total, success=success,
+                   fail=fail, skipped=skipped, message=message)
+
+    def _clean_url(self, url):
+        cleaned = _clean_image_url(url)
+        if cleaned != url:
+            self._log(f"URL clean: {url[:60]}... -> {cleaned[:60]}...")
+        return cleaned
+
+
+class ExtractJob(_BatchJob):
+    """Download or export the images of one sheet into `out_dir`.
+
+    `img_cols` uses the `_detect_image_columns` shape and defaults to every
+    detected column; `image_map` is `_build_image_anchor_map` output for the
+    sheet's embedded pictures. `download(url, filename_base, out_dir[, options])`
+    may be replaced to customize fetching.
+    """
+
+    def __init__(self, df=None, out_dir=None, code_col_idx=0, img_cols=None, header_row=0,
+                 image_map=None, extract_options=None, download=None, **kwargs):
+        super().__init__(**kwargs)
+        self.df = df
+        self.out_dir = out_dir
+        self.code_col_idx = code_col_idx
+        self.img_cols = img_cols
+        self.header_row = header_row
+        self.image_map = image_map or {}
+        self.extract_options = extract_options
+        self.download = download or self._download
+        self.failed_tasks = []
+
+    def _download(self, url, filename_base, out_dir, extract_options=None):
+        return _download_url_to_file(
+            url, filename_base, out_dir, extract_options,
+            T=self.T, is_running=lambda: self.is_running
+        )
+
+    def _submit(self, executor, task):
+        if task.get('extract_options'):
+            return self._submit_download(
+                executor, self.download, task['url'], task['filename_base'], task['out_dir'], task['extract_options']
+            )
+        return self._submit_download(executor, self.download, task['url'], task['filename_base'], task['out_dir'])
+
+    def _queue(self, executor, task, futures, by_url):
+        # One download per URL; later tasks for the same URL ride along and get a copy.
+        key = (task['url'], task['out_dir'])
+        future = by_url.get(key)
+        if future is None:
+            future = by_url[key] = self._submit(executor, task)
+            futures[future] = [task]
+        else:
+            futures[future].append(task)
+
+    def _fan_out(self, group, is_ok, msg):
+        """Yield (task, ok, message) for every task sharing one download."""
+        yield group[0], is_ok, msg
+        if len(group) == 1:
+            return
+        src = _find_extract_output(group[0]['out_dir'], group[0]['filename_base']) if is_ok else None
+        for task in group[1:]:
+            if not is_ok:
+                yield task, False, msg
+                continue
+            if src is None:
+                yield task, False, self.T['msg_err'].format(task['filename_base'], "Missing shared download")
+                continue
+            dst = os.path.join(task['out_dir'], task['filename_base'] + os.path.splitext(src)[1])
+            try:
+                _link_or_copy(src, dst)
+                yield task, True, "OK"
+            except OSError as e:
+                yield task, False, self.T['msg_err'].format(task['filename_base'], str(e)[:60])
+
+    def _log_duplicates(self, futures):
+        shared = sum(len(group) for group in futures.values() if len(group) > 1)
+        if shared:
+            self._log(self.T['msg_dup_urls'].format(
+                shared, sum(1 for group in futures.values() if len(group) > 1)))
+
+    def _row_images(self, i, base_name, img_cols):
+        row_images = []
+        for col_info in img_cols:
+            c_idx = col_info['idx']
+            if col_info['type'] == 'embed':
+                excel_row = self.header_row + 1 + i
+                img_obj = self.image_map.get(excel_row, {}).get(c_idx)
+                if img_obj is not None:
+                    row_images.append(('embed', img_obj))
+            elif col_info['type'] == 'url':
+                val = str(self.df.iloc[i, c_idx]).strip()
+                if not val or val.lower() == 'nan' or "http" not in val.lower():
+                    if val and val.lower() != 'nan':
+                        self._log(self.T['msg_invalid_url'].format(base_name, val[:60]))
+                    continue
+                if not val.startswith("http"):
+                    m = re.search(r'(https?://[^\s;]+)', val)
+                    if m:
+                        val = m.group(1)
+                    else:
+                        self._log(self.T['msg_invalid_url'].format(base_name, val[:60]))
+                        continue
+                val = self._clean_url(val.split('?')[0].split('!')[0])
+                row_images.append(('url', val))
+        return row_images
+
+    def _export_embedded(self, img_obj, final_name):
+        try:
+            raw_data = img_obj._data()
+            if _extract_options_require_processing(self.extract_options):
+                return _save_processed_extract_image(
+                    raw_data, final_name, self.out_dir, self.extract_options, self.T
+                )
+            ext = ".png" if img_obj.format == "png" else ".jpg"
+            with open(os.path.join(self.out_dir, final_name + ext), "wb") as f:
+                f.write(raw_data)
+            return True, "OK"
+        except Exception as e:
+            return False, self.T['msg_err'].format(final_name, f"{type(e).__name__}: {str(e)[:60]}")
+
+    def run(self):
+        """Process every row. Returns a summary dict; failed URL tasks end up in `failed_tasks`."""
+        t_start = time.time()
+        self.failed_tasks = []
+        os.makedirs(self.out_dir, exist_ok=True)
+        img_cols = self.img_cols
+        if img_cols is None:
+            embed_counts = {}
+            for cols in self.image_map.values():
+                for c in cols:
+                    embed_counts[c] = embed_counts.get(c, 0) + 1
+            img_cols = _detect_image_columns(self.df, embed_counts)[0]
+
+        total = len(self.df)
+        self._emit('start', total=total)
+        success = 0
+        fail = 0
+        skipped = 0
+        tasks = {}
+        by_url = {}
+        planned_names = set()
+
+        with self._executor() as executor:
+            for i in range(total):
+                if not self.is_running:
+                    break
+
+                base_name = _safe_filename_base(self.df.iloc[i, self.code_col_idx], i)
+                row_images = self._row_images(i, base_name, img_cols)
+                if not row_images:
+                    skipped += 1
+                    self._progress(i + 1 + len(tasks), total, success, fail, skipped,
+                                   self.T['msg_skip'].format(base_name))
+                    continue
+
+                for img_idx, (src_type, src_data) in enumerate(row_images):
+                    suffix = f"-{img_idx}" if img_idx > 0 else ""
+                    final_name = f"{base_name}{suffix}"
+                    if final_name in planned_names or _extract_output_exists(self.out_dir, final_name):
+                        skipped += 1
+                        self._progress(i + 1, total, success, fail, skipped,
+                                       self.T['msg_same_name_skip'].format(final_name))
+                        continue
+                    planned_names.add(final_name)
+
+                    if src_type == 'embed':
+                        is_ok, msg = self._export_embedded(src_data, final_name)
+                        if is_ok:
+                            success += 1
+                        else:
+                            fail += 1
+                            self._log(msg)
+                    else:
+                        task = {'url': src_data, 'filename_base': final_name, 'out_dir': self.out_dir}
+                        if self.extract_options:
+                            task['extract_options'] = self.extract_options
+                        self._queue(executor, task, tasks, by_url)
+
+                self._progress(i + 1, total, success, fail, skipped, "Process")
+
+            self._log_duplicates(tasks)
+            for future in concurrent.futures.as_completed(tasks):
+                if not self.is_running:
+                    break
+                group = tasks[future]
+                try:
+                    is_ok, msg = future.result()
+                except Exception as e:
+                    is_ok, msg = False, self.T['msg_err'].format(
+                        group[0]['filename_base'],
+                        f"{type(e).__name__}: {str(e)[:60]}"
+                    )
+                for task, task_ok, task_msg in self._fan_out(group, is_ok, msg):
+                    if task_ok:
+                        success += 1
+                    else:
+                        fail += 1
+                        self.failed_tasks.append(task)
+                    self._progress(total, total, success, fail, skipped, task_msg)
+
+        _flush_download_cache()
+        return {
+            'success': success,
+            'fail': fail,
+            'skipped': skipped,
+            'out_dir': self.out_dir,
+            'duration': time.time() - t_start,
+            'stopped': not self.is_running,
+        }
+
+    def run_retry(self, retry_tasks):
+        """Retry previously failed URL tasks (as collected in `failed_tasks`)."""
+        t_start = time.time()
+        self.failed_tasks = []
+        total = len(retry_tasks)
+        out_dir = retry_tasks[0].get('out_dir', self.out_dir) if retry_tasks else self.out_dir
+        success = 0
+        fail = 0
+        skipped = 0
+        self._emit('start', total=total)
+
+        with self._executor() as executor:
+            futures = {}
+            by_url = {}
+            planned_names = set()
+            skipped_before_submit = 0
+            for task in retry_tasks:
+                if not self.is_running:
+                    self.failed_tasks.append(task)
+                    continue
+                filename_base = task['filename_base']
+                if filename_base in planned_names or _extract_output_exists(task['out_dir'], filename_base):
+                    skipped += 1
+                    skipped_before_submit += 1
+                    planned_names.add(filename_base)
+                    self._progress(skipped_before_submit, total, success, fail, skipped,
+                                   self.T['msg_same_name_skip'].format(filename_base))
+                    continue
+                planned_names.add(filename_base)
+                self._queue(executor, task, futures, by_url)
+
+            completed = skipped_before_submit
+            for future in concurrent.futures.as_completed(futures):
+                group = futures[future]
+                if not self.is_running:
+                    self.failed_tasks.extend(group)
+                    continue
+                try:
+                    is_ok, msg = future.result()
+                except Exception as e:
+                    is_ok, msg = False, self.T['msg_err'].format(
+                        group[0]['filename_base'],
+                        f"{type(e).__name__}: {str(e)[:60]}"
+                    )
+                for task, task_ok, task_msg in self._fan_out(group, is_ok, msg):
+                    completed += 1
+                    if task_ok:
+                        success += 1
+                    else:
+                        fail += 1
+                        self.failed_tasks.append(task)
+                    self._progress(completed, total, success, fail, skipped, task_msg)
+
+        _flush_download_cache()
+        return {
+            'success': success,
+            'fail': fail,
+            'skipped': skipped,
+            'out_dir': out_dir,
+            'duration': time.time() - t_start,
+            'stopped': not self.is_running,
+        }
+
+
+def _embed_image_size(width, height):
+    """Scaled picture size (px) and image column width for one embedded row."""
+    img_ratio = width / height if height > 0 else 1
+    col_width = max(EMBED_ROW_HEIGHT_PT * 1.33 * img_ratio / 7 + 1, 12)
+    scaled_h = int(EMBED_ROW_HEIGHT_PT * 1.33)
+    return int(scaled_h * img_ratio), scaled_h, col_width
+
+
+class _OpenpyxlEmbedSink:
+    """Embed output through an openpyxl worksheet (new workbook or a copy of the source)."""
+
+    def __init__(self, wb, ws, path):
+        self.wb = wb
+        self.ws = ws
+        self.path = path
+
+    def write_row(self, excel_row, cells, image=None):
+        """Write `cells` ({column: value}) and an optional (ref, digest, column) picture.
+
+        Raises before writing anything when the picture cannot be read.
+        """
+        xl_img = _shared_xl_image(image[0], image[1]) if image is not None else None
+        for col, value in cells.items():
+            self.ws.cell(row=excel_row, column=col, value=value)
+        if xl_img is not None:
+            scaled_w, scaled_h, col_width = _embed_image_size(xl_img.width, xl_img.height)
+            col_letter = get_column_letter(image[2])
+            self.ws.row_dimensions[excel_row].height = EMBED_ROW_HEIGHT_PT
+            self.ws.column_dimensions[col_letter].width = col_width
+            xl_img.width = scaled_w
+            xl_img.height = scaled_h
+            self.ws.add_image(xl_img, f"{col_letter}{excel_row}")
+
+    def save(self):
+        _save_workbook(self.wb, self.path)
+
+    def close(self):
+        self.wb.close()
+
+
+_XML_ILLEGAL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_XLSX_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XLSX_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XLSX_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XLSX_MINIMAL_STYLES = (
+    f'<styleSheet xmlns="{_XLSX_NS_MAIN}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _xml_text(value):
+    from xml.sax.saxutils import escape
+    return escape(_XML_ILLEGAL_RE.sub('', str(value)))
+
+
+class _XlsxStreamWriter:
+    """Write-only single-sheet `.xlsx` for embed output.
+
+    Rows, picture anchors and media parts go to disk as they arrive (XML via
+    temp files, media straight into the zip), so memory stays flat whatever
+    the row count; only column widths are held until `save`. Rows must be
+    written in ascending order. Implements the same `write_row` / `save` /
+    `close` interface as `_OpenpyxlEmbedSink`.
+
+    `placement` picks how pictures are stored: floating drawing anchors,
+    Excel "Place in Cell" rich values, or WPS `DISPIMG` cell images. The
+    in-cell modes keep pictures with their rows when sorting and filtering.
+
+    The zip is built at `<path>.part` and moved over `path` only by `save`,
+    so a stopped or failed run never leaves a truncated workbook behind.
+    """
+
+    def __init__(self, path, sheet_title="Sheet", placement=EMBED_PLACEMENT_FLOATING):
+        from zipfile import ZipFile, ZIP_DEFLATED
+        self.path = path
+        self.sheet_title = sheet_title
+        self.placement = placement
+        self._temp_path = path + ".part"
+        _remove_file_quietly(self._temp_path)
+        self._zip = ZipFile(self._temp_path, 'w', ZIP_DEFLATED, allowZip64=True)
+        self._parts = {}  # temp files of streamed XML fragments, by part key
+        self._media = {}  # digest -> (media file name, width, height)
+        self._media_exts = set()
+        self._cell_pictures = {}  # digest -> rich value index / WPS image id
+        self._col_widths = {}
+        self._n_anchors = 0
+        self._last_row = 0
+        self._saved = False
+        self._closed = False
+
+    def _append(self, key, text):
+        f = self._parts.get(key)
+        if f is None:
+            f = self._parts[key] = tempfile.TemporaryFile()
+        f.write(text.encode('utf-8'))
+
+    @staticmethod
+    def _cell_xml(ref, value):
+        if isinstance(value, bool):
+            return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)) and math.isfinite(value):
+            return f'<c r="{ref}"><v>{value!r}</v></c>'
+        if value is None or value == '':
+            return ''
+        return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{_xml_text(value)}</t></is></c>'
+
+    def _add_media(self, ref, digest):
+        """Write the media part for `digest` once. Returns (file name, width, height)."""
+        media = self._media.get(digest)
+        if media is not None:
+            return media
+        with PILImage.open(BytesIO(ref) if isinstance(ref, bytes) else ref) as img:
+            width, height = img.size
+            fmt = (img.format or 'png').lower()
+            if fmt in ('jpeg', 'png', 'gif'):
+                if isinstance(ref, bytes):
+                    data = ref
+                else:
+                    with open(ref, 'rb') as f:
+                        data = f.read()
+            else:
+                buf = BytesIO()
+                img.save(buf, format='PNG')
+                data, fmt = buf.getvalue(), 'png'
+        name = f"image-{digest[:20]}.{fmt}"
+        self._zip.writestr(f"xl/media/{name}", data)
+        self._media[digest] = media = (name, width, height)
+        self._media_exts.add(fmt)
+        return media
+
+    def _anchor(self, excel_row, col, media, scaled_w, scaled_h):
+        self._n_anchors += 1
+        n = self._n_anchors
+        self._append('drawing', (
+            f'<xdr:oneCellAnchor><xdr:from><xdr:col>{col - 1}</xdr:col><xdr:colOff>0</xdr:colOff>'
+            f'<xdr:row>{excel_row - 1}</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:from>'
+            f'<xdr:ext cx="{scaled_w * 9525}" cy="{scaled_h * 9525}"/>'
+            f'<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{n}" name="Image {n}" descr="Picture"/><xdr:cNvPicPr/>'
+            f'</xdr:nvPicPr><xdr:blipFill><a:blip r:embed="rId{n}" cstate="print"/>'
+            f'<a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+            f'<xdr:spPr><a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic>'
+            f'<xdr:clientData/></xdr:oneCellAnchor>'
+        ))
+        self._append('drawing_rels',
+                     f'<Relationship Id="rId{n}" Type="{_XLSX_NS_REL}/image" Target="../media/{media}"/>')
+
+    def _rich_value(self, digest, media):
+        """Excel in-cell picture: one rich value per distinct image. Returns its index."""
+        idx = self._cell_pictures.get(digest)
+        if idx is None:
+            idx = self._cell_pictures[digest] = len(self._cell_pictures)
+            self._append('rich_values', f'<rv s="0"><v>{idx}</v><v>5</v></rv>')
+            self._append('rich_value_rel', f'<rel r:id="rId{idx + 1}"/>')
+            self._append('rich_value_rels',
+                         f'<Relationship Id="rId{idx + 1}" Type="{_XLSX_NS_REL}/image" Target="../media/{media}"/>')
+        return idx
+
+    def _wps_image(self, digest, media, scaled_w, scaled_h):
+        """WPS in-cell picture: one cellimages.xml entry per distinct image. Returns its ID."""
+        image_id = self._cell_pictures.get(digest)
+        if image_id is None:
+            n = len(self._cell_pictures) + 1
+            image_id = self._cell_pictures[digest] = "ID_" + digest[:32].upper()
+            self._append('cell_images', (
+                f'<etc:cellImage><xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{n + 1}" name="{image_id}"/>'
+                f'<xdr:cNvPicPr/></xdr:nvPicPr><xdr:blipFill><a:blip r:embed="rId{n}"/>'
+                f'<a:stretch><a:fillRect/></a:stretch></xdr:blipFill><xdr:spPr><a:xfrm><a:off x="0" y="0"/>'
+                f'<a:ext cx="{scaled_w * 9525}" cy="{scaled_h * 9525}"/></a:xfrm>'
+                f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic></etc:cellImage>'
+            ))
+            self._append('cell_image_rels',
+                         f'<Relationship Id="rId{n}" Type="{_XLSX_NS_REL}/image" Target="media/{media}"/>')
+        return image_id
+
+    def write_row(self, excel_row, cells, image=None):
+        """Write `cells` ({column: value}) and an optional (ref, digest, column) picture.
+
+        Raises before writing anything when the picture cannot be read.
+        """
+        if excel_row <= self._last_row:
+            raise ValueError(f"rows must be written in order ({excel_row} after {self._last_row})")
+        cells_xml = {
+            col: self._cell_xml(f"{get_column_letter(col)}{excel_row}", value) for col, value in cells.items()
+        }
+        if image is not None:
+            ref, digest, col = image
+            media, width, height = self._add_media(ref, digest)
+            scaled_w, scaled_h, col_width = _embed_image_size(width, height)
+            self._col_widths[col] = col_width
+            cell_ref = f"{get_column_letter(col)}{excel_row}"
+            if self.placement == EMBED_PLACEMENT_CELL:
+                vm = self._rich_value(digest, media) + 1
+                cells_xml[col] = f'<c r="{cell_ref}" t="e" vm="{vm}"><v>#VALUE!</v></c>'
+            elif self.placement == EMBED_PLACEMENT_WPS:
+                image_id = self._wps_image(digest, media, scaled_w, scaled_h)
+                cells_xml[col] = (f'<c r="{cell_ref}" t="str"><f>_xlfn.DISPIMG("{image_id}",1)</f>'
+                                  f'<v>=DISPIMG("{image_id}",1)</v></c>')
+            else:
+                self._anchor(excel_row, col, media, scaled_w, scaled_h)
+
+        row_attrs = f' ht="{EMBED_ROW_HEIGHT_PT}" customHeight="1"' if image is not None else ''
+        row_xml = ''.join(xml for _col, xml in sorted(cells_xml.items()))
+        if row_xml or row_attrs:
+            self._append('rows', f'<row r="{excel_row}"{row_attrs}>{row_xml}</row>')
+        self._last_row = excel_row
+
+    def _write_part(self, name, head, key=None, tail='', chunks=()):
+        """Stream `head`, the temp file for `key` and/or `chunks`, then `tail` into zip part `name`."""
+        with self._zip.open(name, 'w', force_zip64=True) as out:
+            out.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + head).encode('utf-8'))
+            body = self._parts.get(key)
+            if body is not None:
+                body.seek(0)
+                shutil.copyfileobj(body, out)
+            for chunk in chunks:
+                out.write(chunk.encode('utf-8'))
+            out.write(tail.encode('utf-8'))
+
+    def _rels_part(self, name, rels, key=None):
+        head = f'<Relationships xmlns="{_XLSX_NS_PKG_REL}">' + ''.join(
+            f'<Relationship Id="{rid}" Type="{rtype}" Target="{target}"/>' for rid, rtype, target in rels
+        )
+        self._write_part(name, head, key, '</Relationships>')
+
+    def save(self):
+        ct = 'application/vnd.openxmlformats-officedocument'
+        overrides = [
+            ('/xl/workbook.xml', f'{ct}.spreadsheetml.sheet.main+xml'),
+            ('/xl/worksheets/sheet1.xml', f'{ct}.spreadsheetml.worksheet+xml'),
+            ('/xl/styles.xml', f'{ct}.spreadsheetml.styles+xml'),
+            ('/docProps/core.xml', 'application/vnd.openxmlformats-package.core-properties+xml'),
+            ('/docProps/app.xml', f'{ct}.extended-properties+xml'),
+        ]
+        wb_rels = [
+            ('rId1', f'{_XLSX_NS_REL}/worksheet', 'worksheets/sheet1.xml'),
+            ('rId2', f'{_XLSX_NS_REL}/styles', 'styles.xml'),
+        ]
+
+        cols = ''.join(
+            f'<col min="{c}" max="{c}" width="{w}" customWidth="1"/>' for c, w in sorted(self._col_widths.items())
+        )
+        self._write_part(
+            'xl/worksheets/sheet1.xml',
+            f'<worksheet xmlns="{_XLSX_NS_MAIN}" xmlns:r="{_XLSX_NS_REL}">'
+            + (f'<cols>{cols}</cols>' if cols else '') + '<sheetData>',
+            'rows',
+            '</sheetData>' + ('<drawing r:id="rId1"/>' if self._n_anchors else '') + '</worksheet>',
+        )
+        if self._n_anchors:
+            self._rels_part('xl/worksheets/_rels/sheet1.xml.rels',
+                            [('rId1', f'{_XLSX_NS_REL}/drawing', '../drawings/drawing1.xml')])
+            self._write_part(
+                'xl/drawings/drawing1.xml',
+                '<xdr:wsDr xmlns:xdr="http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing" '
+                f'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" xmlns:r="{_XLSX_NS_REL}">',
+                'drawing',
+                '</xdr:wsDr>',
+            )
+            self._rels_part('xl/drawings/_rels/drawing1.xml.rels', [], 'drawing_rels')
+            overrides.append(('/xl/drawings/drawing1.xml', f'{ct}.drawing+xml'))
+
+        n_pictures = len(self._cell_pictures)
+        if n_pictures and self.placement == EMBED_PLACEMENT_CELL:
+            self._save_rich_values(n_pictures, overrides, wb_rels)
+        elif n_pictures and self.placement == EMBED_PLACEMENT_WPS:
+            self._write_part(
+                'xl/cellimages.xml',
+                '<etc:cellImages xmlns:xdr="http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing" '
+                f'xmlns:r="{_XLSX_NS_REL}" xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+                'xmlns:etc="http://www.wps.cn/officeDocument/2017/etCustomData">',
+                'cell_images',
+                '</etc:cellImages>',
+            )
+            self._rels_part('xl/_rels/cellimages.xml.rels', [], 'cell_image_rels')
+            overrides.append(('/xl/cellimages.xml', 'application/vnd.wps-officedocument.cellimage+xml'))
+            wb_rels.append(('rId3', 'http://www.wps.cn/officeDocument/2020/cellImage', 'cellimages.xml'))
+
+        self._zip.writestr('xl/workbook.xml', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<workbook xmlns="{_XLSX_NS_MAIN}" xmlns:r="{_XLSX_NS_REL}"><sheets>'
+            f'<sheet name="{_xml_text(self.sheet_title)}" sheetId="1" r:id="rId1"/></sheets></workbook>'))
+        self._rels_part('xl/_rels/workbook.xml.rels', wb_rels)
+        self._write_part('xl/styles.xml', _XLSX_MINIMAL_STYLES)
+        created = datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self._write_part('docProps/core.xml', (
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><dc:creator>SheetPic</dc:creator>'
+            f'<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created>'
+            f'<dcterms:modified xsi:type="dcterms:W3CDTF">{created}</dcterms:modified></cp:coreProperties>'))
+        self._write_part('docProps/app.xml', (
+            '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+            '<Application>SheetPic</Application></Properties>'))
+        self._rels_part('_rels/.rels', [
+            ('rId1', f'{_XLSX_NS_REL}/officeDocument', 'xl/workbook.xml'),
+            ('rId2', f'{_XLSX_NS_PKG_REL}/metadata/core-properties', 'docProps/core.xml'),
+            ('rId3', f'{_XLSX_NS_REL}/extended-properties', 'docProps/app.xml'),
+        ])
+        defaults = ''.join(
+            f'<Default Extension="{ext}" ContentType="image/{ext}"/>' for ext in sorted(self._media_exts)
+        )
+        self._write_part('[Content_Types].xml', (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>' + defaults
+            + ''.join(f'<Override PartName="{name}" ContentType="{ctype}"/>' for name, ctype in overrides)
+            + '</Types>'))
+        self._saved = True
+        self.close()
+
+    def _save_rich_values(self, count, overrides, wb_rels):
+        # Same part set Excel writes for "Place in Cell" pictures (_localImage rich values).
+        rd_ns = "http://schemas.microsoft.com/office/spreadsheetml/2017/richdata"
+        self._write_part(
+            'xl/metadata.xml',
+            f'<metadata xmlns="{_XLSX_NS_MAIN}" xmlns:xlrd="{rd_ns}">'
+            '<metadataTypes count="1"><metadataType name="XLRICHVALUE" minSupportedVersion="120000" copy="1" '
+            'pasteAll="1" pasteValues="1" merge="1" splitFirst="1" rowColShift="1" clearFormats="1" '
+            'clearComments="1" assign="1" coerce="1"/></metadataTypes>'
+            f'<futureMetadata name="XLRICHVALUE" count="{count}">',
+            chunks=[
+                *(f'<bk><extLst><ext uri="{{3e2802c4-a4d2-4d8b-9148-e3be6c30e623}}"><xlrd:rvb i="{i}"/>'
+                  '</ext></extLst></bk>' for i in range(count)),
+                f'</futureMetadata><valueMetadata count="{count}">',
+                *(f'<bk><rc t="1" v="{i}"/></bk>' for i in range(count)),
+            ],
+            tail='</valueMetadata></metadata>',
+        )
+        self._write_part('xl/richData/rdrichvalue.xml', f'<rvData xmlns="{rd_ns}" count="{count}">',
+                         'rich_values', '</rvData>')
+        self._write_part(
+            'xl/richData/rdrichvaluestructure.xml',
+            f'<rvStructures xmlns="{rd_ns}" count="1"><s t="_localImage">'
+            '<k n="_rvRel:LocalImageIdentifier" t="i"/><k n="CalcOrigin" t="i"/></s></rvStructures>')
+        flags = ''.join(
+            f'<key name="{k}"><flag name="ExcludeFromCalcComparison" value="1"/></key>'
+            for k in ('_DisplayString', '_Flags', '_Format', '_SubLabel', '_Attribution', '_Icon',
+                      '_Display', '_CanonicalPropertyNames', '_ClassificationId')
+        )
+        self._write_part(
+            'xl/richData/rdRichValueTypes.xml',
+            '<rvTypesInfo xmlns="http://schemas.microsoft.com/office/spreadsheetml/2017/richdata2" '
+            'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" mc:Ignorable="x" '
+            f'xmlns:x="{_XLSX_NS_MAIN}"><global><keyFlags>'
+            '<key name="_Self"><flag name="ExcludeFromFile" value="1"/>'
+            f'<flag name="ExcludeFromCalcComparison" value="1"/></key>{flags}'
+            '</keyFlags></global></rvTypesInfo>')
+        self._write_part(
+            'xl/richData/richValueRel.xml',
+            '<richValueRels xmlns="http://schemas.microsoft.com/office/spreadsheetml/2022/richvaluerel" '
+            f'xmlns:r="{_XLSX_NS_REL}">',
+            'rich_value_rel',
+            '</richValueRels>',
+        )
+        self._rels_part('xl/richData/_rels/richValueRel.xml.rels', [], 'rich_value_rels')
+        ms = "http://schemas.microsoft.com/office"
+        overrides.extend([
+            ('/xl/metadata.xml', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheetMetadata+xml'),
+            ('/xl/richData/rdrichvalue.xml', 'application/vnd.ms-excel.rdrichvalue+xml'),
+            ('/xl/richData/rdrichvaluestructure.xml', 'application/vnd.ms-excel.rdrichvaluestructure+xml'),
+            ('/xl/richData/rdRichValueTypes.xml', 'application/vnd.ms-excel.rdrichvaluetypes+xml'),
+            ('/xl/richData/richValueRel.xml', 'application/vnd.ms-excel.richvaluerel+xml'),
+        ])
+        wb_rels.extend([
+            ('rId3', f'{_XLSX_NS_REL}/sheetMetadata', 'metadata.xml'),
+            ('rId4', f'{ms}/2017/06/relationships/rdRichValue', 'richData/rdrichvalue.xml'),
+            ('rId5', f'{ms}/2017/06/relationships/rdRichValueStructure', 'richData/rdrichvaluestructure.xml'),
+            ('rId6', f'{ms}/2017/06/relationships/rdRichValueTypes', 'richData/rdRichValueTypes.xml'),
+            ('rId7', f'{ms}/2022/10/relationships/richValueRel', 'richData/richValueRel.xml'),
+        ])
+
+    def close(self):
+        """Finish the file; before a completed `save` this discards the partial output."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._zip.close()
+            for f in self._parts.values():
+                f.close()
+            if self._saved:
+                os.replace(self._temp_path, self.path)
+        finally:
+            _remove_file_quietly(self._temp_path)
+
+
+class EmbedJob(_BatchJob):
+    """Download images by URL and write them into a new `.xlsx` next to each row.
+
+    Output goes to `<dest_dir>/<name>_Embedded.xlsx`, or `<name>_WithImages.xlsx`
+    when `write_original` inserts the column into the `.xlsx` at `source_path`.
+    With `use_url_library`, URLs and optional `extra_field_names` come from
+    `url_library` / `url_library_records` keyed by the normalized SKU column.
+    `download(url, max_dim, bg_mode)` may be replaced to customize fetching.
+    """
+
+    def __init__(self, df=None, dest_dir=None, name="Clipboard", url_col_idx=None, sku_col_idx=None,
+                 use_url_library=False, url_library=None, url_library_records=None,
+                 extra_field_names=None, max_dim=500, bg_mode=EMBED_BG_WHITE,
+                 write_original=False, source_path=None, header_row=0, download=None,
+                 window=EMBED_WINDOW, writer=EMBED_WRITER_STREAM, placement=EMBED_PLACEMENT_FLOATING,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.df = df
+        self.dest_dir = dest_dir
+        self.name = name
+        self.url_col_idx = url_col_idx
+        self.sku_col_idx = sku_col_idx
+        self.use_url_library = use_url_library
+        self.url_library = url_library or {}
+        self.url_library_records = url_library_records or {}
+        self.extra_field_names = list(extra_field_names or []) if use_url_library else []
+        self.max_dim = max_dim
+        self.bg_mode = bg_mode
+        self.write_original = write_original
+        self.used_original = write_original
+        self.source_path = source_path
+        self.header_row = header_row
+        self.download = download or self._download
+        self.window = window
+        self.writer = writer
+        self.placement = placement
+        self._values = None
+
+    def _download(self, url, max_dim=None, bg_mode=EMBED_BG_WHITE):
+        return _download_embed_image(url, max_dim, bg_mode, T=self.T, is_running=lambda: self.is_running)
+
+    def _header_cells(self, source_col_idx, extra_field_names):
+        """Header cells of a new output sheet. Returns ({column: value}, img_header_col)."""
+        cells = {}
+        out_col = 1
+        img_header_col = 1
+        for i, col_name in enumerate(self.df.columns):
+            cells[out_col] = col_name
+            out_col += 1
+            if i == source_col_idx:
+                cells[out_col] = EMBED_IMAGE_HEADER
+                img_header_col = out_col
+                out_col += 1
+                for field_name in extra_field_names:
+                    cells[out_col] = field_name
+                    out_col += 1
+        return cells, img_header_col
+
+    def _setup_new(self, source_col_idx, header_row_excel=1, extra_field_names=None):
+        """Create a new workbook for embedding. Returns (out_file, ws, wb, img_header_col, header_row_excel)."""
+        out_file = os.path.join(self.dest_dir, f"{self.name}_Embedded.xlsx")
+        wb_out = openpyxl.Workbook()
+        ws = wb_out.active
+        cells, img_header_col = self._header_cells(source_col_idx, extra_field_names or [])
+        for col, value in cells.items():
+            ws.cell(row=header_row_excel, column=col, value=value)
+        return out_file, ws, wb_out, img_header_col, header_row_excel
+
+    def _setup_stream(self, source_col_idx, header_row_excel=1, extra_field_names=None):
+        """Start a write-only output file. Returns (sink, img_header_col, header_row_excel)."""
+        out_file = os.path.join(self.dest_dir, f"{self.name}_Embedded.xlsx")
+        sink = _XlsxStreamWriter(out_file, placement=self.placement)
+        cells, img_header_col = self._header_cells(source_col_idx, extra_field_names or [])
+        sink.write_row(header_row_excel, cells)
+        return sink, img_header_col, header_row_excel
+
+    def _setup_original(self, source_col_idx, extra_field_names=None):
+        """Load original workbook, insert image column. Returns (out_file, ws, wb, img_header_col, header_row_excel)."""
+        extra_field_names = extra_field_names or []
+        out_file = os.path.join(self.dest_dir, f"{self.name}_WithImages.xlsx")
+        header_row_excel = self.header_row + 1
+
+        if not self.source_path or self.source_path == "Clipboard" or not os.path.exists(self.source_path):
+            # Clipboard mode: fallback to new workbook
+            self.used_original = False
+            return self._setup_new(source_col_idx, header_row_excel, extra_field_names)
+
+        ext = os.path.splitext(self.source_path)[1].lower()
+        if ext != '.xlsx':
+            self._log(self.T['log_embed_format_fallback'].format(ext or "current file"))
+            self.used_original = False
+            return self._setup_new(source_col_idx, header_row_excel, extra_field_names)
+
+        wb_out = openpyxl.load_workbook(self.source_path)
+        ws = wb_out.active
+
+        # Find header row and the source/anchor column in the Excel sheet.
+        source_col_name = str(self.df.columns[source_col_idx])
+
+        source_excel_col = None
+        for col_idx in range(1, ws.max_column + 1):
+            cell_val = ws.cell(row=header_row_excel, column=col_idx).value
+            if cell_val is not None and str(cell_val).strip() == source_col_name:
+                source_excel_col = col_idx
+                break
+
+        if source_excel_col is None:
+            # Fallback: search all rows for the header
+            for r in range(1, min(ws.max_row + 1, 20)):
+                for c in range(1, ws.max_column + 1):
+                    cell_val = ws.cell(row=r, column=c).value
+                    if cell_val is not None and str(cell_val).strip() == source_col_name:
+                        source_excel_col = c
+                        header_row_excel = r
+                        break
+                if source_excel_col:
+                    break
+
+        if source_excel_col is None:
+            # Last resort: use column index directly
+            source_excel_col = source_col_idx + 1
+
+        img_header_col = source_excel_col + 1
+        ws.insert_cols(img_header_col, amount=1 + len(extra_field_names))
+        ws.cell(row=header_row_excel, column=img_header_col, value=EMBED_IMAGE_HEADER)
+        for offset, field_name in enumerate(extra_field_names, start=1):
+            ws.cell(row=header_row_excel, column=img_header_col + offset, value=field_name)
+
+        return out_file, ws, wb_out, img_header_col, header_row_excel
+
+    def _source_row_cells(self, i, image_anchor_col_idx):
+        if self._values is None:
+            # Positional access into one object array; per-cell df.iloc dominates large outputs.
+            self._values = self.df.to_numpy(dtype=object)
+        row = self._values[i]
+        cells = {}
+        out_col = 1
+        for j in range(self.df.shape[1]):
+            cell_val = str(row[j]) if row[j] is not None else ""
+            if cell_val.lower() == 'nan':
+                cell_val = ""
+            cells[out_col] = cell_val
+            out_col += 1
+            if j == image_anchor_col_idx:
+                out_col += 1 + len(self.extra_field_names)
+        return cells
+
+    def _collect_urls(self):
+        rows_data = []
+        row_library_records = []
+        library_matches = 0
+        for i in range(len(self.df)):
+            record = {}
+            if self.use_url_library:
+                code = _normalize_lookup_code(self.df.iloc[i, self.sku_col_idx])
+                url = self.url_library.get(code)
+                record = self.url_library_records.get(code, {})
+                if url:
+                    library_matches += 1
+                    url = self._clean_url(url)
+            else:
+                url_raw_value = self.df.iloc[i, self.url_col_idx]
+                url_raw = str(url_raw_value).strip()
+                url = _extract_http_url(url_raw_value)
+                if url:
+                    url = self._clean_url(url)
+                elif url_raw and url_raw.lower() != 'nan':
+                    self._log(self.T['msg_invalid_url'].format(f"Row {i+1}", url_raw[:60]))
+            rows_data.append(url)
+            row_library_records.append(record)
+        if self.use_url_library:
+            self._log(self.T['msg_url_lib_matches'].format(library_matches, len(self.df)))
+        return rows_data, row_library_records
+
+    def _spool(self, spool_dir, data):
+        data = data.getvalue() if hasattr(data, 'getvalue') else data
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(spool_dir, digest)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path, digest
+
+    def _stream_rows(self, sink, rows_data, row_library_records, layout, spool_dir):
+        """Download with at most `window` unique URLs in flight and write rows in order.
+
+        Returns (success, fail). Rows after a stop are written with the skip marker.
+        """
+        total = len(rows_data)
+        order = list(dict.fromkeys(url for url in rows_data if url))
+        uses = {}
+        for url in rows_data:
+            if url:
+                uses[url] = uses.get(url, 0) + 1
+        shared = [n for n in uses.values() if n > 1]
+        if shared:
+            self._log(self.T['msg_dup_urls'].format(sum(shared), len(shared)))
+
+        success = 0
+        fail = 0
+        pending = {}
+        results = {}  # url -> (ok, (path, digest) | message), kept while later rows still use it
+        next_url = 0
+        window = max(1, self.window)
+        with self._executor() as executor:
+            for i, url in enumerate(rows_data):
+                if not self.is_running:
+                    # queued downloads see the stop flag in _run_limited and return at once
+                    for rest in range(i, total):
+                        self._write_row(sink, rest, None, row_library_records, layout)
+                    break
+                while next_url < len(order) and len(pending) < window:
+                    queued = order[next_url]
+                    pending[queued] = self._submit_download(
+                        executor, self.download, queued, self.max_dim, self.bg_mode)
+                    next_url += 1
+
+                if not url:
+                    row_result = (False, "No URL")
+                else:
+                    if url not in results:
+                        try:
+                            is_ok, data = pending.pop(url).result()
+                            if is_ok:
+                                data = self._spool(spool_dir, data)
+                        except Exception as e:
+                            is_ok, data = False, str(e)
+                        results[url] = (is_ok, data)
+                    row_result = results[url]
+                    uses[url] -= 1
+                    if not uses[url]:
+                        del results[url]
+
+                if self._write_row(sink, i, row_result, row_library_records, layout):
+                    success += 1
+                else:
+                    fail += 1
+                self._progress(i + 1, total, success, fail)
+        return success, fail
+
+    def _write_row(self, sink, i, row_result, row_library_records, layout):
+        """Write one output row; `row_result` None marks a row skipped by stop. Returns True when embedded."""
+        excel_row = layout['header_row_excel'] + 1 + i
+        img_header_col = layout['img_header_col']
+        # Source values only in new-workbook mode; the original copy already has them.
+        cells = {} if layout['write_original'] else self._source_row_cells(i, layout['anchor_col_idx'])
+        if row_result is None:
+            cells[img_header_col] = self.T['msg_dl_skip']
+            sink.write_row(excel_row, cells)
+            return False
+
+        extra_field_names = layout['extra_field_names']
+        if extra_field_names:
+            record = row_library_records[i] if i < len(row_library_records) else {}
+            for offset, field_name in enumerate(extra_field_names, start=1):
+                cells[img_header_col + offset] = _json_safe_value(record.get(field_name, ''))
+        is_ok, data = row_result
+        if is_ok:
+            try:
+                sink.write_row(excel_row, cells, (data[0], data[1], img_header_col))
+                return True
+            except Exception as e:
+                self._log(self.T['log_embed_row_fail'].format(excel_row, f"{type(e).__name__}: {e}"))
+        cells[img_header_col] = self.T['msg_dl_fail']
+        sink.write_row(excel_row, cells)
+        return False
+
+    def run(self):
+        """Build the output workbook. Returns a summary dict; 'error' is set when the job could not finish."""
+        t_start = time.time()
+        self._log(self.T['log_embed_start'])
+        result = {'success': 0, 'fail': 0, 'out_file': None, 'duration': 0.0, 'stopped': False, 'error': None}
+
+        sku_col_idx = self.sku_col_idx
+        url_col_idx = self.url_col_idx
+        use_url_library = self.use_url_library
+        image_anchor_col_idx = sku_col_idx if sku_col_idx is not None else url_col_idx
+        if (use_url_library and sku_col_idx is None) or (not use_url_library and url_col_idx is None):
+            result['error'] = self.T['msg_no_url']
+            return result
+        if image_anchor_col_idx is None:
+            image_anchor_col_idx = sku_col_idx if use_url_library else url_col_idx
+        extra_field_names = self.extra_field_names
+
+        self.used_original = self.write_original
+        header_row_excel = self.header_row + 1
+        if self.write_original and self.placement != EMBED_PLACEMENT_FLOATING:
+            self._log(self.T['log_cell_images_original'])
+        try:
+            in_cell = self.placement != EMBED_PLACEMENT_FLOATING
+            if self.write_original or (self.writer == EMBED_WRITER_OPENPYXL and not in_cell):
+                if self.write_original:
+                    out_file, ws, wb_out, img_header_col, header_row_excel = \
+                        self._setup_original(image_anchor_col_idx, extra_field_names)
+                else:
+                    out_file, ws, wb_out, img_header_col, header_row_excel = \
+                        self._setup_new(image_anchor_col_idx, header_row_excel, extra_field_names)
+                sink = _OpenpyxlEmbedSink(wb_out, ws, out_file)
+            else:
+                sink, img_header_col, header_row_excel = \
+                    self._setup_stream(image_anchor_col_idx, header_row_excel, extra_field_names)
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+            return result
+        write_original = self.used_original
+        result['out_file'] = sink.path
+
+        total = len(self.df)
+        self._emit('start', total=total)
+        rows_data, row_library_records = self._collect_urls()
+        layout = {
+            'header_row_excel': header_row_excel,
+            'img_header_col': img_header_col,
+            'anchor_col_idx': image_anchor_col_idx,
+            'write_original': write_original,
+            'extra_field_names': extra_field_names,
+        }
+
+        # Processed images are spooled to disk and the sheet only references the files,
+        # so memory stays bounded by the in-flight window rather than the sheet length.
+        with tempfile.TemporaryDirectory(prefix="sheetpic-embed-") as spool_dir:
+            try:
+                success, fail = self._stream_rows(sink, rows_data, row_library_records, layout, spool_dir)
+                self._log(self.T['log_embed_save'])
+                sink.save()
+                sink.close()
+            except Exception as e:
+                try:
+                    sink.close()
+                except Exception:
+                    pass
+                result['error'] = f"{type(e).__name__}: {e}"
+                return result
+
+        _flush_download_cache()
+        result.update({
+            'success': success,
+            'fail': fail,
+            'duration': time.time() - t_start,
+            'stopped': not self.is_running,
+        })
+        return result
+
+
+class SheetPicApp:
+    def __init__(self, root):
+        self.root = root
+        self.setup_lang()
+        self.root.title(f"{self.T['title']}  v{APP_VERSION}")
+        self.root.configure(bg=COLORS['bg'])
+        if platform.system() == "Darwin":
+            self.root.geometry("620x750")
+            self.root.minsize(620, 750)
+        else:
+            self.root.geometry("600x730")
+            self.root.minsize(600, 730)
+
+        self.default_dir = os.path.join(os.path.expanduser("~"), "Desktop")
+        self.file_path = None
+        self.df = None
+        self.wb = None
+        self.sheet_images = []
+        self.header_row = 0
+        self.is_running = False
+        self.sheet_names = []
+        self._ui_thread = threading.current_thread()
+
+        # Extract state
+        self.sorted_img_cols = []
+        self.var_extract_bg = None
+        self.var_extract_shape = None
+
+        # Embed state
+        self.embed_url_col_idx = 0
+        self.embed_sku_col_idx = 0
+        self.embed_url_cols = []
+        self.embed_use_url_library = False
+        self._url_store = _open_url_library(self.URL_LIBRARY_PATH, self.CONFIG_PATH)
+        self.url_library = self._load_url_library()
+        self.url_library_records = _UrlLibraryRecords(self._url_store)
+        self.url_library_field_names = self._load_url_library_fields()
+        self.url_library_selected_fields = self._load_url_library_selected_fields()
+        self._url_library_combo_value = None
+        self.var_img_bg = None
+        self.var_img_placement = None
+        self.extract_failed_tasks = []
+        self._active_job = None
+
+        self.setup_style()
+        self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.root.after(2000, lambda: self.check_update(auto=True))
+
+    CONFIG_PATH = CONFIG_PATH
+    URL_LIBRARY_PATH = URL_LIBRARY_PATH
+
+    def setup_lang(self):
+        # 1. 读取用户手动设置
+        saved = self._load_config().get('lang')
+        if saved in LANG_MAP:
+            self.lang = saved
+            self.T = LANG_MAP[self.lang]
+            return
+
+        # 2. 自动检测系统语言
+        self.lang = self._detect_system_lang()
+        self.T = LANG_MAP[self.lang]
+
+    def _detect_system_lang(self):
+        try:
+            if platform.system() == "Darwin":
+                import subprocess
+                result = subprocess.run(
+                    ['defaults', 'read', '-g', 'AppleLanguages'],
+                    capture_output=True, text=True, timeout=3
+                )
+                if result.returncode == 0 and 'zh' in result.stdout.lower():
+                    return 'zh'
+            elif platform.system() == "Windows":
+                # Windows API: GetUserDefaultUILanguage → LANGID
+                import ctypes
+                lang_id = ctypes.windll.kernel32.GetUserDefaultUILanguage()
+                # 0x0804=zh-CN, 0x0404=zh-TW, 0x0C04=zh-HK, 0x1004=zh-SG
+                if lang_id in (0x0804, 0x0404, 0x0C04, 0x1004):
+                    return 'zh'
+                # 也检查 MUI language list
+                buf = ctypes.create_unicode_buffer(256)
+                ctypes.windll.kernel32.GetUserPreferredUILanguages(
+                    0x08, None, buf, ctypes.byref(ctypes.c_uint(256)))
+                if 'zh' in buf.value.lower():
+                    return 'zh'
+            else:
+                for var in ('LANG', 'LC_ALL', 'LC_MESSAGES'):
+                    val = os.environ.get(var, '')
+                    if 'zh' in val.lower():
+                        return 'zh'
+        except Exception:
+            pass
+        return 'en'
+
+    def _load_config(self):
+        return _read_config(self.CONFIG_PATH)
+
+    def _write_config(self, cfg):
+        with open(self.CONFIG_PATH, 'w', encoding='utf-8') as f:
+            json.dump(cfg, f, ensure_ascii=False)
+
+    def _save_config(self, lang):
+        cfg = self._load_config()
+        cfg['lang'] = lang
+        self._write_config(cfg)
+
+    def _url_library_store(self):
+        if getattr(self, '_url_store', None) is None:
+            self._url_store = _open_url_library(self.URL_LIBRARY_PATH, self.CONFIG_PATH)
+        return self._url_store
+
+    def _url_library_records(self):
+        if getattr(self, 'url_library_records', None) is None:
+            self.url_library_records = _UrlLibraryRecords(self._url_library_store())
+        return self.url_library_records
+
+    def _load_url_library(self):
+        return self._url_library_store().urls()
+
+    def _load_url_library_fields(self):
+        raw = self._url_library_store().get_meta(URL_LIBRARY_FIELDS_CONFIG_KEY, [])
+        if not isinstance(raw, list):
+            return []
+        fields = []
+        seen = set()
+        for field in raw:
+            field_name = _normalize_library_field_name(field)
+            if field_name and field_name not in seen:
+                fields.append(field_name)
+                seen.add(field_name)
+        return fields
+
+    def _load_url_library_selected_fields(self):
+        raw = self._url_library_store().get_meta(URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY, [])
+        if not isinstance(raw, list):
+            return []
+        available = set(getattr(self, 'url_library_field_names', []) or [])
+        selected = []
+        seen = set()
+        for field in raw:
+            field_name = _normalize_library_field_name(field)
+            if field_name and field_name not in seen and (not available or field_name in available):
+                selected.append(field_name)
+                seen.add(field_name)
+        return selected
+
+    def _save_url_library(self):
+        """Persist the field lists; entries are written by the import itself."""
+        store = self._url_library_store()
+        store.set_meta(URL_LIBRARY_FIELDS_CONFIG_KEY, getattr(self, 'url_library_field_names', []))
+        store.set_meta(URL_LIBRARY_SELECTED_FIELDS_CONFIG_KEY, getattr(self, 'url_library_selected_fields', []))
+
+    def switch_lang(self, lang):
+        if lang == self.lang:
+            return
+        self.lang = lang
+        self.T = LANG_MAP[lang]
+        self._save_config(lang)
+        messagebox.showinfo(
+            self.T['title'],
+            "语言已切换，程序将重启以应用更改。\nLanguage changed, restarting..." if lang == 'zh'
+            else "Language changed. The app will restart to apply.\n语言已切换，程序将重启。"
+        )
+        self.root.destroy()
+        os.execl(sys.executable, sys.executable, *sys.argv)
+
+    def setup_style(self):
+        style = ttk.Style()
+        style.theme_use('clam')
         if platform.system() == "Darwin":
             base_font = ("PingFang SC", 11)
             bold_font = ("PingFang SC", 11, "bold")
@@ -1191,6 +4446,18 @@ class SheetPicApp:
                        value=EMBED_BG_TRANSPARENT, bg=COLORS['card'], fg=COLORS['text_sub'],
                        font=("Arial", 10), activebackground=COLORS['card']).pack(side='left')
 
+        place_frame = tk.Frame(parent, bg=COLORS['card'])
+        place_frame.pack(fill='x', pady=(2, 0))
+        tk.Label(place_frame, text=self.T['lbl_img_placement'], bg=COLORS['card'],
+                 fg=COLORS['text_sub'], font=("Arial", 10)).pack(side='left', padx=(0, 8))
+        self.var_img_placement = tk.StringVar(value=EMBED_PLACEMENT_FLOATING)
+        for key, value in (('opt_place_floating', EMBED_PLACEMENT_FLOATING),
+                           ('opt_place_cell', EMBED_PLACEMENT_CELL),
+                           ('opt_place_wps', EMBED_PLACEMENT_WPS)):
+            tk.Radiobutton(place_frame, text=self.T[key], variable=self.var_img_placement,
+                           value=value, bg=COLORS['card'], fg=COLORS['text_sub'],
+                           font=("Arial", 10), activebackground=COLORS['card']).pack(side='left')
+
     # ==========================================
     # 通用方法
     # ==========================================
@@ -1249,7 +4516,6 @@ class SheetPicApp:
         name = self.combo_sheet.get()
         if name not in self.wb.sheetnames:
             return
-        self.ws = self.wb[name]
         self.log(f">>> Sheet: {name}")
         threading.Thread(target=self._reload_sheet_data, daemon=True).start()
 
@@ -1260,12 +4526,14 @@ class SheetPicApp:
         self.header_row = 0
         try:
             selected_sheet = self.combo_sheet.get()
-            self.header_row = self.find_robust_header(self.file_path, sheet_name=selected_sheet)
+            self.sheet_images = self.wb.images(selected_sheet) if self.wb else []
+            sheet = _read_excel_sheet(self.file_path, sheet_name=selected_sheet)
+            self.header_row = sheet['header_row']
             if self.header_row > 0:
-                self.root.after(0, lambda: self.log(self.T['log_header'].format(self.header_row + 1)))
-            self.df = pd.read_excel(self.file_path, header=self.header_row, sheet_name=selected_sheet)
+                self.log(self.T['log_header'].format(self.header_row + 1))
+            self.df = sheet['df']
         except Exception as e:
-            self.root.after(0, lambda: self.log(f"❌ Error: {e}"))
+            self.log(f"❌ Error: {e}")
         self.root.after(0, lambda: self.progress.stop())
         self.root.after(0, lambda: self.progress.config(mode='determinate'))
         self.root.after(0, lambda: self.progress.__setitem__('value', 0))
@@ -1332,8 +4600,10 @@ class SheetPicApp:
                 return
             self._save_url_library()
             self._refresh_url_library_status()
+            counts = self.url_library_import_counts
             self.log(self.T['msg_url_lib_imported'].format(
-                added, len(self.url_library), os.path.basename(path)
+                counts['inserted'], counts['updated'], counts['unchanged'],
+                len(self.url_library), os.path.basename(path)
             ))
             if self.df is not None and not self.df.empty:
                 self.process_df()
@@ -1345,10 +4615,10 @@ class SheetPicApp:
             return
         if not messagebox.askyesno(self.T['title'], self.T['msg_url_lib_clear_confirm']):
             return
-        self.url_library = {}
-        self.url_library_records = {}
+        self.url_library = _UrlTable()
         self.url_library_field_names = []
         self.url_library_selected_fields = []
+        self._url_library_store().clear()
         self._save_url_library()
         self._refresh_url_library_status()
         self.log(self.T['msg_url_lib_cleared'])
@@ -1418,14 +4688,10 @@ class SheetPicApp:
     def _read_table_for_url_library(self, path):
         ext = os.path.splitext(path)[1].lower()
         if ext == '.csv':
-            try:
-                return pd.read_csv(path, encoding='utf-8-sig', on_bad_lines='skip')
-            except Exception:
-                return pd.read_csv(path, encoding='gbk', on_bad_lines='skip')
+            return _read_csv_table(path)
         if ext == '.html':
             return pd.read_html(path)[0]
-        header_row = self.find_robust_header(path)
-        return pd.read_excel(path, header=header_row)
+        return _read_excel_sheet(path)['df']
 
     def _detect_url_library_columns(self, df):
         code_col_indices, url_col_idx = self._detect_url_library_mapping_columns(df)
@@ -1434,18 +4700,10 @@ class SheetPicApp:
 
     @staticmethod
     def _is_code_like_column_name(col_name):
-        name = str(col_name).strip().lower()
-        if not name or name.startswith("unnamed"):
+        compact = _compact_column_name(col_name)
+        if not compact:
             return False
-        compact = re.sub(r"\s+", "", name)
-        for keyword in URL_LIBRARY_CODE_KEYWORDS:
-            key = keyword.lower().replace(" ", "")
-            if key not in compact:
-                continue
-            if key == "id" and compact not in ("id", "商品id", "产品id") and not compact.endswith("id"):
-                continue
-            return True
-        return False
+        return _CODE_KEYWORD_MATCHER.contains(compact) or compact.endswith("id")
 
     @staticmethod
     def _combo_option_column_name(option):
@@ -1453,46 +4711,17 @@ class SheetPicApp:
 
     @staticmethod
     def _score_sku_column_name(col_name):
-        name = str(col_name).strip().lower()
-        if not name or name.startswith("unnamed"):
+        compact = _compact_column_name(col_name)
+        if not compact or _SKU_EXCLUDE_MATCHER.contains(compact):
             return -1
-        compact = re.sub(r"\s+", "", name)
-        if any(keyword in compact for keyword in SKU_COLUMN_EXCLUDE_KEYWORDS):
-            return -1
-        for keyword in SKU_COLUMN_HIGH_PRIORITY_KEYWORDS:
-            key = keyword.lower().replace(" ", "")
-            if key in compact:
-                return 200
-        for keyword in SKU_COLUMN_MEDIUM_PRIORITY_KEYWORDS:
-            key = keyword.lower().replace(" ", "")
-            if key not in compact:
-                continue
-            if key == "id" and compact not in ("id", "商品id", "产品id") and not compact.endswith("id"):
-                continue
+        if _SKU_HIGH_MATCHER.contains(compact):
+            return 200
+        if _SKU_MEDIUM_MATCHER.contains(compact) or compact.endswith("id"):
             return 100
         return -1
 
     def _best_url_library_match_col_idx(self):
-        library = getattr(self, 'url_library', {}) or {}
-        if self.df is None or self.df.empty or not library:
-            return None
-
-        best_idx = None
-        best_hits = 0
-        best_name_score = -1
-        for i, col_name in enumerate(self.df.columns):
-            hits = 0
-            for value in self.df.iloc[:, i]:
-                code = _normalize_lookup_code(value)
-                if code and code in library:
-                    hits += 1
-            name_score = self._score_sku_column_name(col_name)
-            if hits > best_hits or (hits == best_hits and hits > 0 and name_score > best_name_score):
-                best_idx = i
-                best_hits = hits
-                best_name_score = name_score
-
-        return best_idx if best_hits > 0 else None
+        return _best_url_library_match_col_idx(self.df, getattr(self, 'url_library', {}) or {})
 
     def _detect_url_library_mapping_columns(self, df):
         if df is None or df.empty:
@@ -1500,7 +4729,7 @@ class SheetPicApp:
 
         url_counts = {}
         for i in range(len(df.columns)):
-            count = self._count_http_values(df.iloc[:, i])
+            count = _count_http_values(df.iloc[:, i])
             if count > 0:
                 url_counts[i] = count
         if not url_counts:
@@ -1521,7 +4750,7 @@ class SheetPicApp:
             if self._is_code_like_column_name(col_name):
                 score += 100000
                 code_col_indices.append(i)
-            if self._count_http_values(series) > 0:
+            if _count_http_values(series) > 0:
                 score -= 100000
             if score > best_score:
                 best_score = score
@@ -1538,9 +4767,7 @@ class SheetPicApp:
             return None
 
         if not hasattr(self, 'url_library') or self.url_library is None:
-            self.url_library = {}
-        if not hasattr(self, 'url_library_records') or self.url_library_records is None:
-            self.url_library_records = {}
+            self.url_library = _UrlTable()
         if not hasattr(self, 'url_library_field_names') or self.url_library_field_names is None:
             self.url_library_field_names = []
         if not hasattr(self, 'url_library_selected_fields') or self.url_library_selected_fields is None:
@@ -1568,24 +4795,21 @@ class SheetPicApp:
             field for field in self.url_library_field_names if field in default_selected
         ]
 
-        added = 0
-        for _, row in df.iterrows():
-            url = _extract_http_url(row.iloc[url_col_idx])
-            if not url:
-                continue
-            record = {}
-            for field_col_idx, field_name in field_columns:
-                record[field_name] = _json_safe_value(row.iloc[field_col_idx])
-            row_codes = set()
-            for code_col_idx in code_col_indices:
-                code = _normalize_lookup_code(row.iloc[code_col_idx])
-                if not code or code in row_codes:
-                    continue
-                row_codes.add(code)
-                self.url_library[code] = url
-                self.url_library_records[code] = record
-                added += 1
-        return added
+        codes, urls, records = _url_library_entries(df, code_col_indices, url_col_idx, field_columns)
+        latest = dict(zip(codes, zip(urls, records)))  # later rows win
+        rows = list(_url_library_rows((code, url, record) for code, (url, record) in latest.items()))
+        store = self._url_library_store()
+        known = store.digests(latest)
+        changed = [row for row in rows if known.get(row[0]) != row[3]]
+        store.upsert_rows(changed)
+        self.url_library.update((code, url) for code, url, _, _ in changed)
+        inserted = sum(1 for row in changed if row[0] not in known)
+        self.url_library_import_counts = {
+            'inserted': inserted,
+            'updated': len(changed) - inserted,
+            'unchanged': len(rows) - len(changed),
+        }
+        return len(codes)
 
     def load_clipboard(self):
         self.log(">>> Reading clipboard...")
@@ -1606,25 +4830,7 @@ class SheetPicApp:
             self.log(f"❌ Error: {e}")
 
     def find_robust_header(self, file_path, sheet_name=0):
-        """Locate the header row in an Excel sheet.
-
-        Strategy: score the first ~15 rows on multiple signals and pick the
-        best. A real header row is characterized by:
-          - High fill ratio (close to the widest row in the sheet)
-          - Mostly string cells with short labels
-          - Unique non-null values (no duplicate column names)
-          - Followed by data rows of comparable width but with mixed types
-            (numbers / dates / mixed strings)
-          - Bonus when cells contain common header keywords
-          - Penalty when the row is sparse (likely a merged title)
-        """
-        try:
-            if os.path.splitext(file_path)[1].lower() == '.csv':
-                return 0
-            df_raw = pd.read_excel(file_path, header=None, nrows=40, sheet_name=sheet_name)
-            return _score_header_row(df_raw)
-        except Exception:
-            return 0
+        return _find_header_row(file_path, sheet_name=sheet_name)
 
     def analyze_data(self):
         self.root.after(0, lambda: self.progress.config(mode='indeterminate'))
@@ -1636,7 +4842,7 @@ class SheetPicApp:
             except Exception:
                 pass
         self.wb = None
-        self.ws = None
+        self.sheet_images = []
         self.header_row = 0
 
         try:
@@ -1645,28 +4851,26 @@ class SheetPicApp:
             selected_sheet = 0
             if ext == '.xlsx':
                 try:
-                    self.wb = openpyxl.load_workbook(self.file_path, data_only=True)
-                    self.ws = self.wb.active
+                    self.wb = _XlsxImages(self.file_path)
+                    selected_sheet = self.wb.active
+                    self.sheet_images = self.wb.images(selected_sheet)
                     self.sheet_names = self.wb.sheetnames
-                    selected_sheet = self.ws.title
                     self.root.after(0, lambda: self._update_sheet_combo(selected_sheet))
                 except Exception:
                     pass
 
-            if ext in ['.xlsx', '.xls']:
-                self.header_row = self.find_robust_header(self.file_path, sheet_name=selected_sheet)
-                if self.header_row > 0:
-                    self.log(self.T['log_header'].format(self.header_row + 1))
-
             if ext == '.csv':
-                try:
-                    self.df = pd.read_csv(self.file_path, encoding='utf-8-sig', on_bad_lines='skip')
-                except Exception:
-                    self.df = pd.read_csv(self.file_path, encoding='gbk', on_bad_lines='skip')
+                self.df, engine = _read_csv(self.file_path)
+                self.log(self.T['log_reader_engine'].format(engine))
             elif ext == '.html':
                 self.df = pd.read_html(self.file_path)[0]
             else:
-                self.df = pd.read_excel(self.file_path, header=self.header_row, sheet_name=selected_sheet)
+                sheet = _read_excel_sheet(self.file_path, sheet_name=selected_sheet)
+                self.log(self.T['log_reader_engine'].format(sheet['engine']))
+                self.header_row = sheet['header_row']
+                if self.header_row > 0:
+                    self.log(self.T['log_header'].format(self.header_row + 1))
+                self.df = sheet['df']
 
         except Exception as e:
             self.log(f"❌ Error: {e}")
@@ -1684,41 +4888,12 @@ class SheetPicApp:
         # spreadsheets, e.g. two "条码" columns or several blank header cells)
         # cause `df[name]` to return a DataFrame instead of a Series, breaking
         # `.str.contains` and silently hiding image/URL columns.
-        new_cols = []
-        seen = {}
-        for c in self.df.columns:
-            base = unnamed if str(c).startswith("Unnamed") else str(c)
-            n = seen.get(base, 0)
-            seen[base] = n + 1
-            new_cols.append(base if n == 0 else f"{base}.{n}")
-        self.df.columns = new_cols
+        self.df.columns = _dedupe_column_names(self.df.columns, unnamed)
         cols = list(self.df.columns)
 
         # --- Extract: 扫描嵌入图 + URL ---
-        embed_counts = {}
-        if self.wb:
-            for img in getattr(self.ws, '_images', []):
-                try:
-                    c = img.anchor._from.col
-                    embed_counts[c] = embed_counts.get(c, 0) + 1
-                except (AttributeError, IndexError):
-                    pass
-
-        url_counts = {}
-        for i in range(len(cols)):
-            # Access by position to avoid duplicate-name pitfalls.
-            series = self.df.iloc[:, i]
-            real_count = self._count_http_values(series)
-            if real_count > 0:
-                url_counts[i] = real_count
-
-        all_img_indices = set(embed_counts.keys()) | set(url_counts.keys())
-        self.sorted_img_cols = []
-        for idx in all_img_indices:
-            count = max(embed_counts.get(idx, 0), url_counts.get(idx, 0))
-            type_str = "embed" if idx in embed_counts else "url"
-            self.sorted_img_cols.append({'idx': idx, 'count': count, 'type': type_str})
-        self.sorted_img_cols.sort(key=lambda x: x['count'], reverse=True)
+        embed_counts = _count_anchor_columns(self.sheet_images) if self.wb else {}
+        self.sorted_img_cols, url_counts = _detect_image_columns(self.df, embed_counts)
 
         # Extract combo 选项
         img_opts = []
@@ -1753,28 +4928,14 @@ class SheetPicApp:
 
         self.root.after(0, lambda: self.update_ui_lists(img_opts, code_opts, url_opts, sku_opts))
 
-    @staticmethod
-    def _count_http_values(series):
-        sample = series.dropna().head(50)
-        if sample.empty:
-            return 0
-        sample_text = sample.astype(str)
-        if not sample_text.str.contains("http", case=False, na=False, regex=False).any():
-            return 0
-        full_text = series.dropna().astype(str)
-        return int(full_text.str.contains("http", case=False, na=False, regex=False).sum())
-
     def update_ui_lists(self, img_opts, code_opts, url_opts, sku_opts):
         # Extract combos
         self.combo_img['values'] = img_opts
         if img_opts:
             self.combo_img.current(0)
         self.combo_code['values'] = code_opts
-        best = next((x for x in code_opts if any(k in x.lower() for k in ["code", "sku", "条码", "货号"])), None)
-        if best:
-            self.combo_code.set(best)
-        elif code_opts:
-            self.combo_code.current(0)
+        if code_opts:
+            self.combo_code.set(code_opts[_default_code_col_idx(code_opts)])
         self.combo_img.config(state='readonly')
         self.combo_code.config(state='readonly')
 
@@ -1864,6 +5025,15 @@ class SheetPicApp:
             return mode
         return EMBED_BG_WHITE
 
+    def _get_embed_placement(self):
+        var = getattr(self, 'var_img_placement', None)
+        if var is None:
+            return EMBED_PLACEMENT_FLOATING
+        mode = var.get()
+        if mode in (EMBED_PLACEMENT_FLOATING, EMBED_PLACEMENT_CELL, EMBED_PLACEMENT_WPS):
+            return mode
+        return EMBED_PLACEMENT_FLOATING
+
     def _get_extract_image_options(self):
         bg_var = getattr(self, 'var_extract_bg', None)
         shape_var = getattr(self, 'var_extract_shape', None)
@@ -1912,399 +5082,98 @@ class SheetPicApp:
 
     def stop_thread(self):
         self.is_running = False
+        job = getattr(self, '_active_job', None)
+        if job is not None:
+            job.stop()
         self.log(">>> Stopping...")
         self.btn_stop.config(state='disabled')
         self.lbl_status.config(text=self.T['status_stop'])
-        self.progress.stop()
-
-    # ==========================================
-    # 提取图片处理
-    # ==========================================
-
-    def run_extract_process(self):
-        t_start = time.time()
-        self._process_start_time = t_start
-        self.extract_failed_tasks = []
-        self.root.after(0, self._update_retry_button_state)
-        dest = self.entry_dest.get()
-        fname = "Clipboard" if self.file_path == "Clipboard" else os.path.splitext(os.path.basename(self.file_path))[0]
-        out_dir = os.path.join(dest, f"{fname}_Img")
-        if not os.path.exists(out_dir):
-            os.makedirs(out_dir)
-
-        idx_code = self._get_col_index(self.combo_code.get())
-        selection = self.combo_img.get()
-        target_cols = []
-
-        if "★" in selection:
-            target_cols = self.sorted_img_cols
-        else:
-            sel_idx = self._get_col_index(selection)
-            for item in self.sorted_img_cols:
-                if item['idx'] == sel_idx:
-                    target_cols = [item]
-                    break
-
-        img_map_row_col = {}
-        if self.wb:
-            for img in getattr(self.ws, '_images', []):
-                r = img.anchor._from.row
-                c = img.anchor._from.col
-                if r not in img_map_row_col:
-                    img_map_row_col[r] = {}
-                img_map_row_col[r][c] = img
-
-        success = 0
-        fail = 0
-        skipped = 0
-        self.progress['maximum'] = len(self.df)
-        tasks = {}
-        planned_names = set()
-        extract_options = self._get_extract_image_options()
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            for i in range(len(self.df)):
-                if not self.is_running:
-                    break
-
-                code = str(self.df.iloc[i, idx_code]).strip()
-                base_name = "".join([c for c in code if c.isalnum() or c in '-_'])
-                if not base_name:
-                    base_name = f"Row_{i+1}"
-
-                row_images = []
-                for col_info in target_cols:
-                    c_idx = col_info['idx']
-                    if col_info['type'] == 'embed':
-                        excel_row = self.header_row + 1 + i
-                        if excel_row in img_map_row_col and c_idx in img_map_row_col[excel_row]:
-                            img_obj = img_map_row_col[excel_row][c_idx]
-                            row_images.append(('embed', img_obj))
-                    elif col_info['type'] == 'url':
-                        val = str(self.df.iloc[i, c_idx]).strip()
-                        if not val or val.lower() == 'nan' or "http" not in val.lower():
-                            if val and val.lower() != 'nan':
-                                self.root.after(0, lambda v=val: self.log(
-                                    self.T['msg_invalid_url'].format(base_name, v[:60])))
-                            continue
-                        if not val.startswith("http"):
-                            m = re.search(r'(https?://[^\s;]+)', val)
-                            if m:
-                                val = m.group(1)
-                            else:
-                                self.root.after(0, lambda v=val: self.log(
-                                    self.T['msg_invalid_url'].format(base_name, v[:60])))
-                                continue
-                        val = self.clean_url(val.split('?')[0].split('!')[0])
-                        row_images.append(('url', val))
-
-                if not row_images:
-                    skipped += 1
-                    self.root.after(0, self.update_progress_ext, i+1+len(tasks), len(self.df), success, fail, skipped, self.T['msg_skip'].format(base_name))
-                    continue
-
-                for img_idx, (src_type, src_data) in enumerate(row_images):
-                    suffix = f"-{img_idx}" if img_idx > 0 else ""
-                    final_name = f"{base_name}{suffix}"
-                    if final_name in planned_names or self._extract_output_exists(out_dir, final_name):
-                        skipped += 1
-                        self.root.after(0, self.update_progress_ext, i+1, len(self.df), success, fail, skipped,
-                                        self.T['msg_same_name_skip'].format(final_name))
-                        continue
-                    planned_names.add(final_name)
-
-                    if src_type == 'embed':
-                        try:
-                            raw_data = src_data._data()
-                            if _extract_options_require_processing(extract_options):
-                                is_ok, msg = self._save_processed_extract_image(
-                                    raw_data,
-                                    final_name,
-                                    out_dir,
-                                    extract_options
-                                )
-                                if is_ok:
-                                    success += 1
-                                else:
-                                    fail += 1
-                                    self.root.after(0, lambda m=msg: self.log(m))
-                            else:
-                                ext = ".png" if src_data.format == "png" else ".jpg"
-                                path = os.path.join(out_dir, final_name + ext)
-                                with open(path, "wb") as f:
-                                    f.write(raw_data)
-                                success += 1
-                        except Exception as e:
-                            fail += 1
-                            self.root.after(0, lambda n=final_name, err=e: self.log(
-                                self.T['msg_err'].format(n, f"{type(err).__name__}: {str(err)[:60]}")
-                            ))
-                    else:
-                        task = {'url': src_data, 'filename_base': final_name, 'out_dir': out_dir}
-                        if extract_options:
-                            task['extract_options'] = extract_options
-                            future = executor.submit(
-                                self.download_url,
-                                task['url'],
-                                task['filename_base'],
-                                task['out_dir'],
-                                task['extract_options']
-                            )
-                        else:
-                            future = executor.submit(
-                                self.download_url,
-                                task['url'],
-                                task['filename_base'],
-                                task['out_dir']
-                            )
-                        tasks[future] = task
-
-                self.root.after(0, self.update_progress_ext, i+1, len(self.df), success, fail, skipped, "Process")
-
-            done_count = i if 'i' in locals() else 0
-            for future in concurrent.futures.as_completed(tasks):
-                if not self.is_running:
-                    break
-                task = tasks[future]
-                try:
-                    is_ok, msg = future.result()
-                except Exception as e:
-                    is_ok, msg = False, self.T['msg_err'].format(
-                        task['filename_base'],
-                        f"{type(e).__name__}: {str(e)[:60]}"
-                    )
-                if is_ok:
-                    success += 1
-                else:
-                    fail += 1
-                    self.extract_failed_tasks.append(task)
-                self.root.after(0, self.update_progress_ext, len(self.df), len(self.df), success, fail, skipped, msg)
-
-        duration = time.time() - t_start
-        self.root.after(0, lambda: self.extract_finish(success, fail, skipped, out_dir, duration))
-
-    def run_extract_retry_process(self, retry_tasks):
-        t_start = time.time()
-        self._process_start_time = t_start
-        total = len(retry_tasks)
-        if total == 0:
-            self.root.after(0, self._update_retry_button_state)
-            return
-
-        success = 0
-        fail = 0
-        skipped = 0
-        out_dir = retry_tasks[0].get('out_dir', self.entry_dest.get())
-        self.progress['maximum'] = total
+        self.progress.stop()
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {}
-            planned_names = set()
-            skipped_before_submit = 0
-            for task in retry_tasks:
-                if not self.is_running:
-                    self.extract_failed_tasks.append(task)
-                    continue
-                filename_base = task['filename_base']
-                if filename_base in planned_names or self._extract_output_exists(task['out_dir'], filename_base):
-                    skipped += 1
-                    skipped_before_submit += 1
-                    planned_names.add(filename_base)
-                    self.root.after(
-                        0,
-                        self.update_progress_ext,
-                        skipped_before_submit,
-                        total,
-                        success,
-                        fail,
-                        skipped,
-                        self.T['msg_same_name_skip'].format(filename_base)
-                    )
-                    continue
-                planned_names.add(filename_base)
-                extract_options = task.get('extract_options')
-                if extract_options:
-                    future = executor.submit(
-                        self.download_url,
-                        task['url'],
-                        filename_base,
-                        task['out_dir'],
-                        extract_options
-                    )
-                else:
-                    future = executor.submit(
-                        self.download_url,
-                        task['url'],
-                        filename_base,
-                        task['out_dir']
-                    )
-                futures[future] = task
+    # ==========================================
+    # 提取图片处理
+    # ==========================================
 
-            completed = skipped_before_submit
-            for future in concurrent.futures.as_completed(futures):
-                task = futures[future]
-                if not self.is_running:
-                    self.extract_failed_tasks.append(task)
-                    continue
-                try:
-                    is_ok, msg = future.result()
-                except Exception as e:
-                    is_ok, msg = False, self.T['msg_err'].format(
-                        task['filename_base'],
-                        f"{type(e).__name__}: {str(e)[:60]}"
-                    )
-                completed += 1
-                if is_ok:
-                    success += 1
-                else:
-                    fail += 1
-                    self.extract_failed_tasks.append(task)
-                self.root.after(0, self.update_progress_ext, completed, total, success, fail, skipped, msg)
+    def _on_extract_event(self, event):
+        kind = event['type']
+        if kind == 'start':
+            self.root.after(0, self.progress.__setitem__, 'maximum', event['total'])
+        elif kind == 'log':
+            self.root.after(0, self.log, event['message'])
+        elif kind == 'progress':
+            self.root.after(0, self.update_progress_ext, event['current'], event['total'],
+                            event['success'], event['fail'], event['skipped'], event['message'])
+
+    def _on_embed_event(self, event):
+        kind = event['type']
+        if kind == 'start':
+            self.root.after(0, self.progress.__setitem__, 'maximum', event['total'])
+        elif kind == 'log':
+            self.root.after(0, self.log, event['message'])
+        elif kind == 'progress':
+            self.root.after(0, self.update_progress_emb, event['current'], event['total'],
+                            event['success'], event['fail'])
+
+    def _new_extract_job(self, **kwargs):
+        job = ExtractJob(T=self.T, on_event=self._on_extract_event, download=self.download_url, **kwargs)
+        self._active_job = job
+        return job
 
-        duration = time.time() - t_start
-        self.root.after(0, lambda: self.extract_finish(success, fail, skipped, out_dir, duration))
+    def run_extract_process(self):
+        self._process_start_time = time.time()
+        self.extract_failed_tasks = []
+        self.root.after(0, self._update_retry_button_state)
+        dest = self.entry_dest.get()
+        fname = "Clipboard" if self.file_path == "Clipboard" else os.path.splitext(os.path.basename(self.file_path))[0]
+        out_dir = os.path.join(dest, f"{fname}_Img")
 
-    MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+        idx_code = self._get_col_index(self.combo_code.get())
+        selection = self.combo_img.get()
+        target_cols = []
 
-    def _remove_file_quietly(self, path):
-        if not path:
-            return
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-        except OSError:
-            pass
+        if "★" in selection:
+            target_cols = self.sorted_img_cols
+        else:
+            sel_idx = self._get_col_index(selection)
+            for item in self.sorted_img_cols:
+                if item['idx'] == sel_idx:
+                    target_cols = [item]
+                    break
 
-    def _write_extract_file_atomic(self, path, data):
-        temp_path = path + ".part"
-        self._remove_file_quietly(temp_path)
-        try:
-            with open(temp_path, 'wb') as f:
-                f.write(data)
-            os.replace(temp_path, path)
-            return True
-        except OSError:
-            self._remove_file_quietly(temp_path)
-            return False
+        job = self._new_extract_job(
+            df=self.df,
+            out_dir=out_dir,
+            code_col_idx=idx_code,
+            img_cols=target_cols,
+            header_row=self.header_row,
+            image_map=_build_image_anchor_map(self.sheet_images) if self.wb else None,
+            extract_options=self._get_extract_image_options(),
+        )
+        result = job.run()
+        self.extract_failed_tasks = job.failed_tasks
+        self.root.after(0, lambda: self.extract_finish(
+            result['success'], result['fail'], result['skipped'], result['out_dir'], result['duration']))
 
-    def _save_processed_extract_image(self, image_data, filename_base, out_dir, options):
-        try:
-            pil_img = PILImage.open(BytesIO(image_data))
-            pil_img.load()
-            buf, ext = _prepare_extract_image_bytes(
-                pil_img,
-                bg_mode=options.get('bg_mode', EXTRACT_BG_ORIGINAL),
-                shape=options.get('shape', EXTRACT_SHAPE_ORIGINAL),
-                add_border=bool(options.get('add_border')),
-            )
-        except Exception as e:
-            return False, self.T['msg_bad_image'].format(filename_base, str(e)[:60])
+    def run_extract_retry_process(self, retry_tasks):
+        self._process_start_time = time.time()
+        if not retry_tasks:
+            self.root.after(0, self._update_retry_button_state)
+            return
 
-        path = os.path.join(out_dir, filename_base + ext)
-        if not self._write_extract_file_atomic(path, buf.getvalue()):
-            return False, self.T['msg_err'].format(filename_base, "Could not write file")
-        return True, "OK"
+        job = self._new_extract_job(out_dir=self.entry_dest.get())
+        result = job.run_retry(retry_tasks)
+        self.extract_failed_tasks = getattr(self, 'extract_failed_tasks', []) + job.failed_tasks
+        self.root.after(0, lambda: self.extract_finish(
+            result['success'], result['fail'], result['skipped'], result['out_dir'], result['duration']))
 
     def _extract_output_exists(self, out_dir, filename_base):
-        try:
-            for name in os.listdir(out_dir):
-                stem, ext = os.path.splitext(name)
-                if stem == filename_base and ext:
-                    path = os.path.join(out_dir, name)
-                    try:
-                        if os.path.isfile(path) and os.path.getsize(path) == 0:
-                            self._remove_file_quietly(path)
-                            continue
-                    except OSError:
-                        pass
-                    return True
-        except OSError:
-            return False
-        return False
+        return _extract_output_exists(out_dir, filename_base)
 
     def download_url(self, url, filename_base, out_dir, extract_options=None):
-        if not self.is_running:
-            return False, "Stopped"
-        process_image = _extract_options_require_processing(extract_options)
-        for attempt in range(EXTRACT_TIMEOUT_RETRIES + 1):
-            path = None
-            temp_path = None
-            try:
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                r = requests.get(url, headers=headers, timeout=10, stream=True)
-                if not self.is_running:
-                    return False, "Stopped"
-                if r.status_code == 200:
-                    cl = int(r.headers.get('Content-Length', 0))
-                    if cl > self.MAX_FILE_SIZE:
-                        return False, self.T['msg_too_large'].format(filename_base, cl // 1024 // 1024)
-                    ct = r.headers.get('Content-Type', '').lower()
-                    ext = mimetypes.guess_extension(ct)
-                    if not ext:
-                        ext = ".jpg"
-                    path = os.path.join(out_dir, filename_base + ext)
-                    written = 0
-                    if process_image:
-                        chunks = []
-                        for chunk in r.iter_content(8192):
-                            if not self.is_running:
-                                return False, "Stopped"
-                            written += len(chunk)
-                            if written > self.MAX_FILE_SIZE:
-                                return False, self.T['msg_too_large'].format(filename_base, written // 1024 // 1024)
-                            chunks.append(chunk)
-                        if written == 0:
-                            if attempt < EXTRACT_TIMEOUT_RETRIES:
-                                continue
-                            return False, self.T['msg_err'].format(filename_base, "Empty download")
-                        return self._save_processed_extract_image(
-                            b''.join(chunks),
-                            filename_base,
-                            out_dir,
-                            extract_options
-                        )
-                    else:
-                        temp_path = path + ".part"
-                        self._remove_file_quietly(temp_path)
-                        with open(temp_path, 'wb') as f:
-                            for chunk in r.iter_content(8192):
-                                if not self.is_running:
-                                    self._remove_file_quietly(temp_path)
-                                    return False, "Stopped"
-                                written += len(chunk)
-                                if written > self.MAX_FILE_SIZE:
-                                    f.close()
-                                    self._remove_file_quietly(temp_path)
-                                    return False, self.T['msg_too_large'].format(filename_base, written // 1024 // 1024)
-                                f.write(chunk)
-                        if written == 0:
-                            self._remove_file_quietly(temp_path)
-                            if attempt < EXTRACT_TIMEOUT_RETRIES:
-                                continue
-                            return False, self.T['msg_err'].format(filename_base, "Empty download")
-                        os.replace(temp_path, path)
-                        return True, "OK"
-                elif r.status_code == 404:
-                    return False, self.T['msg_404'].format(filename_base)
-                else:
-                    return False, self.T['msg_err'].format(filename_base, f"HTTP {r.status_code} ({url[:60]})")
-            except requests.exceptions.Timeout:
-                self._remove_file_quietly(temp_path)
-                if attempt < EXTRACT_TIMEOUT_RETRIES:
-                    continue
-                return False, self.T['msg_timeout'].format(filename_base)
-            except requests.exceptions.SSLError as e:
-                self._remove_file_quietly(temp_path)
-                return False, self.T['msg_ssl_err'].format(filename_base, str(e)[:80])
-            except requests.exceptions.ConnectionError as e:
-                self._remove_file_quietly(temp_path)
-                return False, self.T['msg_conn_err'].format(filename_base, str(e)[:80])
-            except Exception as e:
-                self._remove_file_quietly(temp_path)
-                if attempt == 0:
-                    continue
-                return False, self.T['msg_err'].format(filename_base, f"{type(e).__name__}: {str(e)[:60]}")
-        return False, self.T['msg_err'].format(filename_base, "Max retries exceeded")
+        return _download_url_to_file(
+            url, filename_base, out_dir, extract_options,
+            T=self.T, is_running=lambda: self.is_running
+        )
 
     def _format_eta(self, current, total):
         if current <= 0 or not hasattr(self, '_process_start_time'):
@@ -2347,63 +5216,28 @@ class SheetPicApp:
     # 嵌入图片处理
     # ==========================================
 
-    def clean_url(self, url):
-        original = url
-        url = re.sub(r'!\d+x\d+', '', url)
-        url = re.sub(r'\?imageView2/[^&]*', '', url)
-        url = re.sub(r'\?x-oss-process=[^&]*', '', url)
-        url = re.sub(r'[?&](width|height|w|h|size|resize|quality|format)=[^&]*', '', url)
-        url = re.sub(r'\?\d+$', '', url)
-        url = re.sub(r'\?&+', '?', url)
-        url = re.sub(r'\?$', '', url)
-        if url != original:
-            self.root.after(0, lambda: self.log(f"URL clean: {original[:60]}... -> {url[:60]}..."))
-        return url
-
     def download_to_bytesio(self, url, max_dim=None, bg_mode=EMBED_BG_WHITE):
-        if not self.is_running:
-            return False, "Stopped"
-        for attempt in range(2):
-            try:
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                r = requests.get(url, headers=headers, timeout=10)
-                if not self.is_running:
-                    return False, "Stopped"
-                if r.status_code == 200:
-                    cl = int(r.headers.get('Content-Length', 0))
-                    if cl > self.MAX_FILE_SIZE:
-                        return False, self.T['msg_too_large'].format(url[:50], cl // 1024 // 1024)
-                    try:
-                        pil_img = PILImage.open(BytesIO(r.content))
-                    except Exception as e:
-                        return False, self.T['msg_bad_image'].format(url[:50], str(e)[:60])
-                    return True, _prepare_embed_image_bytes(pil_img, max_dim, bg_mode)
-                elif r.status_code == 404:
-                    return False, self.T['msg_404'].format(url[:50])
-                else:
-                    return False, self.T['msg_err'].format(url[:50], f"HTTP {r.status_code} ({url[:60]})")
-            except requests.exceptions.Timeout:
-                if attempt == 0:
-                    continue
-                return False, self.T['msg_timeout'].format(url[:50])
-            except requests.exceptions.SSLError as e:
-                return False, self.T['msg_ssl_err'].format(url[:50], str(e)[:80])
-            except requests.exceptions.ConnectionError as e:
-                return False, self.T['msg_conn_err'].format(url[:50], str(e)[:80])
-            except Exception as e:
-                if attempt == 0:
-                    continue
-                return False, self.T['msg_err'].format(url[:50], f"{type(e).__name__}: {str(e)[:60]}")
-        return False, self.T['msg_err'].format(url[:50], "Max retries exceeded")
+        return _download_embed_image(url, max_dim, bg_mode, T=self.T, is_running=lambda: self.is_running)
+
+    def _new_embed_job(self, fname, **kwargs):
+        job = EmbedJob(
+            df=self.df,
+            dest_dir=self.entry_dest.get(),
+            name=fname,
+            source_path=self.file_path,
+            header_row=self.header_row,
+            T=self.T,
+            on_event=self._on_embed_event,
+            download=self.download_to_bytesio,
+            **kwargs
+        )
+        self._active_job = job
+        return job
 
     def run_embed_process(self):
-        t_start = time.time()
-        self._process_start_time = t_start
-        dest = self.entry_dest.get()
+        self._process_start_time = time.time()
         fname = "Clipboard" if self.file_path == "Clipboard" else os.path.splitext(os.path.basename(self.file_path))[0]
 
-        self.root.after(0, lambda: self.log(self.T['log_embed_start']))
-
         if self.var_original.get():
             max_dim = None
         else:
@@ -2411,260 +5245,42 @@ class SheetPicApp:
                 max_dim = int(self.entry_max_dim.get())
             except ValueError:
                 max_dim = 500
-        bg_mode = self._get_embed_bg_mode()
-
-        sku_col_idx = self.embed_sku_col_idx
         use_url_library = bool(getattr(self, 'embed_use_url_library', False))
-        url_col_idx = self.embed_url_col_idx
-        image_anchor_col_idx = sku_col_idx if sku_col_idx is not None else url_col_idx
-        if (use_url_library and sku_col_idx is None) or (not use_url_library and url_col_idx is None):
-            self.root.after(0, self.embed_error_finish, self.T['msg_no_url'])
-            return
-        if image_anchor_col_idx is None:
-            image_anchor_col_idx = sku_col_idx if use_url_library else url_col_idx
-        write_original = self.var_write_original.get()
-        self._embed_setup_used_original = write_original
         extra_field_names = self._get_selected_url_library_fields() if use_url_library else []
-
-        header_row_excel = self.header_row + 1
-        try:
-            if write_original:
-                out_file, ws, wb_out, img_header_col, header_row_excel = \
-                    self._embed_setup_original(fname, image_anchor_col_idx, extra_field_names)
-            else:
-                out_file, ws, wb_out, img_header_col, header_row_excel = \
-                    self._embed_setup_new(fname, image_anchor_col_idx, header_row_excel, extra_field_names)
-        except Exception as e:
-            self.root.after(0, self.embed_error_finish, f"{type(e).__name__}: {e}")
-            return
-        write_original = self._embed_setup_used_original
-
-        orig_cols = list(self.df.columns)
-        total = len(self.df)
-        self.progress['maximum'] = total
-
-        # Collect URLs
-        rows_data = []
-        row_library_records = []
-        library_matches = 0
-        for i in range(total):
-            record = {}
-            if use_url_library:
-                code = _normalize_lookup_code(self.df.iloc[i, sku_col_idx])
-                url = getattr(self, 'url_library', {}).get(code)
-                record = getattr(self, 'url_library_records', {}).get(code, {})
-                if url:
-                    library_matches += 1
-                    url = self.clean_url(url)
-            else:
-                url_raw_value = self.df.iloc[i, url_col_idx]
-                url_raw = str(url_raw_value).strip()
-                url = _extract_http_url(url_raw_value)
-                if url:
-                    url = self.clean_url(url)
-                elif url_raw and url_raw.lower() != 'nan':
-                        self.root.after(0, lambda u=url_raw: self.log(
-                            self.T['msg_invalid_url'].format(f"Row {i+1}", u[:60])))
-            rows_data.append(url)
-            row_library_records.append(record)
-
-        if use_url_library:
-            self.root.after(0, lambda: self.log(
-                self.T['msg_url_lib_matches'].format(library_matches, total)
-            ))
-
-        success = 0
-        fail = 0
-        row_results = [None] * total
-
-        # Download concurrently
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {}
-            for i, url in enumerate(rows_data):
-                if not self.is_running:
-                    break
-                if url:
-                    futures[executor.submit(self.download_to_bytesio, url, max_dim, bg_mode)] = i
-                else:
-                    futures[executor.submit(lambda: (False, "No URL"))] = i
-
-            completed = 0
-            for future in concurrent.futures.as_completed(futures):
-                if not self.is_running:
-                    break
-                row_idx = futures[future]
-                try:
-                    is_ok, result = future.result()
-                except Exception as e:
-                    is_ok, result = False, str(e)
-                row_results[row_idx] = (is_ok, result)
-                completed += 1
-                self.root.after(0, self.update_progress_emb, completed, total, success, fail)
-
-        # Embed images into sheet
-        for i, result in enumerate(row_results):
-            if not self.is_running:
-                break
-            if result is None:
-                result = (False, "Stopped")
-
-            is_ok, data = result
-
-            excel_row = header_row_excel + 1 + i
-            if not write_original:
-                # Write cell values for new-workbook mode
-                out_col = 1
-                for j in range(len(orig_cols)):
-                    cell_val = str(self.df.iloc[i, j]) if self.df.iloc[i, j] is not None else ""
-                    if cell_val.lower() == 'nan':
-                        cell_val = ""
-                    ws.cell(row=excel_row, column=out_col, value=cell_val)
-                    out_col += 1
-                    if j == image_anchor_col_idx:
-                        out_col += 1 + len(extra_field_names)
-
-            img_col_letter = get_column_letter(img_header_col)
-            if extra_field_names:
-                record = row_library_records[i] if i < len(row_library_records) else {}
-                for offset, field_name in enumerate(extra_field_names, start=1):
-                    ws.cell(
-                        row=excel_row,
-                        column=img_header_col + offset,
-                        value=_json_safe_value(record.get(field_name, ''))
-                    )
-            if is_ok:
-                try:
-                    xl_img = XlImage(data)
-                    row_height_pt = 40
-                    ws.row_dimensions[excel_row].height = row_height_pt
-                    img_ratio = xl_img.width / xl_img.height if xl_img.height > 0 else 1
-                    col_width = row_height_pt * 1.33 * img_ratio / 7 + 1
-                    ws.column_dimensions[img_col_letter].width = max(col_width, 12)
-                    scaled_h = int(row_height_pt * 1.33)
-                    scaled_w = int(scaled_h * img_ratio)
-                    xl_img.width = scaled_w
-                    xl_img.height = scaled_h
-                    ws.add_image(xl_img, f"{img_col_letter}{excel_row}")
-                    success += 1
-                except Exception:
-                    ws.cell(row=excel_row, column=img_header_col, value=self.T['msg_dl_fail'])
-                    fail += 1
-            else:
-                ws.cell(row=excel_row, column=img_header_col, value=self.T['msg_dl_fail'])
-                fail += 1
-
-        # Handle stopped rows
-        if not self.is_running:
-            for i in range(total):
-                if row_results[i] is None:
-                    excel_row = header_row_excel + 1 + i
-                    if not write_original:
-                        out_col = 1
-                        for j in range(len(orig_cols)):
-                            cell_val = str(self.df.iloc[i, j]) if self.df.iloc[i, j] is not None else ""
-                            if cell_val.lower() == 'nan':
-                                cell_val = ""
-                            ws.cell(row=excel_row, column=out_col, value=cell_val)
-                            out_col += 1
-                            if j == image_anchor_col_idx:
-                                out_col += 1 + len(extra_field_names)
-                    ws.cell(row=excel_row, column=img_header_col, value=self.T['msg_dl_skip'])
-
-        self.root.after(0, lambda: self.log(self.T['log_embed_save']))
-        try:
-            wb_out.save(out_file)
-            wb_out.close()
-        except Exception as e:
-            try:
-                wb_out.close()
-            except Exception:
-                pass
-            self.root.after(0, self.embed_error_finish, f"{type(e).__name__}: {e}")
+        url_library_records = {}
+        if extra_field_names and self.embed_sku_col_idx is not None:
+            # only the records of this sheet's codes are read from the library
+            codes = set(_normalize_lookup_codes(self.df.iloc[:, self.embed_sku_col_idx]))
+            codes.discard('')
+            url_library_records = self._url_library_records().fetch(codes)
+
+        job = self._new_embed_job(
+            fname,
+            url_col_idx=self.embed_url_col_idx,
+            sku_col_idx=self.embed_sku_col_idx,
+            use_url_library=use_url_library,
+            url_library=getattr(self, 'url_library', {}),
+            url_library_records=url_library_records,
+            extra_field_names=extra_field_names,
+            max_dim=max_dim,
+            bg_mode=self._get_embed_bg_mode(),
+            write_original=self.var_write_original.get(),
+            placement=self._get_embed_placement(),
+        )
+        result = job.run()
+        self._embed_setup_used_original = job.used_original
+        if result['error']:
+            self.root.after(0, self.embed_error_finish, result['error'])
             return
-
-        duration = time.time() - t_start
-        self.root.after(0, lambda: self.embed_finish(success, fail, out_file, duration))
-
-    def _embed_setup_new(self, fname, source_col_idx, header_row_excel=1, extra_field_names=None):
-        """Create a new workbook for embedding. Returns (out_file, ws, wb, img_header_col, header_row_excel)."""
-        extra_field_names = extra_field_names or []
-        dest = self.entry_dest.get()
-        out_file = os.path.join(dest, f"{fname}_Embedded.xlsx")
-        wb_out = openpyxl.Workbook()
-        ws = wb_out.active
-
-        orig_cols = list(self.df.columns)
-        out_col = 1
-        img_header_col = 1
-        for i, col_name in enumerate(orig_cols):
-            ws.cell(row=header_row_excel, column=out_col, value=col_name)
-            out_col += 1
-            if i == source_col_idx:
-                ws.cell(row=header_row_excel, column=out_col, value="图片")
-                img_header_col = out_col
-                out_col += 1
-                for field_name in extra_field_names:
-                    ws.cell(row=header_row_excel, column=out_col, value=field_name)
-                    out_col += 1
-
-        return out_file, ws, wb_out, img_header_col, header_row_excel
+        self.root.after(0, lambda: self.embed_finish(
+            result['success'], result['fail'], result['out_file'], result['duration']))
 
     def _embed_setup_original(self, fname, source_col_idx, extra_field_names=None):
         """Load original workbook, insert image column. Returns (out_file, ws, wb, img_header_col, header_row_excel)."""
-        extra_field_names = extra_field_names or []
-        dest = self.entry_dest.get()
-        out_file = os.path.join(dest, f"{fname}_WithImages.xlsx")
-        header_row_excel = self.header_row + 1
-
-        if self.file_path == "Clipboard" or not os.path.exists(self.file_path):
-            # Clipboard mode: fallback to new workbook
-            self._embed_setup_used_original = False
-            return self._embed_setup_new(fname, source_col_idx, header_row_excel, extra_field_names)
-
-        ext = os.path.splitext(self.file_path)[1].lower()
-        if ext != '.xlsx':
-            display_ext = ext or "current file"
-            self.root.after(0, lambda e=display_ext: self.log(
-                self.T['log_embed_format_fallback'].format(e)))
-            self._embed_setup_used_original = False
-            return self._embed_setup_new(fname, source_col_idx, header_row_excel, extra_field_names)
-
-        wb_out = openpyxl.load_workbook(self.file_path)
-        ws = wb_out.active
-
-        # Find header row and the source/anchor column in the Excel sheet.
-        source_col_name = str(self.df.columns[source_col_idx])
-
-        source_excel_col = None
-        for col_idx in range(1, ws.max_column + 1):
-            cell_val = ws.cell(row=header_row_excel, column=col_idx).value
-            if cell_val is not None and str(cell_val).strip() == source_col_name:
-                source_excel_col = col_idx
-                break
-
-        if source_excel_col is None:
-            # Fallback: search all rows for the header
-            for r in range(1, min(ws.max_row + 1, 20)):
-                for c in range(1, ws.max_column + 1):
-                    cell_val = ws.cell(row=r, column=c).value
-                    if cell_val is not None and str(cell_val).strip() == source_col_name:
-                        source_excel_col = c
-                        header_row_excel = r
-                        break
-                if source_excel_col:
-                    break
-
-        if source_excel_col is None:
-            # Last resort: use column index directly
-            source_excel_col = source_col_idx + 1
-
-        img_header_col = source_excel_col + 1
-        ws.insert_cols(img_header_col, amount=1 + len(extra_field_names))
-        ws.cell(row=header_row_excel, column=img_header_col, value="图片")
-        for offset, field_name in enumerate(extra_field_names, start=1):
-            ws.cell(row=header_row_excel, column=img_header_col + offset, value=field_name)
-
-        return out_file, ws, wb_out, img_header_col, header_row_excel
+        job = self._new_embed_job(fname, write_original=True)
+        setup = job._setup_original(source_col_idx, extra_field_names)
+        self._embed_setup_used_original = job.used_original
+        return setup
 
     def update_progress_emb(self, current, total, success, fail):
         if not self.is_running:
@@ -2781,6 +5397,9 @@ class SheetPicApp:
 
     def on_closing(self):
         self.is_running = False
+        job = getattr(self, '_active_job', None)
+        if job is not None:
+            job.stop()
         if self.wb:
             try:
                 self.wb.close()
@@ -2790,7 +5409,352 @@ class SheetPicApp:
         os._exit(0)
 
 
+# ==========================================
+# 命令行: python -m sheetpic extract|embed|cache ...
+# ==========================================
+CLI_COMMANDS = ('extract', 'embed', 'cache')
+
+
+def _expand_input_paths(patterns):
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.expanduser(pattern), recursive=True))
+        if not matches and os.path.isfile(pattern):
+            matches = [pattern]
+        for path in matches:
+            # Skip Office lock files (~$Book.xlsx) and directories.
+            if os.path.basename(path).startswith('~$') or not os.path.isfile(path):
+                continue
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                paths.append(path)
+    return paths
+
+
+def _resolve_column(columns, selector):
+    """Resolve a column selector (header name or Excel-style letter) to a position."""
+    if selector is None:
+        return None
+    names = [str(c) for c in columns]
+    text = str(selector).strip()
+    if text in names:
+        return names.index(text)
+    lowered = [n.strip().lower() for n in names]
+    if text.lower() in lowered:
+        return lowered.index(text.lower())
+    if re.fullmatch(r'[A-Za-z]{1,3}', text):
+        idx = column_index_from_string(text.upper()) - 1
+        if idx < len(names):
+            return idx
+    raise ValueError(f"Column not found: {selector}")
+
+
+def _cli_event_printer(label):
+    def _print(event):
+        if event['type'] == 'log':
+            print(f"[{label}] {event['message']}", file=sys.stderr, flush=True)
+        elif event['type'] == 'progress' and event.get('message') not in (None, '', 'OK', 'Process'):
+            print(f"[{label}] {event['message']}", file=sys.stderr, flush=True)
+    return _print
+
+
+def _cli_process_file(command, path, opts):
+    """Run one extract/embed job for `path`; returns a JSON-serializable summary."""
+    summary = {'input': path, 'ok': False, 'error': None}
+    t_start = time.time()
+    loaded = None
+    try:
+        T = LANG_MAP.get(opts['lang'], LANG_MAP['en'])
+        loaded = _load_sheet(path, sheet_name=opts.get('sheet'), unnamed=T['unnamed'])
+        df = loaded['df']
+        name = os.path.splitext(os.path.basename(path))[0]
+        on_event = _cli_event_printer(os.path.basename(path)) if opts.get('verbose') else None
+        summary['sheet'] = loaded['sheet']
+        summary['engine'] = loaded['engine']
+        summary['rows'] = len(df)
+        if df.empty:
+            raise ValueError("Sheet is empty")
+
+        if command == 'extract':
+            image_map = _build_image_anchor_map(loaded['images'])
+            img_cols, _ = _detect_image_columns(df, _count_anchor_columns(loaded['images']))
+            if opts.get('image_cols'):
+                wanted = {_resolve_column(df.columns, sel) for sel in opts['image_cols']}
+                img_cols = [item for item in img_cols if item['idx'] in wanted]
+            if not img_cols:
+                raise ValueError("No image column detected")
+            code_col_idx = _resolve_column(df.columns, opts.get('name_col'))
+            if code_col_idx is None:
+                code_col_idx = _default_code_col_idx(df.columns)
+            extract_options = {
+                'bg_mode': opts.get('bg') or EXTRACT_BG_ORIGINAL,
+                'shape': opts.get('shape') or EXTRACT_SHAPE_ORIGINAL,
+                'add_border': opts.get('bg') == EXTRACT_BG_WHITE,
+            }
+            job = ExtractJob(
+                df=df,
+                out_dir=os.path.join(opts['out_dir'], f"{name}_Img"),
+                code_col_idx=code_col_idx,
+                img_cols=img_cols,
+                header_row=loaded['header_row'],
+                image_map=image_map,
+                extract_options=extract_options if _extract_options_require_processing(extract_options) else None,
+                T=T,
+                on_event=on_event,
+                max_workers=opts['workers'],
+                max_concurrency=opts['max_workers'],
+                per_host=opts['per_host'],
+                host_rate=opts['host_rate'],
+                host_limits=dict(opts.get('host_limits') or ()),
+            )
+            result = job.run()
+            summary.update({
+                'success': result['success'],
+                'fail': result['fail'],
+                'skipped': result['skipped'],
+                'output': result['out_dir'],
+            })
+        else:
+            url_col_idx = _resolve_column(df.columns, opts.get('url_col'))
+            sku_col_idx = _resolve_column(df.columns, opts.get('sku_col'))
+            use_url_library = bool(opts.get('use_library'))
+            url_library = {}
+            url_library_records = {}
+            extra_field_names = []
+            if use_url_library:
+                # only the codes present in this sheet are read from the library
+                lookup_cols = range(len(df.columns)) if sku_col_idx is None else [sku_col_idx]
+                codes = set()
+                for i in lookup_cols:
+                    codes.update(_normalize_lookup_codes(df.iloc[:, i]))
+                codes.discard('')
+                store = _UrlLibraryStore(opts.get('library_db') or URL_LIBRARY_PATH)
+                try:
+                    found = store.lookup(codes)
+                finally:
+                    store.close()
+                url_library = {code: url for code, (url, _) in found.items()}
+                url_library_records = {code: record for code, (_, record) in found.items()}
+                extra_field_names = opts.get('library_fields') or []
+                if sku_col_idx is None:
+                    sku_col_idx = _best_url_library_match_col_idx(df, url_library)
+            else:
+                if url_col_idx is None:
+                    _, url_counts = _detect_image_columns(df)
+                    if url_counts:
+                        url_col_idx = max(url_counts, key=url_counts.get)
+                if sku_col_idx is None:
+                    scores = [SheetPicApp._score_sku_column_name(c) for c in df.columns]
+                    if scores and max(scores) >= 0:
+                        sku_col_idx = scores.index(max(scores))
+            job = EmbedJob(
+                df=df,
+                dest_dir=opts['out_dir'],
+                name=name,
+                url_col_idx=url_col_idx,
+                sku_col_idx=sku_col_idx,
+                use_url_library=use_url_library,
+                url_library=url_library,
+                url_library_records=url_library_records,
+                extra_field_names=extra_field_names,
+                max_dim=opts['max_dim'] or None,
+                bg_mode=opts.get('bg') or EMBED_BG_WHITE,
+                write_original=bool(opts.get('write_original')),
+                window=opts['window'],
+                writer=opts['writer'],
+                placement=opts['placement'],
+                source_path=path,
+                header_row=loaded['header_row'],
+                T=T,
+                on_event=on_event,
+                max_workers=opts['workers'],
+                max_concurrency=opts['max_workers'],
+                per_host=opts['per_host'],
+                host_rate=opts['host_rate'],
+                host_limits=dict(opts.get('host_limits') or ()),
+            )
+            result = job.run()
+            if result['error']:
+                raise RuntimeError(result['error'])
+            summary.update({
+                'success': result['success'],
+                'fail': result['fail'],
+                'output': result['out_file'],
+            })
+        summary['ok'] = True
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if loaded and loaded['book'] is not None:
+            loaded['book'].close()
+    summary['duration'] = round(time.time() - t_start, 3)
+    return summary
+
+
+def _host_limit_arg(value):
+    """argparse type for --host-limit HOST=CAP[:RATE]."""
+    import argparse
+    host, sep, spec = value.partition('=')
+    cap, _, rate = spec.partition(':')
+    try:
+        if not host or not sep:
+            raise ValueError
+        return host.strip().lower(), (int(cap), float(rate) if rate else 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected HOST=CAP[:RATE], got {value!r}")
+
+
+def _build_cli_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="sheetpic",
+        description="Batch image extract & embed for spreadsheets (headless).",
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def _common(p):
+        p.add_argument('inputs', nargs='+', help="Input workbooks or glob patterns (xlsx/xls/csv/html)")
+        p.add_argument('-o', '--out-dir', default=os.getcwd(), help="Output directory (default: current directory)")
+        p.add_argument('--sheet', help="Sheet name (default: active sheet)")
+        p.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                       help=f"Starting download concurrency per file (default: {DOWNLOAD_WORKERS})")
+        p.add_argument('--max-workers', type=int, default=DOWNLOAD_MAX_WORKERS,
+                       help="Ceiling for adaptive concurrency; equal to --workers keeps it fixed "
+                            f"(default: {DOWNLOAD_MAX_WORKERS})")
+        p.add_argument('--pool-size', type=int, default=None,
+                       help="Keep-alive connections per host (default: max(max-workers, %d))" % HTTP_POOL_SIZE)
+        p.add_argument('--per-host', type=int, default=DOWNLOAD_PER_HOST,
+                       help="Max concurrent downloads per hostname, 0 = up to --max-workers (default: 0)")
+        p.add_argument('--host-rate', type=float, default=DOWNLOAD_HOST_RATE,
+                       help="Max request starts per second per hostname, 0 = unlimited (default: 0)")
+        p.add_argument('--host-limit', dest='host_limits', action='append', type=_host_limit_arg,
+                       metavar='HOST=CAP[:RATE]', help="Per-host override of --per-host/--host-rate; repeatable")
+        p.add_argument('--cache-dir', default=CACHE_DIR, help="Cache directory (default: %(default)s)")
+        p.add_argument('--cache-size', type=int, default=DOWNLOAD_CACHE_MAX_BYTES // (1024 * 1024),
+                       help="Download cache budget in MB; least recently used images are evicted (default: %(default)s)")
+        p.add_argument('--no-cache', action='store_true',
+                       help="Always download and re-process, do not read or fill the caches")
+        p.add_argument('--files', type=int, default=1,
+                       help="Number of files processed at once in worker processes (default: 1)")
+        p.add_argument('--reader', choices=(READER_AUTO, READER_PANDAS), default=READER_AUTO,
+                       help="Table reader: auto prefers python-calamine (Excel) / pyarrow (CSV) when installed, "
+                            "pandas always uses pandas' default engines (default: auto)")
+        p.add_argument('--lang', choices=sorted(LANG_MAP), default='en', help="Language of log messages")
+        p.add_argument('-v', '--verbose', action='store_true', help="Print per-row logs to stderr")
+
+    p_extract = sub.add_parser('extract', help="Download/export images into <out-dir>/<file>_Img")
+    _common(p_extract)
+    p_extract.add_argument('--image-col', dest='image_cols', action='append',
+                           help="Image column by name or letter; repeatable (default: all detected)")
+    p_extract.add_argument('--name-col', help="Filename column by name or letter (default: code/SKU-like column)")
+    p_extract.add_argument('--bg', choices=(EXTRACT_BG_ORIGINAL, EXTRACT_BG_WHITE), default=EXTRACT_BG_ORIGINAL)
+    p_extract.add_argument('--shape', choices=(EXTRACT_SHAPE_ORIGINAL, EXTRACT_SHAPE_SQUARE),
+                           default=EXTRACT_SHAPE_ORIGINAL)
+
+    p_embed = sub.add_parser('embed', help="Embed URL images into <out-dir>/<file>_Embedded.xlsx")
+    _common(p_embed)
+    p_embed.add_argument('--url-col', help="Image URL column by name or letter (default: most URLs)")
+    p_embed.add_argument('--sku-col', help="SKU/ID column by name or letter; images go right after it")
+    p_embed.add_argument('--max-dim', type=int, default=500, help="Max image dimension in px, 0 = original size")
+    p_embed.add_argument('--bg', choices=(EMBED_BG_WHITE, EMBED_BG_TRANSPARENT), default=EMBED_BG_WHITE)
+    p_embed.add_argument('--window', type=int, default=EMBED_WINDOW,
+                         help=f"Images downloaded ahead of the row being written; bounds memory (default: {EMBED_WINDOW})")
+    p_embed.add_argument('--writer', choices=(EMBED_WRITER_STREAM, EMBED_WRITER_OPENPYXL), default=EMBED_WRITER_STREAM,
+                         help="Output backend for new workbooks; --write-original always uses openpyxl")
+    p_embed.add_argument('--placement', choices=(EMBED_PLACEMENT_FLOATING, EMBED_PLACEMENT_CELL, EMBED_PLACEMENT_WPS),
+                         default=EMBED_PLACEMENT_FLOATING,
+                         help="Floating pictures, Excel in-cell pictures (cell) or WPS DISPIMG pictures (wps); "
+                              "in-cell modes use the streaming writer and stay with their rows when sorting")
+    p_embed.add_argument('--write-original', action='store_true',
+                         help="Insert the image column into a copy of the source .xlsx")
+    p_embed.add_argument('--use-library', action='store_true',
+                         help="Match URLs from the saved URL library by the SKU column")
+    p_embed.add_argument('--library-field', dest='library_fields', action='append',
+                         help="URL library field to write next to the image; repeatable")
+    p_embed.add_argument('--library-db', default=URL_LIBRARY_PATH,
+                         help="URL library database (default: %(default)s)")
+
+    p_cache = sub.add_parser('cache', help="Show or clear the download and processed image caches")
+    p_cache.add_argument('action', choices=('info', 'clear'))
+    p_cache.add_argument('--cache-dir', default=CACHE_DIR, help="Cache directory (default: %(default)s)")
+    p_cache.add_argument('--only', choices=('downloads', 'processed'), help="Limit to one cache")
+    return parser
+
+
+def _cli_init_worker(pool_size, cache_dir, cache_bytes, use_cache, reader=READER_AUTO):
+    configure_http_session(pool_size)
+    configure_reader(reader)
+    configure_download_cache(os.path.join(cache_dir, "downloads"), cache_bytes, enabled=use_cache)
+    configure_processed_cache(os.path.join(cache_dir, "processed"), enabled=use_cache)
+
+
+def _cli_cache_command(args):
+    caches = {
+        'downloads': _DownloadCache(os.path.join(args.cache_dir, "downloads")),
+        'processed': _ProcessedImageCache(os.path.join(args.cache_dir, "processed")),
+    }
+    summary = {'command': 'cache', 'action': args.action, 'path': args.cache_dir}
+    for name, cache in caches.items():
+        if args.only and name != args.only:
+            continue
+        if args.action == 'clear':
+            cache.clear()
+        summary[name] = cache.stats()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0
+
+
+def cli_main(argv=None):
+    """Entry point for `python -m sheetpic extract|embed|cache ...`.
+
+    Prints a JSON summary to stdout; exit status is 1 when any file failed.
+    """
+    args = _build_cli_parser().parse_args(argv)
+    if args.command == 'cache':
+        return _cli_cache_command(args)
+    paths = _expand_input_paths(args.inputs)
+    os.makedirs(args.out_dir, exist_ok=True)
+    opts = {k: v for k, v in vars(args).items() if k not in ('command', 'inputs', 'files', 'pool_size',
+                                                                'cache_dir', 'cache_size', 'no_cache', 'reader')}
+    pool_size = args.pool_size or max(args.max_workers, HTTP_POOL_SIZE)
+    init_args = (pool_size, args.cache_dir, args.cache_size * 1024 * 1024, not args.no_cache, args.reader)
+
+    if getattr(args, 'use_library', False) and args.library_db == URL_LIBRARY_PATH:
+        _open_url_library().close()  # migrate a config-saved library before workers read it
+
+    t_start = time.time()
+    if args.files > 1 and len(paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.files,
+            initializer=_cli_init_worker,
+            initargs=init_args,
+        ) as executor:
+            files = list(executor.map(_cli_process_file, [args.command] * len(paths), paths, [opts] * len(paths)))
+    else:
+        _cli_init_worker(*init_args)
+        files = [_cli_process_file(args.command, path, opts) for path in paths]
+        _flush_download_cache()
+
+    totals = {'files': len(files), 'ok': sum(1 for f in files if f['ok'])}
+    for key in ('success', 'fail', 'skipped'):
+        totals[key] = sum(f.get(key, 0) for f in files)
+    summary = {
+        'command': args.command,
+        'files': files,
+        'totals': totals,
+        'duration': round(time.time() - t_start, 3),
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if paths and totals['ok'] == len(files) else 1
+
+
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(cli_main(sys.argv[1:]))
     root = tk.Tk()
     _set_window_icon(root)
     # Try loading tkdnd for drag-and-drop support
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def _no_persistent_caches(monkeypatch, tmp_path):
+    """Keep tests off the user's persistent caches and URL library; cache tests configure their own."""
+    import sheetpic
+
+    monkeypatch.setattr(sheetpic, '_download_cache_obj', None)
+    monkeypatch.setattr(sheetpic, '_download_cache_enabled', False)
+    monkeypatch.setattr(sheetpic, '_processed_cache_obj', None)
+    monkeypatch.setattr(sheetpic, '_processed_cache_enabled', False)
+    monkeypatch.setattr(sheetpic, '_sheet_cache', sheetpic._SheetCache())
+    monkeypatch.setattr(sheetpic.SheetPicApp, 'CONFIG_PATH', str(tmp_path / 'sheetpic_config'))
+    monkeypatch.setattr(sheetpic.SheetPicApp, 'URL_LIBRARY_PATH', str(tmp_path / 'sheetpic_url_library.db'))
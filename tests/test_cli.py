@@ -0,0 +1,142 @@
+"""Tests for the headless `python -m sheetpic extract|embed` command line."""
+import json
+import os
+import sys
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+import pytest
+from PIL import Image as PILImage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _fake_embed_download(url, max_dim=None, bg_mode=None, T=None, is_running=None):
+    buf = BytesIO()
+    PILImage.new('RGB', (10, 10), 'white').save(buf, format='JPEG')
+    buf.seek(0)
+    return True, buf
+
+
+def test_resolve_column_by_name_or_letter():
+    from sheetpic import _resolve_column
+
+    cols = ['条码', 'Image URL', 'Name']
+    assert _resolve_column(cols, '条码') == 0
+    assert _resolve_column(cols, 'image url') == 1
+    assert _resolve_column(cols, 'C') == 2
+    assert _resolve_column(cols, None) is None
+    with pytest.raises(ValueError):
+        _resolve_column(cols, 'Z')
+
+
+def test_cli_parses_per_host_limits():
+    from sheetpic import _build_cli_parser
+
+    args = _build_cli_parser().parse_args([
+        'embed', 'a.xlsx', '--per-host', '4', '--host-limit', 'IMG.example.com=2:0.5', '--host-limit', 'cdn=8',
+    ])
+
+    assert args.per_host == 4
+    assert dict(args.host_limits) == {'img.example.com': (2, 0.5), 'cdn': (8, 0)}
+    with pytest.raises(SystemExit):
+        _build_cli_parser().parse_args(['embed', 'a.xlsx', '--host-limit', 'cdn'])
+
+
+def test_expand_input_paths_globs_and_skips_lock_files(tmp_path):
+    from sheetpic import _expand_input_paths
+
+    for name in ('a.xlsx', 'b.xlsx', '~$a.xlsx', 'c.csv'):
+        (tmp_path / name).write_bytes(b'x')
+
+    paths = _expand_input_paths([str(tmp_path / '*.xlsx'), str(tmp_path / 'a.xlsx')])
+
+    assert [os.path.basename(p) for p in paths] == ['a.xlsx', 'b.xlsx']
+
+
+def test_cli_embed_processes_many_files_and_prints_json(tmp_path, monkeypatch, capsys):
+    import sheetpic
+
+    monkeypatch.setattr(sheetpic, '_download_embed_image', _fake_embed_download)
+    for name in ('s1', 's2'):
+        pd.DataFrame({
+            'SKU': [f'{name}-1', f'{name}-2'],
+            'Pic': ['http://x/1.jpg', None],
+        }).to_excel(tmp_path / f'{name}.xlsx', index=False)
+    out_dir = tmp_path / 'out'
+
+    code = sheetpic.cli_main([
+        'embed', str(tmp_path / '*.xlsx'), '-o', str(out_dir),
+        '--url-col', 'B', '--sku-col', 'SKU', '--max-dim', '200', '--workers', '2', '--no-cache',
+    ])
+
+    summary = json.loads(capsys.readouterr().out)
+    assert code == 0
+    assert summary['command'] == 'embed'
+    assert summary['totals'] == {'files': 2, 'ok': 2, 'success': 2, 'fail': 2, 'skipped': 0}
+    assert [os.path.basename(f['output']) for f in summary['files']] == ['s1_Embedded.xlsx', 's2_Embedded.xlsx']
+    assert summary['files'][0]['engine'] in ('openpyxl', 'calamine')
+
+    wb = openpyxl.load_workbook(out_dir / 's1_Embedded.xlsx')
+    try:
+        ws = wb.active
+        assert [c.value for c in ws[1]] == ['SKU', '图片', 'Pic']
+        assert len(ws._images) == 1
+    finally:
+        wb.close()
+
+
+def test_cli_reports_per_file_errors_without_stopping(tmp_path, monkeypatch, capsys):
+    import sheetpic
+
+    monkeypatch.setattr(sheetpic, '_download_embed_image', _fake_embed_download)
+    pd.DataFrame({'SKU': ['A'], 'Pic': ['http://x/1.jpg']}).to_excel(tmp_path / 'good.xlsx', index=False)
+    pd.DataFrame({'SKU': ['A'], 'Name': ['no urls']}).to_excel(tmp_path / 'bad.xlsx', index=False)
+
+    code = sheetpic.cli_main(['embed', str(tmp_path / '*.xlsx'), '-o', str(tmp_path / 'out'), '--no-cache'])
+
+    files = {os.path.basename(f['input']): f for f in json.loads(capsys.readouterr().out)['files']}
+    assert code == 1
+    assert files['good.xlsx']['ok'] is True
+    assert files['bad.xlsx']['ok'] is False
+    assert files['bad.xlsx']['error']
+
+
+def test_cli_cache_info_and_clear(tmp_path, capsys):
+    import sheetpic
+
+    downloads = sheetpic._DownloadCache(str(tmp_path / 'downloads'))
+    downloads.store('http://x/a.jpg', b'abc', {})
+    downloads.flush()
+    sheetpic._ProcessedImageCache(str(tmp_path / 'processed')).put('ab' * 32, 500, 'white', b'abcd')
+
+    assert sheetpic.cli_main(['cache', 'info', '--cache-dir', str(tmp_path)]) == 0
+    info = json.loads(capsys.readouterr().out)
+    assert info['downloads'] == {'entries': 1, 'blobs': 1, 'bytes': 3}
+    assert info['processed'] == {'entries': 1, 'bytes': 4}
+
+    sheetpic.cli_main(['cache', 'clear', '--only', 'processed', '--cache-dir', str(tmp_path)])
+    cleared = json.loads(capsys.readouterr().out)
+    assert cleared['processed'] == {'entries': 0, 'bytes': 0}
+    assert 'downloads' not in cleared
+
+
+def test_cli_embed_uses_library_database(tmp_path, monkeypatch, capsys):
+    import sheetpic
+
+    monkeypatch.setattr(sheetpic, '_download_embed_image', _fake_embed_download)
+    store = sheetpic._UrlLibraryStore(str(tmp_path / 'library.db'))
+    store.upsert([('690001', 'http://x/1.jpg', {'品牌': '方寸'}), ('690009', 'http://x/9.jpg', {})])
+    store.close()
+    pd.DataFrame({'名称': ['a', 'b'], '条码': [690001, 690002]}).to_excel(tmp_path / 's.xlsx', index=False)
+
+    code = sheetpic.cli_main([
+        'embed', str(tmp_path / 's.xlsx'), '-o', str(tmp_path / 'out'), '--no-cache',
+        '--use-library', '--library-db', str(tmp_path / 'library.db'), '--library-field', '品牌',
+    ])
+
+    summary = json.loads(capsys.readouterr().out)
+    assert code == 0
+    assert summary['totals']['success'] == 1
@@ -388,9 +388,9 @@ def test_embed_process_writes_selected_url_library_fields(tmp_path, monkeypatch)
     app.embed_sku_col_idx = 0
     app.embed_use_url_library = True
     app.url_library = {'A001': 'http://x/1.webp'}
-    app.url_library_records = {
-        'A001': {'商品名称': '库商品1', '品牌': '库品牌'},
-    }
+    app._url_library_store().upsert([
+        ('A001', 'http://x/1.webp', {'商品名称': '库商品1', '品牌': '库品牌'}),
+    ])
     app.url_library_field_names = ['商品名称', '品牌']
     app.url_library_selected_fields = ['商品名称', '品牌']
     app.is_running = True
@@ -482,13 +482,19 @@ def test_extract_download_retries_two_timeouts_then_succeeds(tmp_path, monkeypat
         def iter_content(self, _chunk_size):
             yield b'abc'
 
+        def close(self):
+            pass
+
     def _get(*_args, **_kwargs):
         calls.append(1)
         if len(calls) <= 2:
             raise sheetpic.requests.exceptions.Timeout()
         return _Response()
 
-    monkeypatch.setattr(sheetpic.requests, 'get', _get)
+    class _SessionStub:
+        get = staticmethod(_get)
+
+    monkeypatch.setattr(sheetpic, '_http_session', lambda: _SessionStub())
 
     ok, msg = app.download_url('http://x/slow.jpg', 'slow', str(tmp_path))
 
@@ -515,11 +521,17 @@ def test_extract_download_stream_timeout_does_not_leave_zero_byte_file(tmp_path,
             raise sheetpic.requests.exceptions.Timeout()
             yield b''
 
+        def close(self):
+            pass
+
     def _get(*_args, **_kwargs):
         calls.append(1)
         return _Response()
 
-    monkeypatch.setattr(sheetpic.requests, 'get', _get)
+    class _SessionStub:
+        get = staticmethod(_get)
+
+    monkeypatch.setattr(sheetpic, '_http_session', lambda: _SessionStub())
 
     ok, msg = app.download_url('http://x/slow.jpg', 'slow', str(tmp_path))
 
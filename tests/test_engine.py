@@ -0,0 +1,767 @@
+"""Tests for the headless ExtractJob / EmbedJob engine (no Tk involved)."""
+import os
+import sys
+import zipfile
+from io import BytesIO
+
+import openpyxl
+import pytest
+import pandas as pd
+from PIL import Image as PILImage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _jpeg_payload(size=(10, 10)):
+    buf = BytesIO()
+    PILImage.new('RGB', size, 'white').save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+def test_embed_job_runs_headless_and_reports_events(tmp_path):
+    from sheetpic import EmbedJob
+
+    payload = _jpeg_payload()
+    events = []
+    df = pd.DataFrame({
+        '条码': ['A001', 'A002'],
+        '图片': ['http://x/1.jpg!200x200', None],
+    })
+
+    job = EmbedJob(
+        df=df,
+        dest_dir=str(tmp_path),
+        name='batch',
+        url_col_idx=1,
+        sku_col_idx=0,
+        on_event=events.append,
+        download=lambda _url, _max_dim, _bg: (True, BytesIO(payload)),
+    )
+    result = job.run()
+
+    assert result['error'] is None
+    assert result['success'] == 1
+    assert result['fail'] == 1
+    assert result['out_file'] == str(tmp_path / 'batch_Embedded.xlsx')
+    assert events[0] == {'type': 'log', 'message': job.T['log_embed_start']}
+    assert any(e['type'] == 'start' and e['total'] == 2 for e in events)
+    assert any(e['type'] == 'log' and 'URL clean' in e['message'] for e in events)
+    assert [e['current'] for e in events if e['type'] == 'progress'] == [1, 2]
+
+    wb = openpyxl.load_workbook(result['out_file'])
+    try:
+        ws = wb.active
+        assert ws.cell(row=1, column=2).value == '图片'
+        assert ws.cell(row=2, column=1).value == 'A001'
+        assert len(ws._images) == 1
+        assert ws.cell(row=3, column=2).value == job.T['msg_dl_fail']
+    finally:
+        wb.close()
+
+
+def test_embed_job_reports_missing_url_column_as_error(tmp_path):
+    from sheetpic import EmbedJob
+
+    job = EmbedJob(df=pd.DataFrame({'条码': ['A001']}), dest_dir=str(tmp_path), name='x')
+
+    result = job.run()
+
+    assert result['error'] == job.T['msg_no_url']
+    assert not (tmp_path / 'x_Embedded.xlsx').exists()
+
+
+def test_extract_job_downloads_url_columns_and_collects_failures(tmp_path):
+    from sheetpic import ExtractJob
+
+    calls = []
+
+    def _download(url, filename_base, out_dir):
+        calls.append((url, filename_base))
+        if filename_base == 'B2':
+            return False, 'boom'
+        with open(os.path.join(out_dir, filename_base + '.jpg'), 'wb') as f:
+            f.write(b'x')
+        return True, 'OK'
+
+    df = pd.DataFrame({
+        'code': ['A1', 'B2', None],
+        'img': ['http://x/a.jpg?width=100', 'see http://x/b.jpg', 'no image'],
+    })
+    out_dir = tmp_path / 'out'
+    job = ExtractJob(df=df, out_dir=str(out_dir), code_col_idx=0, download=_download)
+
+    result = job.run()
+
+    assert sorted(calls) == [('http://x/a.jpg', 'A1'), ('http://x/b.jpg', 'B2')]
+    assert result['success'] == 1
+    assert result['fail'] == 1
+    assert result['skipped'] == 1
+    assert [t['filename_base'] for t in job.failed_tasks] == ['B2']
+    assert (out_dir / 'A1.jpg').exists()
+
+
+def test_stopped_job_does_not_download(tmp_path):
+    from sheetpic import ExtractJob
+
+    calls = []
+    df = pd.DataFrame({'code': ['A1'], 'img': ['http://x/a.jpg']})
+    job = ExtractJob(df=df, out_dir=str(tmp_path), download=lambda *a: calls.append(a))
+    job.stop()
+
+    result = job.run()
+
+    assert calls == []
+    assert result['stopped'] is True
+
+
+def test_http_session_is_shared_and_pooled(monkeypatch):
+    import threading
+    import sheetpic
+
+    monkeypatch.setattr(sheetpic, '_http_session_obj', None)
+    session = sheetpic.configure_http_session(pool_size=7)
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(sheetpic._http_session())) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    adapter = session.get_adapter('https://cdn.example.com/a.jpg')
+    assert all(s is session for s in seen)
+    assert adapter._pool_maxsize == 7
+    assert session.headers['User-Agent'] == sheetpic.DOWNLOAD_HEADERS['User-Agent']
+    session.close()
+
+
+def test_adaptive_limit_grows_while_throughput_holds_and_halves_on_congestion(monkeypatch):
+    import itertools
+    import sheetpic
+    from sheetpic import _AdaptiveLimit
+
+    # One clock tick per window: throughput equals the window size, so it keeps improving.
+    ticks = itertools.count()
+    monkeypatch.setattr(sheetpic.time, 'monotonic', lambda: float(next(ticks)))
+    limit = _AdaptiveLimit(initial=4, minimum=2, maximum=6)
+    for _ in range(4 + 5 + 6 + 6):
+        limit.record_success()
+    assert limit.limit == 6  # grew by one per window, capped at maximum
+
+    limit.record_congestion()
+    limit.record_congestion()  # a burst of failures backs off only once per window
+    assert limit.limit == 3
+
+    limit.record_congestion()
+    assert limit.limit == 3
+    for _ in range(3):
+        limit.record_success()
+    limit.record_congestion()
+    assert limit.limit == 2  # never below minimum
+    limit.record_success()
+    limit.record_success()
+    limit.record_congestion()
+    assert limit.limit == 2
+
+
+def test_job_downloads_respect_adaptive_limit(tmp_path):
+    import threading
+    import time
+    from sheetpic import ExtractJob
+
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def _download(url, filename_base, out_dir):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.pop()
+        return False, 'nope'
+
+    df = pd.DataFrame({'code': [f'C{i}' for i in range(12)], 'img': [f'http://x/{i}.jpg' for i in range(12)]})
+    job = ExtractJob(df=df, out_dir=str(tmp_path), download=_download, max_workers=3, max_concurrency=8)
+
+    result = job.run()
+
+    assert result['fail'] == 12
+    assert max(peak) <= 3
+
+
+def test_embed_download_backs_off_on_429_then_retries(monkeypatch):
+    import sheetpic
+    from sheetpic import _AdaptiveLimit
+
+    sleeps = []
+    responses = []
+
+    class _Response:
+        def __init__(self, status, content=b''):
+            self.status_code = status
+            self.headers = {'Retry-After': '2'} if status == 429 else {}
+            self.content = content
+
+    buf = BytesIO()
+    PILImage.new('RGB', (4, 4), 'white').save(buf, format='PNG')
+
+    def _get(url, **_kwargs):
+        responses.append(url)
+        return _Response(429) if len(responses) == 1 else _Response(200, buf.getvalue())
+
+    class _SessionStub:
+        get = staticmethod(_get)
+
+    monkeypatch.setattr(sheetpic, '_http_session', lambda: _SessionStub())
+    monkeypatch.setattr(sheetpic.time, 'sleep', sleeps.append)
+    limiter = _AdaptiveLimit(initial=8)
+    sheetpic._download_context.limiter = limiter
+    try:
+        ok, _data = sheetpic._download_embed_image('http://x/a.png')
+    finally:
+        sheetpic._download_context.limiter = None
+
+    assert ok is True
+    assert len(responses) == 2
+    assert sleeps == [2.0]
+    assert limiter.limit == 4
+
+
+def test_slow_host_only_holds_back_its_own_rows(tmp_path):
+    import threading
+    from sheetpic import ExtractJob
+
+    lock = threading.Lock()
+    fast_done = threading.Event()
+    slow_active = []
+    slow_peak = []
+    finished = []
+
+    def _download(url, filename_base, out_dir):
+        if 'slow.example' in url:
+            with lock:
+                slow_active.append(1)
+                slow_peak.append(len(slow_active))
+            fast_done.wait(5)
+            with lock:
+                slow_active.pop()
+        with lock:
+            finished.append(filename_base)
+            if sum(1 for f in finished if f.startswith('F')) == 6:
+                fast_done.set()
+        return False, 'nope'
+
+    urls = [f'http://slow.example/{i}.jpg' for i in range(6)] + [f'http://fast.example/{i}.jpg' for i in range(6)]
+    codes = [f'S{i}' for i in range(6)] + [f'F{i}' for i in range(6)]
+    df = pd.DataFrame({'code': codes, 'img': urls})
+    job = ExtractJob(df=df, out_dir=str(tmp_path), download=_download,
+                     max_workers=4, max_concurrency=4, per_host=2)
+
+    result = job.run()
+
+    assert result['fail'] == 12
+    assert fast_done.is_set()
+    assert max(slow_peak) <= 2
+    # Every fast row finished while the slow host was still stuck on its first two.
+    assert [f[0] for f in finished[:6]] == ['F'] * 6
+
+
+def test_single_fast_host_grows_past_sixteen_concurrent_downloads(tmp_path):
+    import threading
+    import time
+    from sheetpic import ExtractJob
+
+    lock = threading.Lock()
+    active = []
+    peak = [0]
+
+    def _download(url, filename_base, out_dir):
+        with lock:
+            active.append(1)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.005)
+        with lock:
+            active.pop()
+        return True, 'OK'
+
+    df = pd.DataFrame({
+        'code': [f'C{i}' for i in range(600)],
+        'img': [f'http://cdn.example/{i}.jpg' for i in range(600)],
+    })
+    job = ExtractJob(df=df, out_dir=str(tmp_path), download=_download, max_workers=10, max_concurrency=40)
+
+    result = job.run()
+
+    assert result['success'] == 600
+    assert peak[0] > 16
+
+
+def test_download_cache_tracks_bytes_and_sweeps_only_over_budget(tmp_path, monkeypatch):
+    import sheetpic
+
+    cache = sheetpic._DownloadCache(str(tmp_path), max_bytes=100)
+    sweeps = []
+    evict = cache._evict_locked
+    monkeypatch.setattr(cache, '_evict_locked', lambda: (sweeps.append(cache._total_bytes), evict()))
+
+    for i in range(9):
+        cache.store(f'http://x/{i}', bytes([i]) * 10)
+    cache.store('http://x/0', bytes([1]) * 10)  # now shares blob 1; blob 0 is unreferenced
+    cache.store('http://y/1', bytes([1]) * 10)
+    assert sweeps == []
+    assert cache.stats() == {'entries': 10, 'blobs': 8, 'bytes': 80}
+
+    other = sheetpic._DownloadCache(str(tmp_path), max_bytes=100)
+    other.store('http://z/a', b'z' * 15)
+    other.flush()
+    read_index = cache._read_index
+
+    def _read_index_unlocked():
+        assert not cache._lock.locked(), "index read under the cache lock"
+        return read_index()
+
+    monkeypatch.setattr(cache, '_read_index', _read_index_unlocked)
+    cache.flush()  # merges the other process's entry into the running total
+    assert cache.stats() == {'entries': 11, 'blobs': 9, 'bytes': 95}
+
+    cache.store('http://x/big', b'b' * 30)
+    assert sweeps == [125]
+    assert cache.stats()['bytes'] <= 90
+    assert cache.lookup('http://x/big') is not None
+
+
+def test_extract_only_looks_up_shared_downloads_for_duplicate_urls(tmp_path, monkeypatch):
+    import sheetpic
+    from sheetpic import ExtractJob
+
+    lookups = []
+    find = sheetpic._find_extract_output
+    monkeypatch.setattr(sheetpic, '_find_extract_output', lambda *a: (lookups.append(a[1]), find(*a))[1])
+
+    def _download(url, filename_base, out_dir):
+        with open(os.path.join(out_dir, filename_base + '.jpg'), 'wb') as f:
+            f.write(b'x')
+        return True, 'OK'
+
+    df = pd.DataFrame({
+        'code': ['A', 'B', 'C', 'D'],
+        'img': ['http://x/1.jpg', 'http://x/2.jpg', 'http://x/3.jpg', 'http://x/1.jpg'],
+    })
+    result = ExtractJob(df=df, out_dir=str(tmp_path), download=_download).run()
+
+    assert result['success'] == 4
+    assert lookups == ['A']
+    assert os.path.exists(os.path.join(result['out_dir'], 'D.jpg'))
+
+
+def test_host_scheduler_spaces_requests_by_host_rate():
+    import concurrent.futures
+    from sheetpic import _HostScheduler
+
+    now = [100.0]
+    starts, sleeps = [], []
+
+    def _sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    def _task(label):
+        starts.append((label, now[0]))
+        return True, label
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        sched = _HostScheduler(executor, lambda _limit, fn, *a: fn(*a), per_host=1,
+                               host_limits={'b.example': (1, 0)}, rate=4, clock=lambda: now[0], sleep=_sleep)
+        futures = [sched.submit(f'https://A.example/{i}', _task, i) for i in range(3)]
+        futures.append(sched.submit('https://b.example/x', _task, 'b'))
+        results = [f.result() for f in futures]
+
+    assert results == [(True, 0), (True, 1), (True, 2), (True, 'b')]
+    a_starts = [t for label, t in starts if label != 'b']
+    assert [b - a for a, b in zip(a_starts, a_starts[1:])] == [0.25, 0.25]  # a.example is paced at 4/s
+    assert sleeps == [0.25, 0.25]  # b.example has no rate and never waits
+
+
+def test_download_cache_reuses_revalidates_and_evicts(tmp_path, monkeypatch):
+    import sheetpic
+
+    buf = BytesIO()
+    PILImage.new('RGB', (4, 4), 'white').save(buf, format='PNG')
+    payload = buf.getvalue()
+    requests_seen = []
+
+    class _Response:
+        def __init__(self, status, content=b''):
+            self.status_code = status
+            self.content = content
+            self.headers = {'ETag': '"v1"', 'Content-Type': 'image/png'} if status == 200 else {}
+
+    def _get(url, headers=None, **_kwargs):
+        requests_seen.append((url, dict(headers or {})))
+        return _Response(304) if headers else _Response(200, payload)
+
+    class _SessionStub:
+        get = staticmethod(_get)
+
+    monkeypatch.setattr(sheetpic, '_http_session', lambda: _SessionStub())
+    cache = sheetpic.configure_download_cache(str(tmp_path / 'cache'))
+
+    assert sheetpic._download_embed_image('http://x/a.png')[0] is True
+    assert sheetpic._download_embed_image('http://x/a.png')[0] is True
+    assert len(requests_seen) == 1  # fresh entry: no network at all
+
+    cache.flush()
+    cache = sheetpic.configure_download_cache(str(tmp_path / 'cache'), max_age=0)
+    assert sheetpic._download_embed_image('http://x/a.png')[0] is True
+    assert requests_seen[-1] == ('http://x/a.png', {'If-None-Match': '"v1"'})  # survived the restart
+
+    # Same bytes behind another URL share one blob; a tight budget evicts the least recently used.
+    cache.store('http://y/b.png', payload, {})
+    assert cache.stats() == {'entries': 2, 'blobs': 1, 'bytes': len(payload)}
+    cache.max_bytes = len(payload) + 10
+    cache.store('http://z/c.bin', b'x' * 10, {})
+    assert cache.lookup('http://x/a.png') is not None
+    cache.lookup('http://z/c.bin')
+    cache.store('http://z/d.bin', b'y' * 5, {})
+    assert cache.lookup('http://x/a.png') is None
+    assert cache.lookup('http://y/b.png') is None
+    assert cache.stats()['bytes'] == 15
+
+
+def test_processed_cache_skips_pillow_for_known_images(tmp_path, monkeypatch):
+    import os
+    import sheetpic
+
+    cache = sheetpic.configure_processed_cache(str(tmp_path / 'processed'))
+    payload = _jpeg_payload((40, 20))
+    ok, first = sheetpic._embed_image_from_bytes(payload, 'http://x/a.jpg', 16, sheetpic.EMBED_BG_WHITE, sheetpic.LANG_MAP['en'])
+    assert ok is True
+
+    def _no_pillow(*_args, **_kwargs):
+        raise AssertionError("processed again")
+
+    monkeypatch.setattr(sheetpic, '_prepare_embed_image_bytes', _no_pillow)
+    ok, again = sheetpic._embed_image_from_bytes(payload, 'http://y/b.jpg', 16, sheetpic.EMBED_BG_WHITE, sheetpic.LANG_MAP['en'])
+    assert ok is True
+    assert again.getvalue() == first.getvalue()
+    with pytest.raises(AssertionError):  # other parameters are a different key
+        sheetpic._embed_image_from_bytes(payload, 'http://x/a.jpg', 32, sheetpic.EMBED_BG_WHITE, sheetpic.LANG_MAP['en'])
+
+    assert cache.stats() == {'entries': 1, 'bytes': len(first.getvalue())}
+    for path in (tmp_path / 'processed').glob('*/*'):
+        os.utime(path, (0, 0))
+    cache.max_bytes = 1
+    cache.put('ab' * 32, 8, sheetpic.EMBED_BG_WHITE, b'x')
+    assert cache.stats() == {'entries': 1, 'bytes': 1}  # oldest evicted to fit the cap
+    cache.clear()
+    assert cache.stats() == {'entries': 0, 'bytes': 0}
+    assert os.path.isdir(tmp_path / 'processed')
+
+
+def test_embed_job_downloads_each_url_once_for_all_rows(tmp_path):
+    from sheetpic import EmbedJob
+
+    payload = _jpeg_payload()
+    calls = []
+
+    def _download(url, _max_dim, _bg):
+        calls.append(url)
+        return True, BytesIO(payload)
+
+    df = pd.DataFrame({
+        'SKU': ['A-S', 'A-M', 'A-L', 'B'],
+        'Pic': ['http://x/a.jpg', 'http://x/a.jpg?width=100', 'http://x/a.jpg', 'http://x/b.jpg'],
+    })
+    events = []
+    job = EmbedJob(df=df, dest_dir=str(tmp_path), name='dup', url_col_idx=1, sku_col_idx=0,
+                   download=_download, on_event=events.append)
+
+    result = job.run()
+
+    assert sorted(calls) == ['http://x/a.jpg', 'http://x/b.jpg']
+    assert result['success'] == 4
+    assert [e['current'] for e in events if e['type'] == 'progress'] == [1, 2, 3, 4]
+    assert {'type': 'log', 'message': job.T['msg_dup_urls'].format(3, 1)} in events
+    wb = openpyxl.load_workbook(result['out_file'])
+    try:
+        assert len(wb.active._images) == 4
+    finally:
+        wb.close()
+    # Identical pictures share one media part; every anchor still has its own relationship.
+    with zipfile.ZipFile(result['out_file']) as zf:
+        names = zf.namelist()
+        rels = zf.read('xl/drawings/_rels/drawing1.xml.rels').decode()
+    assert len([n for n in names if n.startswith('xl/media/')]) == 1
+    assert len(names) == len(set(names))
+    assert rels.count('Target=') == 4
+
+
+def test_extract_job_writes_shared_url_once_and_links_copies(tmp_path):
+    from sheetpic import ExtractJob
+
+    calls = []
+
+    def _download(url, filename_base, out_dir):
+        calls.append(filename_base)
+        with open(os.path.join(out_dir, filename_base + '.png'), 'wb') as f:
+            f.write(b'png')
+        return True, 'OK'
+
+    df = pd.DataFrame({'code': ['V1', 'V2', 'V3'], 'img': ['http://x/a.png', 'http://x/a.png', 'http://x/b.png']})
+    out_dir = tmp_path / 'out'
+    job = ExtractJob(df=df, out_dir=str(out_dir), code_col_idx=0, download=_download)
+
+    result = job.run()
+
+    assert sorted(calls) == ['V1', 'V3']
+    assert result['success'] == 3
+    assert (out_dir / 'V2.png').read_bytes() == b'png'
+
+
+def test_embed_job_streams_rows_in_order_with_bounded_window(tmp_path):
+    import threading
+    from sheetpic import EmbedJob
+
+    payload = _jpeg_payload()
+    lock = threading.Lock()
+    started = []
+
+    def _download(url, _max_dim, _bg):
+        with lock:
+            started.append(url)
+        return True, BytesIO(payload)
+
+    df = pd.DataFrame({'SKU': [f'S{i}' for i in range(8)], 'Pic': [f'http://x/{i}.jpg' for i in range(8)]})
+    job = EmbedJob(df=df, dest_dir=str(tmp_path), name='stream', url_col_idx=1, sku_col_idx=0,
+                   download=_download, window=2)
+    written = []
+    write_row = job._write_row
+
+    def _spy(ws, i, *args):
+        with lock:
+            written.append((i, len(started)))
+        return write_row(ws, i, *args)
+
+    job._write_row = _spy
+    result = job.run()
+
+    assert result['success'] == 8
+    assert [i for i, _ in written] == list(range(8))
+    assert all(n_started <= i + 2 for i, n_started in written)
+
+
+def test_stopping_embed_job_mid_stream_leaves_scheduler_futures_intact(tmp_path, caplog):
+    import logging
+    import threading
+    from sheetpic import EmbedJob
+
+    payload = _jpeg_payload()
+    lock = threading.Lock()
+    started = []
+
+    def _download(url, _max_dim, _bg):
+        with lock:
+            started.append(url)
+            if len(started) == 3:
+                job.stop()
+        return True, BytesIO(payload)
+
+    df = pd.DataFrame({'SKU': [f'S{i}' for i in range(40)],
+                       'Pic': [f'http://x.example/{i}.jpg' for i in range(40)]})
+    job = EmbedJob(df=df, dest_dir=str(tmp_path), name='halt', url_col_idx=1, sku_col_idx=0,
+                   download=_download, window=16)
+    with caplog.at_level(logging.ERROR, logger='concurrent.futures'):
+        result = job.run()
+
+    assert not [r for r in caplog.records if r.name == 'concurrent.futures']
+    assert len(started) < 40
+    assert result['stopped'] and result['error'] is None
+
+
+def test_embed_job_logs_row_write_errors_and_only_publishes_saved_output(tmp_path, monkeypatch):
+    from sheetpic import EmbedJob, _XlsxStreamWriter
+
+    payload = _jpeg_payload()
+    write_row = _XlsxStreamWriter.write_row
+
+    def _write_row(self, excel_row, cells, image=None):
+        if image is not None and excel_row == 3:
+            raise OSError("disk full")
+        return write_row(self, excel_row, cells, image)
+
+    monkeypatch.setattr(_XlsxStreamWriter, 'write_row', _write_row)
+    df = pd.DataFrame({'SKU': ['S1', 'S2', 'S3'], 'Pic': ['http://x/1.jpg', 'http://x/2.jpg', 'http://x/3.jpg']})
+    events = []
+    result = EmbedJob(df=df, dest_dir=str(tmp_path), name='rows', url_col_idx=1, sku_col_idx=0,
+                      on_event=events.append, download=lambda *_a: (True, BytesIO(payload))).run()
+
+    assert (result['success'], result['fail']) == (2, 1)
+    assert any(e['type'] == 'log' and 'Row 3' in e['message'] and 'disk full' in e['message'] for e in events)
+    assert sorted(os.listdir(tmp_path)) == ['rows_Embedded.xlsx']
+
+    (tmp_path / 'broken_Embedded.xlsx').write_bytes(b'previous run')
+    rels_part = _XlsxStreamWriter._rels_part
+
+    def _rels_part(self, name, rels, key=None):
+        if name == 'xl/_rels/workbook.xml.rels':  # after the sheet part is in the zip
+            raise OSError("disk full")
+        return rels_part(self, name, rels, key)
+
+    monkeypatch.setattr(_XlsxStreamWriter, '_rels_part', _rels_part)
+    result = EmbedJob(df=df, dest_dir=str(tmp_path), name='broken', url_col_idx=1, sku_col_idx=0,
+                      download=lambda *_a: (True, BytesIO(payload))).run()
+
+    assert result['error'] is not None
+    assert (tmp_path / 'broken_Embedded.xlsx').read_bytes() == b'previous run'
+    assert not (tmp_path / 'broken_Embedded.xlsx.part').exists()
+
+
+def test_stream_writer_matches_openpyxl_layout(tmp_path):
+    from sheetpic import EMBED_WRITER_OPENPYXL, EMBED_WRITER_STREAM, EmbedJob
+
+    payload = _jpeg_payload((30, 10))
+    df = pd.DataFrame({
+        '条码': ['A001', 'A002', 'A003'],
+        'Name': ['x & <y>', None, 'z'],
+        'Pic': ['http://x/1.jpg', 'http://x/bad.jpg', None],
+    })
+    records = {'A001': {'Price': 9.5, 'Stock': 3}, 'A002': {'Price': 'n/a'}}
+    library = {'A001': 'http://x/1.jpg', 'A002': 'http://x/bad.jpg'}
+
+    def _download(url, _max_dim, _bg):
+        return (True, BytesIO(payload)) if url.endswith('1.jpg') else (False, 'boom')
+
+    def _layout(writer):
+        out = tmp_path / writer
+        out.mkdir()
+        job = EmbedJob(df=df, dest_dir=str(out), name='cmp', sku_col_idx=0, header_row=1,
+                       use_url_library=True, url_library=library, url_library_records=records,
+                       extra_field_names=['Price', 'Stock'], download=_download, writer=writer)
+        result = job.run()
+        assert result['error'] is None
+        wb = openpyxl.load_workbook(result['out_file'])
+        try:
+            ws = wb.active
+            values = [[c.value if c.value != '' else None for c in row] for row in ws.iter_rows()]
+            heights = {r: d.height for r, d in ws.row_dimensions.items() if d.height}
+            widths = {k: round(d.width, 3) for k, d in ws.column_dimensions.items() if d.customWidth}
+            anchors = [(img.anchor._from.row, img.anchor._from.col, img.anchor.ext.width, img.anchor.ext.height)
+                       for img in ws._images]
+            return result['success'], result['fail'], values, heights, widths, anchors
+        finally:
+            wb.close()
+
+    streamed = _layout(EMBED_WRITER_STREAM)
+    assert streamed == _layout(EMBED_WRITER_OPENPYXL)
+    assert streamed[0] == 1
+    assert streamed[2][1][:5] == ['条码', '图片', 'Price', 'Stock', 'Name']
+    assert streamed[3] == {3: 40}
+
+
+@pytest.mark.parametrize('placement', ['cell', 'wps'])
+def test_embed_job_writes_in_cell_pictures(tmp_path, placement):
+    from sheetpic import EmbedJob
+
+    payload = _jpeg_payload((30, 10))
+    df = pd.DataFrame({'SKU': ['A', 'B', 'C'], 'Pic': ['http://x/1.jpg', 'http://x/1.jpg', 'http://x/bad.jpg']})
+
+    def _download(url, _max_dim, _bg):
+        return (True, BytesIO(payload)) if url.endswith('1.jpg') else (False, 'boom')
+
+    result = EmbedJob(df=df, dest_dir=str(tmp_path), name='cells', url_col_idx=1, sku_col_idx=0,
+                      download=_download, placement=placement).run()
+
+    assert (result['error'], result['success'], result['fail']) == (None, 2, 1)
+    with zipfile.ZipFile(result['out_file']) as zf:
+        names = set(zf.namelist())
+        sheet = zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        content_types = zf.read('[Content_Types].xml').decode('utf-8')
+        assert not any(n.startswith('xl/drawings/') for n in names)
+        assert len([n for n in names if n.startswith('xl/media/')]) == 1
+        if placement == 'cell':
+            assert {'xl/metadata.xml', 'xl/richData/rdrichvalue.xml', 'xl/richData/richValueRel.xml',
+                    'xl/richData/_rels/richValueRel.xml.rels'} <= names
+            assert sheet.count('t="e" vm="1"><v>#VALUE!</v>') == 2
+            assert zf.read('xl/richData/rdrichvalue.xml').count(b'<rv ') == 1
+            assert 'richvaluerel+xml' in content_types
+        else:
+            assert {'xl/cellimages.xml', 'xl/_rels/cellimages.xml.rels'} <= names
+            assert sheet.count('_xlfn.DISPIMG("ID_') == 2
+            assert zf.read('xl/cellimages.xml').count(b'<etc:cellImage>') == 1
+            assert 'cellimage+xml' in content_types
+
+    wb = openpyxl.load_workbook(result['out_file'])
+    try:
+        assert [c.value for c in wb.active[1]] == ['SKU', '图片', 'Pic']
+        assert wb.active.row_dimensions[2].height == 40
+    finally:
+        wb.close()
+
+
+def test_xlsx_images_read_anchors_from_drawings_without_openpyxl(tmp_path):
+    from openpyxl.drawing.image import Image as XlImage
+    from sheetpic import ExtractJob, _build_image_anchor_map, _load_sheet
+
+    path = tmp_path / 'pics.xlsx'
+    wb = openpyxl.Workbook()
+    other = wb.active
+    other.title = 'Other'
+    other['A1'] = 'nothing here'
+    ws = wb.create_sheet('Pics')
+    ws.append(['SKU', 'Photo'])
+    ws.append(['S1'])
+    ws.append(['S2'])
+    for anchor, size in (('B2', (12, 8)), ('B3', (20, 20))):
+        ws.add_image(XlImage(BytesIO(_jpeg_payload(size))), anchor)
+    wb.active = 1
+    wb.save(path)
+
+    loaded = _load_sheet(str(path))
+    try:
+        assert loaded['sheet'] == 'Pics'
+        assert loaded['sheet_names'] == ['Other', 'Pics']
+        assert sorted((img.row, img.col) for img in loaded['images']) == [(1, 1), (2, 1)]
+        assert loaded['book'].images('Other') == []
+
+        out_dir = tmp_path / 'out'
+        result = ExtractJob(df=loaded['df'], out_dir=str(out_dir), code_col_idx=0,
+                            image_map=_build_image_anchor_map(loaded['images'])).run()
+    finally:
+        loaded['book'].close()
+
+    assert result['success'] == 2
+    with PILImage.open(out_dir / 'S2.jpg') as img:
+        assert img.size == (20, 20)
+
+
+@pytest.mark.parametrize('placement', ['cell', 'wps'])
+def test_xlsx_images_resolve_in_cell_pictures(tmp_path, placement):
+    from sheetpic import ExtractJob, _XlsxStreamWriter, _build_image_anchor_map, _detect_image_columns, \
+        _count_anchor_columns, _load_sheet
+
+    path = tmp_path / 'cells.xlsx'
+    small, big = _jpeg_payload((12, 8)), _jpeg_payload((20, 20))
+    sink = _XlsxStreamWriter(str(path), placement=placement)
+    sink.write_row(1, {1: 'SKU', 2: 'Photo'})
+    sink.write_row(2, {1: 'S1'}, image=(small, 'a' * 64, 2))
+    sink.write_row(3, {1: 'S2'}, image=(big, 'b' * 64, 2))
+    sink.write_row(4, {1: 'S3'}, image=(small, 'a' * 64, 2))
+    sink.save()
+
+    loaded = _load_sheet(str(path))
+    try:
+        assert sorted((img.row, img.col) for img in loaded['images']) == [(1, 1), (2, 1), (3, 1)]
+        img_cols, _ = _detect_image_columns(loaded['df'], _count_anchor_columns(loaded['images']))
+        assert img_cols == [{'idx': 1, 'count': 3, 'type': 'embed'}]
+
+        out_dir = tmp_path / 'out'
+        result = ExtractJob(df=loaded['df'], out_dir=str(out_dir), code_col_idx=0, img_cols=img_cols,
+                            image_map=_build_image_anchor_map(loaded['images'])).run()
+    finally:
+        loaded['book'].close()
+
+    assert result['success'] == 3
+    with PILImage.open(out_dir / 'S2.jpg') as img:
+        assert img.size == (20, 20)
@@ -215,3 +215,44 @@ def test_duplicate_string_row_not_preferred():
         ['A3', 'Z', 3, 3.0],
     ])
     assert _score_header_row(data) == 1
+
+
+def test_cell_type_codes_match_cell_type():
+    import numpy as np
+    from sheetpic import _CELL_TYPE_CODES, _cell_type_codes
+
+    values = [None, float('nan'), '', '  ', 'hello', ' 1,234.5 ', '1_000', 'inf', 'nan', 'item 1',
+              'https://x/1.jpg', '//cdn/x.jpg', 'HTTP://X', 7, 2.5, True, dt.date(2024, 1, 1),
+              pd.Timestamp('2024-01-02'), pd.NaT, np.float64('nan'), np.int64(3), b'raw']
+    cells = np.array(values + [None] * 2, dtype=object).reshape(4, 6)
+
+    codes = _cell_type_codes(cells)
+
+    assert [int(c) for c in codes.ravel()] == [_CELL_TYPE_CODES[_cell_type(v)] for v in cells.ravel()]
+
+
+def test_wide_export_header_after_title():
+    """300-column export with a title row; every column has a label."""
+    n = 300
+    rows = [['商品导出 2024-05-01'] + [None] * (n - 1), [f'字段{i}' for i in range(n)]]
+    for r in range(20):
+        rows.append([f'SKU{r}'] + [r * 10 + c for c in range(1, n)])
+    assert _score_header_row(df(rows)) == 1
+
+
+def test_keyword_matchers_are_shared_by_header_and_sku_detection():
+    from sheetpic import SheetPicApp, _KeywordMatcher, _header_keyword_hit
+
+    matcher = _KeywordMatcher(['图', 'Bar Code', 'no.'], min_len=2, compact=True)
+    assert matcher.match('图')          # exact short keyword
+    assert not matcher.match('图片x')   # 1-char keywords only match exactly
+    assert matcher.match('商品barcode') and matcher.match('no.1')
+
+    assert _header_keyword_hit(' 商品主图 ')
+    assert not _header_keyword_hit('zzz')
+    assert SheetPicApp._score_sku_column_name('Bar Code') == 200
+    assert SheetPicApp._score_sku_column_name('商品 ID') == 100
+    assert SheetPicApp._score_sku_column_name('idea') == -1
+    assert SheetPicApp._score_sku_column_name('库位条码') == -1
+    assert SheetPicApp._is_code_like_column_name('EAN13')
+    assert not SheetPicApp._is_code_like_column_name('Unnamed: 2')
@@ -180,8 +180,30 @@ def test_url_library_import_keeps_extra_fields_for_ui_and_output():
     assert added == 4
     assert app.url_library_field_names == ['SKU', '条形码', '商品名称', '品牌']
     assert app.url_library_selected_fields == ['商品名称', '品牌']
-    assert app.url_library_records['S001']['商品名称'] == '杯子'
-    assert app.url_library_records['690002']['品牌'] == '方寸'
+    assert app._url_library_records()['S001']['商品名称'] == '杯子'
+    assert app._url_library_records()['690002']['品牌'] == '方寸'
+
+
+def test_url_library_entries_follow_row_order_and_skip_blank_codes():
+    from sheetpic import _url_library_entries
+
+    df = pd.DataFrame({
+        'SKU': ['S001', None, 'S003', 'X'],
+        '条码': [690001.0, 690001.0, float('nan'), 'S001'],
+        '价格': [1.5, float('nan'), 3.0, 4.0],
+        '图片': [' https://img.example.com/1.jpg ', '//img.example.com/2.jpg', 'nan', 'see http://img.example.com/4.jpg'],
+    })
+
+    codes, urls, records = _url_library_entries(df, [0, 1], 3, [(0, 'SKU'), (2, '价格')])
+
+    assert codes == ['S001', '690001', '690001', 'X', 'S001']
+    assert urls == [
+        'https://img.example.com/1.jpg', 'https://img.example.com/1.jpg', 'https://img.example.com/2.jpg',
+        'http://img.example.com/4.jpg', 'http://img.example.com/4.jpg',
+    ]
+    assert records[0] is records[1]
+    assert records[2] == {'SKU': '', '价格': ''}
+    assert dict(zip(codes, records))['S001'] == {'SKU': 'X', '价格': 4.0}
 
 
 def test_url_library_auto_selects_matching_barcode_column():
@@ -206,6 +228,51 @@ def test_url_library_auto_selects_matching_barcode_column():
     assert app.embed_sku_col_idx == 2
 
 
+def test_normalize_lookup_codes_matches_scalar_normalizer():
+    import datetime
+    from sheetpic import _normalize_lookup_code, _normalize_lookup_codes
+
+    columns = [
+        pd.Series([690001.0, 1.5, float('nan'), -3.0, 1e20, 0.1]),
+        pd.Series([690001, -2, 0]),
+        pd.Series([' 690001 ', '690002.00', 'NaN', 'none', None, 690003, 4.0, 2.5,
+                   True, datetime.date(2024, 1, 2), '1.50', '']),
+        pd.Series([' 12.00 ', '12.', '1.2.0', 'a1.0', 'NONE', 'nan1', '100', '७.0', '']),
+    ]
+    for column in columns:
+        assert list(_normalize_lookup_codes(column)) == [_normalize_lookup_code(v) for v in column]
+
+
+def test_best_url_library_match_col_idx_counts_normalized_hits():
+    from sheetpic import _best_url_library_match_col_idx
+
+    df = pd.DataFrame({
+        '编号': [690001.0, 690002.0, None],
+        '条码': ['690001', '690002.0', ' 690003 '],
+        '名称': ['a', 'b', 'c'],
+    })
+    library = {'690001': 'u1', '690002': 'u2', '690003': 'u3'}
+
+    assert _best_url_library_match_col_idx(df, library) == 1
+    assert _best_url_library_match_col_idx(df.iloc[:, [0, 2]], library) == 0
+    assert _best_url_library_match_col_idx(df[['名称']], library) is None
+
+
+def test_best_url_library_match_col_idx_is_not_fooled_by_the_sample(monkeypatch):
+    import sheetpic
+
+    monkeypatch.setattr(sheetpic, 'URL_LIBRARY_MATCH_SAMPLE_ROWS', 2)
+    df = pd.DataFrame({
+        '名称': ['1', '2', 'x', 'x', 'x'],
+        '编号': ['x', 'x', '3', '4', '5'],
+        '条码': ['1', '2', '3', '4', 'x'],
+    })
+    library = {str(i): f'u{i}' for i in range(1, 6)}
+
+    # 名称 and 条码 tie on the sample; counting every row, 条码 wins
+    assert sheetpic._best_url_library_match_col_idx(df, library) == 2
+
+
 def test_embed_sku_default_prefers_barcode_and_syncs_index():
     df = pd.DataFrame({
         '组合': ['货架组合1', None],
@@ -249,3 +316,188 @@ def test_real_user_file_qinrun(tmp_path):
     assert app.sorted_img_cols, 'image column must be detected'
     assert app.sorted_img_cols[0]['idx'] == 0
     assert app.sorted_img_cols[0]['count'] == 3
+
+
+def test_read_excel_sheet_parses_once_and_matches_read_excel(tmp_path, monkeypatch):
+    import sheetpic
+
+    rows = [
+        ['供应商商品列表', None, None, None, None],
+        [None, None, None, None, None],
+        ['条码', '图片', '条码', None, '数量'],
+        ['00123', 'http://x/1.jpg', 'A', 1, 2.5],
+        [None, None, None, None, None],
+        ['456', 'http://x/2.jpg', 'B', None, 3],
+    ]
+    p = tmp_path / 'sheet.xlsx'
+    pd.DataFrame(rows).to_excel(p, header=False, index=False)
+    expected = pd.read_excel(p, header=2)
+
+    calls = []
+    real_read_excel = pd.read_excel
+    monkeypatch.setattr(sheetpic.pd, 'read_excel', lambda *a, **k: calls.append(k) or real_read_excel(*a, **k))
+
+    sheet = sheetpic._read_excel_sheet(str(p))
+
+    assert len(calls) == 1
+    assert sheet['header_row'] == 2
+    pd.testing.assert_frame_equal(sheet['df'], expected)
+
+
+def test_sheet_cache_reuses_parse_until_file_changes_and_evicts_by_size(tmp_path, monkeypatch):
+    import sheetpic
+
+    p = tmp_path / 'two.xlsx'
+    with pd.ExcelWriter(p) as writer:
+        pd.DataFrame({'SKU': ['A', 'B'], 'Pic': ['http://x/1.jpg', 'http://x/2.jpg']}).to_excel(
+            writer, sheet_name='One', index=False)
+        pd.DataFrame({'Code': ['C']}).to_excel(writer, sheet_name='Two', index=False)
+
+    calls = []
+    real_read_excel = pd.read_excel
+    monkeypatch.setattr(sheetpic.pd, 'read_excel', lambda *a, **k: calls.append(k) or real_read_excel(*a, **k))
+
+    first = sheetpic._read_excel_sheet(str(p), 'One')
+    first['df'].columns = ['renamed', 'cols']
+    sheetpic._read_excel_sheet(str(p), 'Two')
+    again = sheetpic._read_excel_sheet(str(p), 'One')
+    assert len(calls) == 2
+    assert list(again['df'].columns) == ['SKU', 'Pic']
+
+    os.utime(p, ns=(0, os.stat(p).st_mtime_ns + 10 ** 9))
+    sheetpic._read_excel_sheet(str(p), 'One')
+    assert len(calls) == 3
+
+    cache = sheetpic._SheetCache(max_bytes=100)
+    cache.put('a', 1, 60)
+    cache.put('b', 2, 30)
+    assert cache.get('a') == 1  # 'b' is now least recently used
+    cache.put('c', 3, 30)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    cache.put('huge', 4, 101)
+    assert cache.get('huge') is None
+
+
+def test_reader_prefers_fast_engine_and_falls_back(tmp_path, monkeypatch):
+    import sheetpic
+
+    csv_path = tmp_path / 'lib.csv'
+    csv_path.write_text('SKU,Pic\nA,http://x/1.jpg\n', encoding='utf-8')
+    xlsx_path = tmp_path / 'lib.xlsx'
+    pd.DataFrame({'SKU': ['A'], 'Pic': ['http://x/1.jpg']}).to_excel(xlsx_path, index=False)
+    # Stand-ins: 'python' is a real read_csv engine, 'bogus' makes read_excel fail.
+    monkeypatch.setattr(sheetpic, '_FAST_READERS', {'excel': ('bogus', 'json'), 'csv': ('python', 'json')})
+
+    df, engine = sheetpic._read_csv(str(csv_path))
+    assert engine == 'python'
+    assert list(df.columns) == ['SKU', 'Pic']
+
+    sheet = sheetpic._read_excel_sheet(str(xlsx_path))
+    assert sheet['engine'] == 'openpyxl'
+    assert sheet['df'].iloc[0, 0] == 'A'
+
+    monkeypatch.setattr(sheetpic, '_reader_mode', sheetpic.READER_PANDAS)
+    assert sheetpic._read_csv(str(csv_path))[1] == 'c'
+
+
+def test_url_library_store_migrates_config_and_imports_only_changed_codes(tmp_path):
+    import json
+    from sheetpic import _UrlLibraryStore
+
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps({
+        'lang': 'en',
+        'url_library': {'A001': 'https://img.example.com/a.jpg', 690002.0: 'https://img.example.com/b.jpg'},
+        'url_library_records': {'A001': {'商品名称': '杯子'}},
+        'url_library_fields': ['商品名称'],
+        'url_library_selected_fields': ['商品名称'],
+    }), encoding='utf-8')
+    app = _build_app(pd.DataFrame({'x': [1]}))
+    app.CONFIG_PATH = str(config_path)
+    app.URL_LIBRARY_PATH = str(tmp_path / 'library.db')
+
+    assert dict(app._load_url_library().items()) == {'A001': 'https://img.example.com/a.jpg', '690002': 'https://img.example.com/b.jpg'}
+    assert app._url_library_records().fetch(['A001', '690002', 'B003']) == {'A001': {'商品名称': '杯子'}, '690002': {}}
+    assert app._load_url_library_fields() == ['商品名称']
+    assert json.loads(config_path.read_text(encoding='utf-8')) == {'lang': 'en'}
+
+    app.url_library = app._load_url_library()
+    app.url_library_field_names = ['商品名称']
+    app.url_library_selected_fields = []
+    new_rows = pd.DataFrame({
+        'SKU': ['A001', 'B003'],
+        '图片': ['https://img.example.com/a2.jpg', 'https://img.example.com/c.jpg'],
+    })
+    app._merge_url_library_from_df(new_rows)
+    assert app.url_library_import_counts == {'inserted': 1, 'updated': 1, 'unchanged': 0}
+    app._merge_url_library_from_df(new_rows)
+    assert app.url_library_import_counts == {'inserted': 0, 'updated': 0, 'unchanged': 2}
+    app._save_url_library()
+
+    store = _UrlLibraryStore(str(tmp_path / 'library.db'))
+    try:
+        assert len(store) == 3
+        assert store.lookup(['A001', 'B003', 'missing']) == {
+            'A001': ('https://img.example.com/a2.jpg', {'SKU': 'A001'}),
+            'B003': ('https://img.example.com/c.jpg', {'SKU': 'B003'}),
+        }
+        assert store.get_meta('url_library_fields') == ['商品名称', 'SKU']
+    finally:
+        store.close()
+    app._url_store.close()
+
+
+def test_url_table_behaves_like_the_dict_it_replaces():
+    from sheetpic import _UrlTable
+
+    table = _UrlTable([('690001', 'https://img.example.com/1.jpg'), ('S001', 'https://img.example.com/1.jpg')])
+    table.update([('条码-1', 'https://img.example.com/图.jpg'), ('690001', 'https://img.example.com/2.jpg'),
+                  ('9', 'https://img.example.com/9.jpg'), ('9', 'https://img.example.com/9b.jpg')])
+
+    assert len(table) == 4
+    assert dict(table.items()) == {
+        '690001': 'https://img.example.com/2.jpg',
+        'S001': 'https://img.example.com/1.jpg',
+        '条码-1': 'https://img.example.com/图.jpg',
+        '9': 'https://img.example.com/9b.jpg',
+    }
+    assert table.get('6900011') is None and table.get(None, 'x') == 'x'
+    assert '条码-1' in table and '条码' not in table
+    assert list(table.isin(['S001', 'S00', '690001'])) == [True, False, True]
+    with pytest.raises(KeyError):
+        table['missing']
+
+
+def test_url_table_keeps_oversized_codes_out_of_the_code_array():
+    from sheetpic import _UrlTable
+
+    long_code = 'X' * 5000
+    table = _UrlTable([(f'69000{i}', f'https://img.example.com/{i}.jpg') for i in range(100)])
+    table.update([(long_code, 'https://img.example.com/long.jpg'), ('a\x00', 'https://img.example.com/nul.jpg')])
+
+    assert table._codes.dtype.itemsize <= _UrlTable.CODE_WIDTH
+    assert len(table) == 102
+    assert table[long_code] == 'https://img.example.com/long.jpg'
+    assert table.get('a\x00') == 'https://img.example.com/nul.jpg' and 'a' not in table
+    assert list(table.isin([long_code, 'X' * 4999, '690007'])) == [True, False, True]
+    assert dict(table.items())[long_code] == 'https://img.example.com/long.jpg'
+
+
+def test_url_library_store_streams_urls_into_the_table(tmp_path, monkeypatch):
+    from sheetpic import _UrlLibraryStore, _UrlTable
+
+    store = _UrlLibraryStore(str(tmp_path / 'lib.db'))
+    monkeypatch.setattr(_UrlLibraryStore, 'LOAD_BATCH', 3)
+    entries = {f'69000{i}': f'https://img.example.com/{i % 4}.jpg' for i in range(10)}
+    entries.update({'条码-1': 'https://img.example.com/图.jpg', 'Y' * 40: 'https://img.example.com/y.jpg'})
+    try:
+        store.upsert([(code, url, {}) for code, url in entries.items()])
+        table = store.urls()
+    finally:
+        store.close()
+
+    assert isinstance(table, _UrlTable)
+    assert dict(table.items()) == entries
+    assert table._codes.tolist() == sorted(table._codes.tolist())
+    assert len(table._offsets) - 1 == 6  # shared urls are stored once
+    assert list(table.isin(['690003', 'Y' * 40, '69000'])) == [True, True, False]